@@ -0,0 +1,137 @@
+#! /usr/bin/env python3
+# Runs every query in `query_map` against synthetic JIRA data served by a
+# fake paginated client, reporting the wall time of each phase of a run and
+# the peak memory allocated by Python while running it.
+#
+#   python benchmarks/bench_queries.py [--issues N] [--latency SECONDS]
+
+import argparse
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mosaic.mosaic import (build_fetcher, build_queries,  # noqa: E402
+                           complete_query, render)
+from mosaic.queries import query_map  # noqa: E402
+
+from synthetic import FakeJiraClient, generate_issues  # noqa: E402
+
+QUERY_ARGUMENTS = {
+    'statusduration': 'In Progress',
+    'prioritycycletime': 'Major',
+    'forecast': '2019-03-31',
+}
+PHASES = ['plan', 'fetch', 'compute', 'render']
+
+
+def query_args(query, options):
+    return {
+        'server': 'https://jira.example.com',
+        'cert': None,
+        'project': 'BENCH',
+        'begin_date': '2018-01-01',
+        'end_date': '2018-12-31',
+        'end_state': 'Done',
+        'query': [query],
+        'query_argument': QUERY_ARGUMENTS.get(query),
+        'epoch': '2017-01-01',
+        'output': 'csv',
+        'percentiles': options.percentiles,
+        'fetch_workers': options.workers,
+        'page_size': options.page_size,
+        'stream': options.stream,
+    }
+
+
+# One run of a query split into the phases of `mosaic.mosaic.execute`,
+# returning the seconds spent in each of them.
+def run_query(query, options, issues):
+    client = FakeJiraClient(issues, latency=options.latency)
+    args = query_args(query, options)
+    timings = dict((phase, 0.0) for phase in PHASES)
+
+    start = time.perf_counter()
+    queries = build_queries(args, client)
+    fetcher = build_fetcher(args, client)
+    fetcher.plan(queries)
+    timings['plan'] = time.perf_counter() - start
+
+    if options.stream:
+        # Fetching and computing are interleaved page by page.
+        start = time.perf_counter()
+        fetcher.stream(queries)
+        timings['fetch'] = time.perf_counter() - start
+    else:
+        for built in queries:
+            start = time.perf_counter()
+            built.run(fetcher)
+            timings['fetch'] += time.perf_counter() - start
+            start = time.perf_counter()
+            complete_query(args, built)
+            timings['compute'] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    lines = list(render(args, queries))
+    timings['render'] = time.perf_counter() - start
+    return timings, client.requests, len(lines)
+
+
+def peak_memory(query, options, issues):
+    tracemalloc.start()
+    try:
+        run_query(query, options, issues)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    desc = 'Benchmark the mosaic queries against synthetic JIRA data'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--issues', type=int, default=5000)
+    parser.add_argument('--transitions', type=int, default=6)
+    parser.add_argument('--epics', type=int, default=20)
+    parser.add_argument('--priorities', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds the fake server takes per page')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--percentiles', default=None)
+    parser.add_argument('--stream', action='store_true', default=False)
+    parser.add_argument('-q', '--query', action='append',
+                        choices=sorted(query_map.keys()),
+                        help='Only benchmark these queries')
+    options = parser.parse_args()
+    logging.getLogger('mosaic').setLevel(logging.WARNING)
+
+    issues = generate_issues(options.issues, options.transitions,
+                             epics=options.epics,
+                             priorities=options.priorities)
+    print('{0} issues, {1} transitions each, {2:g}s latency per page'.format(
+        options.issues, options.transitions, options.latency))
+    header = '{:<20} {:>6} {:>6} {:>9}' + ' {:>8}' * (len(PHASES) + 1)
+    print(header.format('query', 'pages', 'rows', 'peak MB', 'total',
+                        *PHASES))
+    row = '{:<20} {:>6} {:>6} {:>9.1f}' + ' {:>8.3f}' * (len(PHASES) + 1)
+    for query in options.query or sorted(query_map.keys()):
+        # The fastest of the repeats is reported for every phase.
+        best = None
+        for _ in range(options.repeat):
+            timings, requests, lines = run_query(query, options, issues)
+            if best is None:
+                best = timings
+            best = dict((phase, min(best[phase], timings[phase]))
+                        for phase in PHASES)
+        peak = peak_memory(query, options, issues) / float(2 ** 20)
+        print(row.format(query, requests, lines, peak,
+                         sum(best.values()),
+                         *[best[phase] for phase in PHASES]))
+
+
+if __name__ == '__main__':
+    main()
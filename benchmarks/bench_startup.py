@@ -0,0 +1,85 @@
+#! /usr/bin/env python3
+# Measures the startup cost of the mosaic command line: the cumulative
+# `python -X importtime` of the main entry point, the slowest modules it
+# pulls in, and the wall time of `mosaic --list` against a bare interpreter.
+#
+#   python benchmarks/bench_startup.py [--repeat N] [--top N]
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ENTRY_POINT = 'mosaic.mosaic'
+
+# Dependencies which should only be imported by the commands that use them.
+HEAVY_MODULES = ['jira', 'requests', 'yaml', 'numpy', 'aiohttp']
+
+
+def python(*arguments):
+    return subprocess.run([sys.executable] + list(arguments), cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+# The self and cumulative microseconds of every module imported by some
+# code, from the `-X importtime` report.
+def import_times(code):
+    result = python('-X', 'importtime', '-c', code)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def wall_time(repeat, *arguments):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        python(*arguments)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    desc = 'Benchmark the startup time of the mosaic command line'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10,
+                        help='How many of the slowest imports to list')
+    args = parser.parse_args()
+
+    # Modules the bare interpreter imports anyway (site hooks and the like)
+    # are not charged to mosaic.
+    interpreter = import_times('pass')
+    runs = [import_times('import ' + ENTRY_POINT)
+            for _ in range(args.repeat)]
+    best = dict((name, min(run[name] for run in runs if name in run))
+                for name in runs[0] if name not in interpreter)
+    print('import {0}: {1:.1f}ms in {2} modules'.format(
+        ENTRY_POINT, sum(own for own, _ in best.values()) / 1000.0,
+        len(best)))
+    print('heavy modules imported: {0}'.format(
+        ', '.join(name for name in HEAVY_MODULES if name in best) or 'none'))
+    print('')
+    print('{0:<40} {1:>10} {2:>10}'.format('slowest imports', 'self ms',
+                                           'total ms'))
+    slowest = sorted(best.items(), key=lambda item: item[1][0], reverse=True)
+    for name, (own, cumulative) in slowest[:args.top]:
+        print('{0:<40} {1:>10.1f} {2:>10.1f}'.format(name, own / 1000.0,
+                                                     cumulative / 1000.0))
+    print('')
+    bare = wall_time(args.repeat, '-c', 'pass')
+    listing = wall_time(args.repeat, '-m', ENTRY_POINT, '--list')
+    print('python -c pass          {0:8.1f}ms'.format(bare * 1000))
+    print('mosaic --list           {0:8.1f}ms'.format(listing * 1000))
+
+
+if __name__ == '__main__':
+    main()
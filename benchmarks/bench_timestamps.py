@@ -0,0 +1,92 @@
+#! /usr/bin/env python3
+# Compares the original strptime based `date_difference` with the cached
+# timestamp parser on JIRA style changelog timestamps.
+#
+#   python benchmarks/bench_timestamps.py [--issues N] [--repeat N]
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mosaic.queries.utils import date_difference  # noqa: E402
+from mosaic.timestamps import to_timestamp  # noqa: E402
+
+
+def strptime_date_difference(later_date, earlier_date, epoch):
+    try:
+        date_format = '%Y-%m-%dT%H:%M:%S'
+        later = datetime.datetime.strptime(later_date[0:19], date_format)
+        earlier = datetime.datetime.strptime(earlier_date[0:19], date_format)
+        if later.date() < epoch:
+            return float('-inf')
+        return (later - earlier).total_seconds() / float(60 * 60 * 24)
+    except ValueError:
+        date_format = '%Y-%m-%d'
+        later = datetime.datetime.strptime(later_date[0:10], date_format)
+        earlier = datetime.datetime.strptime(earlier_date[0:10], date_format)
+        if later.date() < epoch:
+            return float('-inf')
+        return (later - earlier).days
+
+
+def changelog_pairs(issues, transitions, seed=0):
+    # Each issue is compared against the end of the period and between its
+    # own transitions, the way the status duration and cycle time queries
+    # use them.
+    rnd = random.Random(seed)
+    start = datetime.datetime(2018, 1, 1)
+    pairs = []
+    for _ in range(issues):
+        moment = start + datetime.timedelta(minutes=rnd.randint(0, 525600))
+        stamps = []
+        for _ in range(transitions):
+            moment += datetime.timedelta(minutes=rnd.randint(1, 20000))
+            stamps.append(moment.strftime('%Y-%m-%dT%H:%M:%S.') +
+                          '{0:03d}+0000'.format(rnd.randint(0, 999)))
+        for earlier, later in zip(stamps, stamps[1:]):
+            pairs.append((later, earlier))
+        pairs.append(('2019-12-31', stamps[0]))
+    return pairs
+
+
+def main():
+    desc = 'Benchmark parsing of JIRA changelog timestamps'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--issues', type=int, default=5000)
+    parser.add_argument('--transitions', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    pairs = changelog_pairs(args.issues, args.transitions)
+    epoch = datetime.date(2017, 1, 1)
+
+    def legacy():
+        for later, earlier in pairs:
+            strptime_date_difference(later, earlier, epoch)
+
+    def cold():
+        to_timestamp.cache_clear()
+        for later, earlier in pairs:
+            date_difference(later, earlier, epoch)
+
+    def warm():
+        for later, earlier in pairs:
+            date_difference(later, earlier, epoch)
+
+    print('{0} timestamp differences'.format(len(pairs)))
+    baseline = None
+    for name, function in [('strptime', legacy), ('parser, cold cache', cold),
+                           ('parser, warm cache', warm)]:
+        best = min(timeit.repeat(function, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print('{0:<20} {1:8.3f}s {2:6.1f}x'.format(name, best,
+                                                   baseline / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# Synthetic JIRA data for the benchmarks.
+#
+# `generate_issues` builds raw search results shaped like the JIRA REST API's
+# (fields plus an expanded changelog) and `FakeJiraClient` serves them through
+# a paginated `search_issues`, optionally sleeping to simulate the latency of
+# a real server.
+
+import datetime
+import random
+import re
+import threading
+import time
+
+from mosaic.issues import EPIC_FIELD, POINTS_FIELD
+
+JIRA_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.000+0000'
+PRIORITIES = ['Blocker', 'Critical', 'Major', 'Minor', 'Trivial']
+TYPES = ['Bug', 'Story', 'Task']
+MAX_RESULTS = 100
+
+PRIORITY_CLAUSE = re.compile(r'priority in \(([^()]*)\)', re.I)
+KEY_CLAUSE = re.compile(r'^key in \(([^()]*)\)$', re.I)
+
+
+def _history(moment, from_status, to_status):
+    return {
+        'created': moment.strftime(JIRA_TIME_FORMAT),
+        'items': [{'field': 'status', 'fromString': from_status,
+                   'toString': to_status}],
+    }
+
+
+# The status changes of an issue moving through a To Do, In Progress,
+# Review, Done workflow, bouncing back from review now and then and padded
+# to roughly `transitions` changes.
+def _workflow(rnd, transitions, done):
+    steps = [('To Do', 'In Progress')]
+    if rnd.random() < 0.2:
+        steps = [('To Do', 'Next'), ('Next', 'In Progress')]
+    while len(steps) + 2 < transitions:
+        steps.extend([('In Progress', 'Review'), ('Review', 'In Progress')])
+    steps.append(('In Progress', 'Review'))
+    if done:
+        steps.append(('Review', 'Done'))
+    return steps
+
+
+def generate_issues(count, transitions=6, epics=20,
+                    priorities=len(PRIORITIES), seed=0,
+                    start=datetime.datetime(2018, 1, 1), days=365,
+                    done_ratio=0.8):
+    rnd = random.Random(seed)
+    priority_names = PRIORITIES[:priorities]
+    epic_keys = ['BENCH-E{0}'.format(epic) for epic in range(epics)]
+    issues = []
+    for number in range(count):
+        done = rnd.random() < done_ratio
+        created = start + datetime.timedelta(
+            minutes=rnd.randint(0, days * 24 * 60))
+        moment = created
+        histories = []
+        for from_status, to_status in _workflow(rnd, transitions, done):
+            moment += datetime.timedelta(minutes=rnd.randint(30, 6 * 24 * 60))
+            histories.append(_history(moment, from_status, to_status))
+        fields = {
+            'created': created.strftime(JIRA_TIME_FORMAT),
+            'resolutiondate': moment.strftime(JIRA_TIME_FORMAT)
+            if done else None,
+            'priority': {'name': rnd.choice(priority_names)},
+            'issuetype': {'name': rnd.choice(TYPES)},
+            EPIC_FIELD: rnd.choice(epic_keys) if rnd.random() < 0.9 else None,
+            POINTS_FIELD: rnd.choice([1.0, 2.0, 3.0, 5.0, 8.0, None]),
+            'status': {'name': 'Done' if done else 'Review',
+                       'statusCategory': {
+                           'name': 'Done' if done else 'In Progress'}},
+        }
+        issues.append({
+            'key': 'BENCH-{0}'.format(number + 1),
+            'fields': fields,
+            'changelog': {'histories': histories},
+        })
+    return issues
+
+
+# The error of a failed search, with its HTTP status like a JIRAError.
+class FakeJiraError(Exception):
+    def __init__(self, status_code, text):
+        super(FakeJiraError, self).__init__(text)
+        self.status_code = status_code
+
+
+# Serves the synthetic issues to searches. Searches for done issues get the
+# resolved ones and any other search the unresolved ones, narrowed down by a
+# `priority in (...)` clause if there is one, while `key in (...)` lookups
+# get the issues or epics named. Only the requested fields are returned,
+# every field when none are, and the changelog only when it is expanded,
+# like JIRA does. Like JIRA, a lookup naming an unknown key fails with a 400
+# unless the query is not validated.
+class FakeJiraClient(object):
+    def __init__(self, issues, latency=0.0, max_results=MAX_RESULTS):
+        self.done = [issue for issue in issues
+                     if issue['fields']['resolutiondate']]
+        self.in_progress = [issue for issue in issues
+                            if not issue['fields']['resolutiondate']]
+        self.issues = dict((issue['key'], issue) for issue in issues)
+        for issue in issues:
+            epic = issue['fields'].get(EPIC_FIELD)
+            if epic and epic not in self.issues:
+                self.issues[epic] = {'key': epic, 'fields': {
+                    'summary': 'Epic {0}'.format(epic),
+                    'status': {'name': 'In Progress'},
+                    'created': '2017-12-01T00:00:00.000+0000',
+                    'resolutiondate': None,
+                }, 'changelog': {'histories': []}}
+        self.latency = latency
+        self.max_results = max_results
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def matching(self, jql, validate_query=True):
+        match = KEY_CLAUSE.match(jql)
+        if match:
+            keys = [key.strip() for key in match.group(1).split(',')]
+            unknown = [key for key in keys if key not in self.issues]
+            if unknown and validate_query:
+                raise FakeJiraError(400, ("An issue with key '{0}' does not "
+                                          "exist for field 'key'.").format(
+                                              unknown[0]))
+            return [self.issues[key] for key in keys if key in self.issues]
+        if 'statusCategory = Done' in jql:
+            issues = self.done
+        else:
+            issues = self.in_progress
+        match = PRIORITY_CLAUSE.search(jql)
+        if match:
+            priorities = set(value.strip().strip('"\'').lower()
+                             for value in match.group(1).split(','))
+            issues = [issue for issue in issues
+                      if issue['fields']['priority']['name'].lower()
+                      in priorities]
+        return issues
+
+    def page_issue(self, issue, fields, expand):
+        result = {'key': issue['key']}
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        if not fields:
+            result['fields'] = issue['fields']
+        else:
+            result['fields'] = dict((field, issue['fields'].get(field))
+                                    for field in fields)
+        if expand and 'changelog' in expand:
+            result['changelog'] = issue['changelog']
+        return result
+
+    def search_issues(self, jql, startAt=0, maxResults=50,
+                      validate_query=True, fields=None, expand=None,
+                      json_result=True):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        issues = self.matching(jql, validate_query)
+        page_size = min(maxResults, self.max_results)
+        page = issues[startAt:startAt + page_size]
+        return {
+            'startAt': startAt,
+            'maxResults': page_size,
+            'total': len(issues),
+            'issues': [self.page_issue(issue, fields, expand)
+                       for issue in page],
+        }
@@ -0,0 +1,207 @@
+import asyncio
+import ssl
+
+from .details import open_details
+from .fetch import (DEFAULT_PAGE_SIZE, DEFAULT_RETRIES, DEFAULT_WORKERS,
+                    RETRY_STATUSES, IssueFetcher, normalize_jql, retry_delay)
+from .mosaic import build_queries, complete_query, create_client, log, report
+from .profiling import Profiler
+
+
+SEARCH_PATH = '/rest/api/2/search'
+
+
+class AsyncJiraError(Exception):
+    def __init__(self, response, text):
+        msg = 'JIRA search failed with status {status}: {text}'
+        super(AsyncJiraError, self).__init__(msg.format(
+            status=response.status, text=text))
+        self.status_code = response.status
+        self.response = response
+
+
+# A minimal asyncio JIRA client for the REST search endpoint.
+#
+# Requests share a pooled aiohttp session limited to `concurrency`
+# connections. JIRA is authenticated against by a blocking jira client
+# first (Kerberos negotiation is not available to aiohttp) and its session
+# cookies are reused, see `from_client`.
+class AsyncJiraClient(object):
+    def __init__(self, server, verify=True, cookies=None, headers=None,
+                 concurrency=DEFAULT_WORKERS):
+        self.server = server.rstrip('/')
+        self.verify = verify
+        self.cookies = cookies or {}
+        self.headers = headers or {}
+        self.concurrency = concurrency
+        self._session = None
+        self._semaphore = None
+
+    @classmethod
+    def from_client(cls, client, concurrency=DEFAULT_WORKERS):
+        options = getattr(client, '_options', {})
+        cookies = dict(client._session.cookies.items())
+        return cls(options['server'], verify=options.get('verify', True),
+                   cookies=cookies, concurrency=concurrency)
+
+    def _ssl(self):
+        if self.verify is False:
+            return False
+        if isinstance(self.verify, str):
+            return ssl.create_default_context(cafile=self.verify)
+        return None
+
+    def _get_session(self):
+        if self._session is None:
+            try:
+                import aiohttp
+            except ImportError:
+                raise Exception('The async mode requires the aiohttp package.')
+            connector = aiohttp.TCPConnector(limit=self.concurrency,
+                                             ssl=self._ssl())
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  cookies=self.cookies,
+                                                  headers=self.headers)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def search_issues(self, jql, startAt=0, maxResults=50, fields=None,
+                            expand=None):
+        session = self._get_session()
+        params = {'jql': jql, 'startAt': startAt, 'maxResults': maxResults}
+        if fields is not None:
+            params['fields'] = ','.join(fields)
+        if expand:
+            params['expand'] = expand
+        async with self._semaphore:
+            async with session.get(self.server + SEARCH_PATH,
+                                   params=params) as response:
+                if response.status >= 400:
+                    raise AsyncJiraError(response, await response.text())
+                return await response.json()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+async def search_page(client, jql, start, page_size, retries, log, **kwargs):
+    attempt = 0
+    while True:
+        try:
+            return await client.search_issues(jql, startAt=start,
+                                              maxResults=page_size, **kwargs)
+        except Exception as error:
+            status = getattr(error, 'status_code', None)
+            if status not in RETRY_STATUSES or attempt >= retries:
+                raise
+            delay = retry_delay(error, attempt)
+            log.debug(('Search page at {start} failed with status {status}, '
+                       'retrying in {delay} seconds').format(
+                           start=start, status=status, delay=delay))
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+async def search_pages(client, jql, log, page_size=DEFAULT_PAGE_SIZE,
+                       retries=DEFAULT_RETRIES, **kwargs):
+    first = await search_page(client, jql, 0, page_size, retries, log,
+                              **kwargs)
+    issues = list(first['issues'])
+    total = first.get('total', len(issues))
+    page_size = first.get('maxResults') or page_size
+    starts = list(range(len(issues), total, page_size)) if issues else []
+    pages = await asyncio.gather(*[
+        search_page(client, jql, start, page_size, retries, log, **kwargs)
+        for start in starts])
+    for page in pages:
+        issues.extend(page['issues'])
+    return issues
+
+
+# An IssueFetcher whose searches run as asyncio tasks. Every distinct search
+# becomes a single task that all the queries needing it await, and the
+# pages of all the searches are requested concurrently.
+class AsyncIssueFetcher(IssueFetcher):
+    def __init__(self, client, log, **kwargs):
+        super(AsyncIssueFetcher, self).__init__(client, log, **kwargs)
+        self.tasks = {}
+
+    def fetch_async(self, query_string):
+        jql = normalize_jql(query_string)
+        if jql not in self.tasks:
+            self.tasks[jql] = asyncio.ensure_future(self._fetch(jql))
+        return self.tasks[jql]
+
+    async def _fetch(self, jql):
+        if jql in self.derived:
+            source = self.derived[jql][0]
+            self.issues[jql] = self.derive(jql, await self.fetch_async(source))
+        else:
+            self.log.debug('Executing query: {0}'.format(jql))
+            self.profiler.count('searches')
+            raws = await search_pages(self.client, jql, self.log,
+                                      page_size=self.page_size,
+                                      retries=self.retries,
+                                      **self.search_args(jql))
+            self.profiler.count('issues', len(raws))
+            with self.profiler.phase('fetch.parse'):
+                self.issues[jql] = self.table.extend(raws)
+        return self.issues[jql]
+
+
+async def run_async(args, client=None, profiler=None):
+    profiler = profiler or Profiler()
+    if args.get('cache_dir') or args.get('offline', False):
+        raise Exception('The async mode does not support the issue cache.')
+    if args.get('stream'):
+        raise Exception('The async mode does not support the stream '
+                        'argument.')
+    workers = args.get('fetch_workers', DEFAULT_WORKERS)
+    if client is None:
+        client = AsyncJiraClient.from_client(create_client(args),
+                                             concurrency=workers)
+
+    queries = build_queries(args, client, profiler)
+    if any(query.resolves_epics for query in queries):
+        raise Exception('The async mode does not support looking up epics.')
+    fetcher = AsyncIssueFetcher(
+        client, log, workers=workers,
+        page_size=args.get('page_size', DEFAULT_PAGE_SIZE),
+        retries=args.get('fetch_retries', DEFAULT_RETRIES),
+        profiler=profiler)
+    fetcher.plan(queries)
+    details = open_details(args, queries)
+
+    # Each query's results are built as soon as its own searches land,
+    # while the searches of the other queries are still in flight.
+    async def complete(query):
+        with profiler.phase('fetch.search'):
+            await asyncio.gather(*[fetcher.fetch_async(query_string)
+                                   for query_string in query.queries.values()])
+        query.run(fetcher)
+        with profiler.phase('build_results'):
+            complete_query(args, query)
+
+    try:
+        await asyncio.gather(*[complete(query) for query in queries])
+    finally:
+        # The connection pool belongs to this event loop, an injected client
+        # opens a new one the next time it is used.
+        if hasattr(client, 'close'):
+            await client.close()
+        if details is not None:
+            details.close()
+
+    with profiler.phase('render'):
+        return report(args, queries)
+
+
+def run(args, client=None, profiler=None):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run_async(args, client=client,
+                                                 profiler=profiler))
+    finally:
+        loop.close()
@@ -0,0 +1,215 @@
+#! /usr/bin/env python3
+
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .mosaic import build_parser, ch, create_client, execute, formatter, log
+from .mosaic import render
+from .profiling import Profiler, profile_run
+
+
+DEFAULT_BATCH_WORKERS = 4
+
+# The authenticated JIRA clients of this process, one per server and
+# certificate bundle. Every job of a thread pool shares them, and each
+# process of a process pool authenticates once for all the jobs it runs.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(args):
+    if args.get('offline', False):
+        return None
+    key = (args['server'], args['cert'])
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = create_client(args)
+        return _clients[key]
+
+
+def job_name(job):
+    return job.get('name') or job['project']
+
+
+def load_jobs(path, defaults):
+    import yaml
+    with open(path, 'r') as f:
+        entries = yaml.safe_load(f) or []
+    if isinstance(entries, dict):
+        entries = entries.get('jobs', [])
+    jobs = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            entry = {'project': entry}
+        unknown = [key for key in entry
+                   if key not in defaults and key != 'name']
+        if unknown:
+            msg = 'Unknown settings for batch job {job}: {settings}'
+            raise Exception(msg.format(job=entry,
+                                       settings=', '.join(sorted(unknown))))
+        job = dict(defaults)
+        job.update(entry)
+        # YAML reads unquoted dates as dates, the queries expect them as
+        # the strings given on the command line.
+        for key, value in entry.items():
+            if isinstance(value, datetime.datetime):
+                value = value.date()
+            if isinstance(value, datetime.date):
+                job[key] = value.isoformat()
+        if isinstance(job['query'], str):
+            job['query'] = [job['query']]
+        jobs.append(job)
+    return jobs
+
+
+# The --details file of a job, named after the job so that the jobs of a
+# batch do not all write to the same file.
+def job_details(path, job):
+    root, extension = os.path.splitext(path)
+    return '{root}.{name}{extension}'.format(root=root, name=job_name(job),
+                                             extension=extension)
+
+
+def build_jobs(args):
+    defaults = dict(args)
+    for key in ('projects', 'jobs', 'batch_workers', 'batch_executor',
+                'output_file'):
+        defaults.pop(key)
+    jobs = load_jobs(args['jobs'], defaults) if args['jobs'] else []
+    for project in args['projects']:
+        jobs.append(dict(defaults, project=project))
+    details = set()
+    for job in jobs:
+        if not job.get('query'):
+            msg = 'Batch job {0} does not specify any queries.'
+            raise Exception(msg.format(job_name(job)))
+        if not job.get('details'):
+            continue
+        if job['details'] == args['details']:
+            job['details'] = job_details(args['details'], job)
+        if job['details'] in details:
+            msg = ('Several batch jobs write their details to {0}, give '
+                   'them distinct names.')
+            raise Exception(msg.format(job['details']))
+        details.add(job['details'])
+    return jobs
+
+
+# Runs a single job, returning its rendered output lines and how long it
+# took, or the error it failed with, along with the phases and counts its
+# profiler recorded. Jobs never raise so that one failing project does not
+# abort the rest of the batch.
+def run_job(job):
+    start = time.time()
+    profiler = Profiler()
+    try:
+        queries = execute(job, client=get_client(job), profiler=profiler)
+        with profiler.phase('render'):
+            lines = list(render(job, queries))
+    except Exception:
+        lines, error = None, traceback.format_exc()
+    else:
+        error = None
+    profile = (profiler.phases, profiler.counters)
+    return lines, time.time() - start, error, profile
+
+
+def run_batch(jobs, workers=DEFAULT_BATCH_WORKERS, executor='thread'):
+    if executor == 'process':
+        pool = ProcessPoolExecutor(max_workers=workers)
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    with pool:
+        return list(pool.map(run_job, jobs))
+
+
+def report_batch(jobs, results, out=None):
+    out = out or sys.stdout
+    failures = 0
+    for job, (lines, elapsed, error, _) in zip(jobs, results):
+        if error is not None:
+            failures += 1
+            msg = 'Job {name} failed after {elapsed:.1f}s:\n{error}'
+            log.error(msg.format(name=job_name(job), elapsed=elapsed,
+                                 error=error))
+            continue
+        log.info('Job {name} finished in {elapsed:.1f}s'.format(
+            name=job_name(job), elapsed=elapsed))
+        for line in lines:
+            out.write(line)
+            out.write('\n')
+    log.info('{done} of {total} jobs succeeded'.format(
+        done=len(jobs) - failures, total=len(jobs)))
+    return failures
+
+
+def parse_args():
+    desc = ('Calculate metrics from JIRA data for several projects or jobs '
+            'at once')
+    parser = build_parser(desc)
+    parser.add_argument('projects', nargs='*', default=[],
+                        help=('The JIRA projects to run the queries for, '
+                              'each as a job of its own'))
+    parser.add_argument('--jobs', default=None, metavar='FILE',
+                        help=('A YAML file listing jobs, each a mapping of '
+                              'settings (project, query, begin_date, ...) '
+                              'overriding the command line ones'))
+    parser.add_argument('--batch-workers', type=int,
+                        default=DEFAULT_BATCH_WORKERS,
+                        help='The number of jobs to run concurrently')
+    parser.add_argument('--batch-executor', default='thread',
+                        choices=['thread', 'process'],
+                        help=('Run the jobs on a pool of threads sharing one '
+                              'JIRA session, or of processes with a session '
+                              'each'))
+    return vars(parser.parse_args())
+
+
+def main():
+    args = parse_args()
+    if args['verbose']:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+
+    # The rows of every job are printed to stdout, so the progress of the
+    # batch is logged to stderr to keep it out of them.
+    log.removeHandler(ch)
+    status = logging.StreamHandler(sys.stderr)
+    status.setFormatter(formatter)
+    log.addHandler(status)
+
+    if args['use_async']:
+        log.error('The async mode is not supported in batch mode.')
+        sys.exit(1)
+    if args['profile_dump']:
+        log.error('The profile-dump argument is not supported in batch mode, '
+                  'cProfile only sees the thread it is started from.')
+        sys.exit(1)
+    jobs = build_jobs(args)
+    if not jobs:
+        log.error('You must specify at least one project or a jobs file.')
+        sys.exit(1)
+    with profile_run(args, Profiler()) as profiler:
+        results = run_batch(jobs, workers=args['batch_workers'],
+                            executor=args['batch_executor'])
+        for _, _, _, profile in results:
+            profiler.merge(*profile)
+        if args['output_file']:
+            with open(args['output_file'], 'w') as f:
+                failures = report_batch(jobs, results, f)
+        else:
+            failures = report_batch(jobs, results)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
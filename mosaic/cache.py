@@ -0,0 +1,566 @@
+import collections
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .fetch import IssueFetcher
+from .issues import raw_facts
+from .jql import IssueIndex, parse_jql
+from .profiling import carry_profiler
+
+
+CACHE_FILE = 'mosaic.sqlite'
+
+# JIRA only accepts minute precision for `updated` and interprets it in the
+# timezone of the authenticated user, so every incremental search overlaps
+# the previous one generously.
+SYNC_OVERLAP = datetime.timedelta(days=1)
+JQL_TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+# Changed issues are fetched in batches of this many keys, and changelogs
+# which were cut short in the search results are paged through this many
+# histories at a time.
+KEY_BATCH_SIZE = 100
+CHANGELOG_PAGE_SIZE = 100
+
+SCHEMA = [
+    ('CREATE TABLE IF NOT EXISTS issues ('
+     'server TEXT, project TEXT, key TEXT, raw TEXT, '
+     'changed INTEGER DEFAULT 0, '
+     'PRIMARY KEY (server, project, key))'),
+    ('CREATE TABLE IF NOT EXISTS syncs ('
+     'server TEXT, project TEXT, generation INTEGER, synced TEXT, '
+     'PRIMARY KEY (server, project))'),
+    ('CREATE TABLE IF NOT EXISTS searches ('
+     'server TEXT, project TEXT, jql TEXT, keys TEXT, '
+     'generation INTEGER, synced TEXT, '
+     'PRIMARY KEY (server, project, jql))'),
+    ('CREATE TABLE IF NOT EXISTS facts ('
+     'server TEXT, project TEXT, key TEXT, facts TEXT, '
+     'PRIMARY KEY (server, project, key))'),
+    ('CREATE TABLE IF NOT EXISTS versions ('
+     'server TEXT, project TEXT, key TEXT, updated TEXT, '
+     'PRIMARY KEY (server, project, key))'),
+    ('CREATE TABLE IF NOT EXISTS epics ('
+     'server TEXT, project TEXT, key TEXT, raw TEXT, fetched REAL, '
+     'PRIMARY KEY (server, project, key))'),
+    ('CREATE TABLE IF NOT EXISTS snapshots ('
+     'server TEXT, project TEXT, synced TEXT, '
+     'PRIMARY KEY (server, project))'),
+]
+
+
+def issue_updated(raw):
+    return (raw.get('fields') or {}).get('updated')
+
+
+def since(synced):
+    synced = datetime.datetime.strptime(synced, JQL_TIME_FORMAT)
+    return (synced - SYNC_OVERLAP).strftime(JQL_TIME_FORMAT)
+
+
+# A local store of issues and their changelogs for a single JIRA project.
+#
+# Every refresh bumps the project's sync generation and records it against
+# the issues JIRA reported as updated. Stored searches remember the
+# generation their membership was computed at, so only issues changed since
+# then need to be re-evaluated by JIRA.
+#
+# Once every issue of the project has been stored, a snapshot is recorded
+# and the refreshes keep it complete, dropping the issues which were deleted
+# or moved to another project, so searches can be answered from an
+# IssueIndex over the stored issues. The index is built once per process
+# and dropped whenever issues are stored.
+class IssueCache(object):
+    def __init__(self, directory, server, project):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.server = server
+        self.project = project
+        self.index = None
+        self.db = sqlite3.connect(os.path.join(directory, CACHE_FILE))
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def _key(self):
+        return (self.server, self.project)
+
+    def sync_state(self):
+        row = self.db.execute(
+            'SELECT generation, synced FROM syncs '
+            'WHERE server = ? AND project = ?', self._key()).fetchone()
+        if row is None:
+            return 0, None
+        return row
+
+    def set_sync_state(self, generation, synced):
+        self.db.execute(
+            'INSERT OR REPLACE INTO syncs VALUES (?, ?, ?, ?)',
+            self._key() + (generation, synced))
+        self.db.commit()
+
+    def snapshot(self):
+        row = self.db.execute(
+            'SELECT synced FROM snapshots WHERE server = ? AND project = ?',
+            self._key()).fetchone()
+        return None if row is None else row[0]
+
+    def set_snapshot(self, synced):
+        self.db.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)',
+                        self._key() + (synced,))
+        self.db.commit()
+
+    def store_issues(self, raws, generation=None):
+        self.index = None
+        rows = [self._key() + (raw['key'], json.dumps(raw)) for raw in raws]
+        self.db.executemany(
+            'INSERT OR IGNORE INTO issues (server, project, key, raw) '
+            'VALUES (?, ?, ?, ?)', rows)
+        self.db.executemany(
+            'UPDATE issues SET raw = ? '
+            'WHERE server = ? AND project = ? AND key = ?',
+            [(row[3],) + row[:3] for row in rows])
+        self.db.executemany(
+            'INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?)',
+            [self._key() + (raw['key'], issue_updated(raw)) for raw in raws])
+        self.db.executemany(
+            'INSERT OR REPLACE INTO facts VALUES (?, ?, ?, ?)',
+            [self._key() + (raw['key'], json.dumps(raw_facts(raw)))
+             for raw in raws])
+        if generation is not None:
+            self.db.executemany(
+                'UPDATE issues SET changed = ? '
+                'WHERE server = ? AND project = ? AND key = ?',
+                [(generation,) + row[:3] for row in rows])
+        self.db.commit()
+
+    def load_issues(self, keys):
+        raws = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            query = ('SELECT key, raw FROM issues WHERE server = ? AND '
+                     'project = ? AND key IN ({0})').format(placeholders)
+            for key, raw in self.db.execute(query,
+                                            self._key() + tuple(chunk)):
+                raws[key] = json.loads(raw)
+        return [raws[key] for key in keys if key in raws]
+
+    def all_issues(self):
+        return [json.loads(raw) for raw, in self.db.execute(
+            'SELECT raw FROM issues WHERE server = ? AND project = ? '
+            'ORDER BY rowid', self._key())]
+
+    def keys(self):
+        return [key for key, in self.db.execute(
+            'SELECT key FROM issues WHERE server = ? AND project = ? '
+            'ORDER BY rowid', self._key())]
+
+    # Forget issues, along with their membership of the stored searches.
+    def remove_issues(self, keys):
+        self.index = None
+        rows = [self._key() + (key,) for key in keys]
+        for table in ('issues', 'facts', 'versions'):
+            self.db.executemany(
+                'DELETE FROM {0} WHERE server = ? AND project = ? '
+                'AND key = ?'.format(table), rows)
+        removed = set(keys)
+        searches = self.db.execute(
+            'SELECT jql, keys FROM searches WHERE server = ? AND project = ?',
+            self._key()).fetchall()
+        self.db.executemany(
+            'UPDATE searches SET keys = ? '
+            'WHERE server = ? AND project = ? AND jql = ?',
+            [(json.dumps([key for key in json.loads(members)
+                          if key not in removed]),) + self._key() + (jql,)
+             for jql, members in searches])
+        self.db.commit()
+
+    def load_facts(self, keys):
+        facts = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            query = ('SELECT key, facts FROM facts WHERE server = ? AND '
+                     'project = ? AND key IN ({0})').format(placeholders)
+            for key, value in self.db.execute(query,
+                                              self._key() + tuple(chunk)):
+                facts[key] = json.loads(value)
+        return facts
+
+    # The stored epic lookups, with the time each was made.
+    def load_epics(self, keys):
+        epics = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            query = ('SELECT key, raw, fetched FROM epics WHERE server = ? '
+                     'AND project = ? AND key IN ({0})').format(placeholders)
+            for key, raw, fetched in self.db.execute(
+                    query, self._key() + tuple(chunk)):
+                epics[key] = (json.loads(raw), fetched)
+        return epics
+
+    def store_epics(self, raws, fetched):
+        self.db.executemany(
+            'INSERT OR REPLACE INTO epics VALUES (?, ?, ?, ?, ?)',
+            [self._key() + (raw['key'], json.dumps(raw), fetched)
+             for raw in raws])
+        self.db.commit()
+
+    def missing(self, keys):
+        present = set(raw['key'] for raw in self.load_issues(keys))
+        return [key for key in keys if key not in present]
+
+    def versions(self, keys):
+        versions = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            query = ('SELECT key, updated FROM versions WHERE server = ? AND '
+                     'project = ? AND key IN ({0})').format(placeholders)
+            versions.update(self.db.execute(query,
+                                            self._key() + tuple(chunk)))
+        return versions
+
+    def changed_since(self, generation):
+        return set(row[0] for row in self.db.execute(
+            'SELECT key FROM issues WHERE server = ? AND project = ? '
+            'AND changed > ?', self._key() + (generation,)))
+
+    def search(self, jql):
+        row = self.db.execute(
+            'SELECT keys, generation, synced FROM searches '
+            'WHERE server = ? AND project = ? AND jql = ?',
+            self._key() + (jql,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def store_search(self, jql, keys, generation, synced):
+        self.db.execute(
+            'INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?, ?)',
+            self._key() + (jql, json.dumps(keys), generation, synced))
+        self.db.commit()
+
+
+# An IssueCache kept in memory, for a long running process. Issues are held
+# as the decoded search results rather than serialized. The requests of
+# mosaic-server and its background refresh use it from several threads at
+# once. At most `max_searches` searches are kept, the least recently used
+# being forgotten first.
+class MemoryIssueCache(object):
+    def __init__(self, server, project, max_searches=None):
+        self.server = server
+        self.project = project
+        self.issues = {}
+        self.facts = {}
+        self.changed = {}
+        self.searches = collections.OrderedDict()
+        self.max_searches = max_searches
+        self.lock = threading.RLock()
+        self.generation = 0
+        self.synced = None
+        self.snapshotted = None
+        self.index = None
+        self.epics = {}
+
+    def sync_state(self):
+        return self.generation, self.synced
+
+    def set_sync_state(self, generation, synced):
+        self.generation, self.synced = generation, synced
+
+    def snapshot(self):
+        return self.snapshotted
+
+    def set_snapshot(self, synced):
+        self.snapshotted = synced
+
+    def store_issues(self, raws, generation=None):
+        facts = [raw_facts(raw) for raw in raws]
+        with self.lock:
+            self.index = None
+            for raw, issue_facts in zip(raws, facts):
+                self.issues[raw['key']] = raw
+                self.facts[raw['key']] = issue_facts
+                if generation is not None:
+                    self.changed[raw['key']] = generation
+
+    def load_issues(self, keys):
+        return [self.issues[key] for key in keys if key in self.issues]
+
+    def all_issues(self):
+        return list(self.issues.values())
+
+    def keys(self):
+        with self.lock:
+            return list(self.issues)
+
+    def remove_issues(self, keys):
+        removed = set(keys)
+        with self.lock:
+            self.index = None
+            for key in removed:
+                self.issues.pop(key, None)
+                self.facts.pop(key, None)
+                self.changed.pop(key, None)
+            for jql, (members, generation, synced) in list(
+                    self.searches.items()):
+                self.searches[jql] = ([key for key in members
+                                       if key not in removed],
+                                      generation, synced)
+
+    def load_facts(self, keys):
+        return dict((key, self.facts[key]) for key in keys
+                    if key in self.facts)
+
+    def load_epics(self, keys):
+        return dict((key, self.epics[key]) for key in keys
+                    if key in self.epics)
+
+    def store_epics(self, raws, fetched):
+        for raw in raws:
+            self.epics[raw['key']] = (raw, fetched)
+
+    def missing(self, keys):
+        return [key for key in keys if key not in self.issues]
+
+    def versions(self, keys):
+        return dict((key, issue_updated(self.issues[key]))
+                    for key in keys if key in self.issues)
+
+    def changed_since(self, generation):
+        with self.lock:
+            return set(key for key, changed in self.changed.items()
+                       if changed > generation)
+
+    def search(self, jql):
+        with self.lock:
+            if jql not in self.searches:
+                return None
+            self.searches.move_to_end(jql)
+            keys, generation, synced = self.searches[jql]
+        return list(keys), generation, synced
+
+    def store_search(self, jql, keys, generation, synced):
+        with self.lock:
+            self.searches[jql] = (list(keys), generation, synced)
+            self.searches.move_to_end(jql)
+            while (self.max_searches is not None and
+                   len(self.searches) > self.max_searches):
+                self.searches.popitem(last=False)
+
+    def stored_searches(self):
+        with self.lock:
+            return list(self.searches)
+
+
+class CachedIssueFetcher(IssueFetcher):
+    def __init__(self, client, log, cache, offline=False, local=False,
+                 **kwargs):
+        super(CachedIssueFetcher, self).__init__(client, log, **kwargs)
+        self.cache = cache
+        self.offline = offline
+        self.local = local
+        self.refreshed = offline
+
+    def now(self):
+        return datetime.datetime.now().strftime(JQL_TIME_FORMAT)
+
+    def refresh(self):
+        generation, synced = self.cache.sync_state()
+        started = self.now()
+        generation += 1
+        if synced is not None:
+            jql = 'PROJECT = {project} AND updated >= "{since}"'.format(
+                project=self.cache.project, since=since(synced))
+            self.log.debug('Refreshing issue cache: {0}'.format(jql))
+            listing = self.listing(jql)
+            self.log.debug('{0} issues were updated since the last '
+                           'refresh'.format(len(listing)))
+            self.update(listing, generation)
+            self.reconcile()
+        self.cache.set_sync_state(generation, started)
+        self.refreshed = True
+
+    # Drop the cached issues which were deleted or moved to another project.
+    # JIRA keeps no record of those, so every key of the project is listed
+    # and compared with the cached ones.
+    def reconcile(self):
+        jql = 'PROJECT = {0}'.format(self.cache.project)
+        present = set(raw['key'] for raw in self.search_raw(jql,
+                                                            fields='key'))
+        gone = [key for key in self.cache.keys() if key not in present]
+        if gone:
+            self.log.debug('{0} issues were deleted or moved since the last '
+                           'refresh'.format(len(gone)))
+            self.cache.remove_issues(gone)
+
+    # The key and `updated` timestamp of every issue matching a search,
+    # which is all that is needed to tell which cached issues are stale.
+    def listing(self, jql):
+        return [(raw['key'], issue_updated(raw))
+                for raw in self.search_raw(jql, fields=['updated'])]
+
+    # Bring the cache up to date with a listing. Only the issues which are
+    # not cached yet, or whose `updated` timestamp moved since they were,
+    # are fetched again along with their changelogs.
+    def update(self, listing, generation=None):
+        versions = self.cache.versions([key for key, _ in listing])
+        stale = [key for key, updated in listing
+                 if updated is None or versions.get(key) != updated]
+        self.profiler.count('changelogs_reused', len(listing) - len(stale))
+        self.fetch_issues(stale, generation)
+
+    def fetch_issues(self, keys, generation=None):
+        if not keys:
+            return
+        self.log.debug('Fetching {0} changed or missing issues'.format(
+            len(keys)))
+        batches = [keys[start:start + KEY_BATCH_SIZE]
+                   for start in range(0, len(keys), KEY_BATCH_SIZE)]
+
+        def fetch(batch):
+            jql = 'key in ({0})'.format(', '.join(batch))
+            raws = self.search_raw(jql, expand='changelog')
+            for raw in raws:
+                self.complete_changelog(raw)
+            return raws
+
+        if self.workers <= 1 or len(batches) == 1:
+            results = [fetch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(carry_profiler(fetch), batches))
+        for raws in results:
+            self.cache.store_issues(raws, generation)
+
+    # JIRA Cloud caps the changelog expanded into search results, reporting
+    # the real number of histories as its total. Issues with longer
+    # histories get theirs from the issue changelog endpoint instead, a page
+    # at a time.
+    def complete_changelog(self, raw):
+        changelog = raw.get('changelog') or {}
+        histories = changelog.get('histories') or []
+        if changelog.get('total', len(histories)) <= len(histories):
+            return
+        path = 'issue/{0}/changelog'.format(raw['key'])
+        complete = []
+        try:
+            while True:
+                page = self.client._get_json(path, params={
+                    'startAt': len(complete),
+                    'maxResults': CHANGELOG_PAGE_SIZE})
+                values = page.get('values') or []
+                complete.extend(values)
+                self.profiler.count('changelog_pages')
+                if (not values or page.get('isLast') or
+                        len(complete) >= page.get('total', len(complete))):
+                    break
+        except Exception as error:
+            self.log.debug(('The changelog of {key} could not be completed, '
+                            'keeping the first {count} histories: '
+                            '{error}').format(key=raw['key'],
+                                              count=len(histories),
+                                              error=error))
+            return
+        changelog.update(histories=complete, startAt=0,
+                         maxResults=len(complete), total=len(complete))
+
+    def fill(self, keys):
+        self.fetch_issues(self.cache.missing(keys))
+
+    # An index over every issue of the project, storing them all first if
+    # that was never done. None when offline without a snapshot.
+    def local_index(self):
+        if self.cache.snapshot() is None:
+            if self.offline:
+                return None
+            jql = 'PROJECT = {0}'.format(self.cache.project)
+            self.log.debug('Storing every issue of the project: {0}'.format(
+                jql))
+            started = self.now()
+            self.update(self.listing(jql))
+            self.cache.set_snapshot(started)
+        # The cache drops its index whenever it stores issues, which
+        # mosaic-server's refresh may do at any time.
+        index = self.cache.index
+        if index is None:
+            with self.profiler.phase('cache.index'):
+                index = IssueIndex(self.cache.project,
+                                   self.cache.all_issues())
+            self.cache.index = index
+        return index
+
+    # The keys of the issues matching a search evaluated locally, or None if
+    # it uses JQL the index can not answer.
+    def local_keys(self, jql):
+        clauses = parse_jql(jql)
+        if clauses is None:
+            return None
+        index = self.local_index()
+        if index is None:
+            return None
+        return index.evaluate(clauses)
+
+    # The keys of the issues matching a search, fetching it from JIRA if it
+    # was never cached and re-evaluating the issues changed since it was.
+    # The issues themselves are left in the cache.
+    def search_keys(self, jql):
+        if not self.refreshed:
+            self.refresh()
+        if self.local:
+            keys = self.local_keys(jql)
+            if keys is not None:
+                self.log.debug('Evaluated query locally: {0}'.format(jql))
+                self.profiler.count('local_searches')
+                return keys
+        generation = self.cache.sync_state()[0]
+        cached = self.cache.search(jql)
+
+        if cached is None:
+            self.profiler.count('cache_misses')
+            if self.offline:
+                msg = ('The query "{0}" has not been cached yet. Run it '
+                       'once without --offline to populate the '
+                       'cache.').format(jql)
+                raise Exception(msg)
+            self.log.debug('Executing query: {0}'.format(jql))
+            listing = self.listing(jql)
+            self.update(listing)
+            keys = [key for key, _ in listing]
+            self.cache.store_search(jql, keys, generation, self.now())
+            return keys
+
+        self.profiler.count('cache_hits')
+        keys, searched_generation, synced = cached
+        if not self.offline and searched_generation < generation:
+            # Issues changed since the search was stored may have entered or
+            # left its result set, so ask JIRA which of them match it now.
+            changed = self.cache.changed_since(searched_generation)
+            delta = '({jql}) AND updated >= "{since}"'.format(
+                jql=jql, since=since(synced))
+            self.log.debug('Executing query: {0}'.format(delta))
+            matching = [raw['key']
+                        for raw in self.search_raw(delta, fields='key')]
+            keys = [key for key in keys if key not in changed]
+            members = set(keys)
+            keys.extend(key for key in matching if key not in members)
+            self.fill(keys)
+            self.cache.store_search(jql, keys, generation, self.now())
+        return keys
+
+    def search(self, jql):
+        keys = self.search_keys(jql)
+        self.log.debug('Answering query from the issue cache: {0}'.format(jql))
+        with self.profiler.phase('cache.load'):
+            raws = self.cache.load_issues(keys)
+            facts = self.cache.load_facts(keys)
+        with self.profiler.phase('fetch.parse'):
+            return self.table.extend(raws, facts)
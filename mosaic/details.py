@@ -0,0 +1,101 @@
+import csv
+import json
+
+
+# Every query writes the same columns, one row per issue and metric, so the
+# results of several queries and periods can be loaded as a single table.
+DETAIL_COLUMNS = ['query', 'begin_date', 'end_date', 'key', 'metric',
+                  'qualifier', 'value']
+
+# The columnar formats are written a row group of this many rows at a time.
+ROW_GROUP_SIZE = 65536
+
+
+# Writes the per-issue values computed by the queries to a file as the
+# queries compute them. `write` takes a batch of rows as a dict of equally
+# long column lists.
+class CsvDetailWriter(object):
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(DETAIL_COLUMNS)
+
+    def write(self, columns):
+        self.writer.writerows(zip(*[columns[name]
+                                    for name in DETAIL_COLUMNS]))
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesDetailWriter(object):
+    def __init__(self, path):
+        self.file = open(path, 'w')
+
+    def write(self, columns):
+        for row in zip(*[columns[name] for name in DETAIL_COLUMNS]):
+            self.file.write(json.dumps(dict(zip(DETAIL_COLUMNS, row))))
+            self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+
+# Buffers the rows into row groups for a pyarrow table writer, either a
+# Parquet file or an Arrow IPC file.
+class ArrowDetailWriter(object):
+    def __init__(self, path, file_format):
+        try:
+            import pyarrow
+        except ImportError:
+            raise Exception(('The {0} details format requires the pyarrow '
+                             'package.').format(file_format))
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [(name, pyarrow.string()) for name in DETAIL_COLUMNS[:-1]] +
+            [('value', pyarrow.float64())])
+        if file_format == 'parquet':
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            import pyarrow.ipc
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+        self.buffered = dict((name, []) for name in DETAIL_COLUMNS)
+
+    def write(self, columns):
+        for name in DETAIL_COLUMNS:
+            self.buffered[name].extend(columns[name])
+        if len(self.buffered['key']) >= ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.buffered['key']:
+            return
+        table = self.pyarrow.Table.from_pydict(self.buffered,
+                                               schema=self.schema)
+        self.writer.write_table(table)
+        self.buffered = dict((name, []) for name in DETAIL_COLUMNS)
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+detail_formats = {
+    'csv': CsvDetailWriter,
+    'jsonl': JsonLinesDetailWriter,
+    'parquet': lambda path: ArrowDetailWriter(path, 'parquet'),
+    'arrow': lambda path: ArrowDetailWriter(path, 'arrow'),
+}
+
+
+# Open the --details file, if one was asked for, and have the queries write
+# their per-issue values to it. The caller closes the returned writer.
+def open_details(args, queries):
+    if not args.get('details'):
+        return None
+    writer = detail_formats[args.get('details_format', 'csv')](
+        args['details'])
+    for query in queries:
+        query.details = writer
+    return writer
@@ -0,0 +1,236 @@
+import numpy
+
+from .issues import MISSING
+from .timestamps import SECONDS_PER_DAY
+
+
+# Vectorized metric calculations over an IssueTable.
+#
+# Every function takes a list of IssueRecords belonging to the same table and
+# returns one value per record, in the same order, computed with array
+# operations over the table's columns and its status-transition table rather
+# than by walking each issue's changelog in Python.
+#
+# The queries import this module when they first compute a metric, which
+# keeps NumPy off the startup path of commands such as --list.
+
+def column(values, dtype=numpy.int64):
+    # Copy rather than view the array.array, a buffer that is being exported
+    # cannot be appended to by later searches.
+    return numpy.array(values, dtype=dtype)
+
+
+def rows_of(issues):
+    return numpy.fromiter((issue.index for issue in issues),
+                          dtype=numpy.int64, count=len(issues))
+
+
+def days_between(later, earlier, epoch, date_only=False):
+    if date_only is True:
+        date_only = numpy.ones(len(later), dtype=bool)
+    elif date_only is False:
+        date_only = numpy.zeros(len(later), dtype=bool)
+    whole_days = (later // SECONDS_PER_DAY -
+                  earlier // SECONDS_PER_DAY).astype(numpy.float64)
+    days = (later - earlier) / float(SECONDS_PER_DAY)
+    days = numpy.where(date_only, whole_days, days)
+    return numpy.where(later < epoch, -numpy.inf, days)
+
+
+def _transitions(table):
+    return (column(table.transition_from), column(table.transition_to),
+            column(table.transition_timestamps))
+
+
+def _status_code(table, status):
+    return table.status_codes.get(status, -1)
+
+
+def lead_times(issues, epoch):
+    if not issues:
+        return numpy.zeros(0)
+    table = issues[0].table
+    rows = rows_of(issues)
+    created = column(table.created)[rows]
+    resolved = column(table.resolved)[rows]
+    days = days_between(resolved, created, epoch)
+    return numpy.where((resolved == MISSING) | (created == MISSING),
+                       numpy.nan, days)
+
+
+# The timestamp of each issue's last status change out of "To Do" (other
+# than to "Next") or out of "Next" (other than back to "To Do"), or MISSING.
+def cycle_start_dates(issues):
+    if not issues:
+        return numpy.zeros(0, dtype=numpy.int64)
+    return column(issues[0].table.cycle_starts)[rows_of(issues)]
+
+
+# Cycle times in days, or nan for issues that were never started or have no
+# resolution date.
+def cycle_times(issues, epoch):
+    if not issues:
+        return numpy.zeros(0)
+    table = issues[0].table
+    starts = cycle_start_dates(issues)
+    resolved = column(table.resolved)[rows_of(issues)]
+    days = days_between(resolved, starts, epoch)
+    return numpy.where((starts == MISSING) | (resolved == MISSING),
+                       numpy.nan, days)
+
+
+# The time between each issue first entering `status` and last leaving it,
+# clipped to `period_end`. Issues that never entered the status get -1.
+def times_in_status(issues, status, period_end, epoch):
+    if not issues:
+        return numpy.zeros(0)
+    table = issues[0].table
+    rows = rows_of(issues)
+
+    # Every issue has at most one visit row per status, so the rows of the
+    # status scatter straight into per issue columns.
+    first_entry = numpy.full(len(table), MISSING, dtype=numpy.int64)
+    last_exit = numpy.full(len(table), MISSING, dtype=numpy.int64)
+    visits = column(table.visit_statuses) == _status_code(table, status)
+    owners = column(table.visit_issues)[visits]
+    first_entry[owners] = column(table.visit_entries)[visits]
+    last_exit[owners] = column(table.visit_exits)[visits]
+    first_entry, last_exit = first_entry[rows], last_exit[rows]
+
+    never_entered = first_entry == MISSING
+    end = numpy.where(last_exit != MISSING, last_exit, period_end)
+    clipped = end >= period_end
+    end = numpy.where(clipped, period_end, end)
+    begin = numpy.where(never_entered, end, first_entry)
+    days = days_between(end, begin, epoch, date_only=clipped)
+    return numpy.where(never_entered, -1.0, days)
+
+
+# The first time each issue changed to `status`, compared without case, at
+# or after `begin` and before `end`, or MISSING if it did not.
+def entry_times(issues, status, begin, end):
+    if not issues:
+        return numpy.zeros(0, dtype=numpy.int64)
+    table = issues[0].table
+    status = status.strip('"\'').lower()
+    codes = [code for name, code in table.status_codes.items()
+             if name is not None and name.lower() == status]
+    _, to_status, timestamps = _transitions(table)
+    entered = (numpy.isin(to_status, codes) & (timestamps >= begin) &
+               (timestamps < end))
+    never = numpy.iinfo(numpy.int64).max
+    first = numpy.full(len(table), never, dtype=numpy.int64)
+    numpy.minimum.at(first, column(table.transition_issues)[entered],
+                     timestamps[entered])
+    first = first[rows_of(issues)]
+    return numpy.where(first == never, MISSING, first)
+
+
+# The number of the issues in each status at the end of every day from
+# `begin` to `end`, as a (days x statuses) array whose columns are the
+# table's status codes. Issues enter their first status when they are
+# created, in the source status of their first transition or their current
+# status if they never changed, and each transition is a -1 event for its
+# source status and a +1 event for its target. The events are bucketed by
+# the day they happened on and swept once with a cumulative sum, rather
+# than replaying every changelog for every day. Events before `begin` count
+# towards the first day.
+def daily_status_counts(issues, begin, end):
+    days = max(int(-(-(end - begin) // SECONDS_PER_DAY)), 1)
+    if not issues:
+        return numpy.zeros((days, 0), dtype=numpy.int64)
+    table = issues[0].table
+    rows = rows_of(issues)
+    selected = numpy.zeros(len(table), dtype=bool)
+    selected[rows] = True
+    from_status, to_status, timestamps = _transitions(table)
+    moves = selected[column(table.transition_issues)]
+
+    offsets = column(table.transition_offsets)
+    first = offsets[rows]
+    changed = offsets[rows + 1] > first
+    initial = numpy.where(
+        changed, numpy.append(from_status, -1)[first],
+        column(table.current_statuses)[rows])
+
+    boundaries = begin + SECONDS_PER_DAY * numpy.arange(1, days + 1)
+    created = column(table.created)[rows]
+    created_days = numpy.where(
+        created == MISSING, 0,
+        numpy.searchsorted(boundaries, created, side='right'))
+    move_days = numpy.searchsorted(boundaries, timestamps[moves],
+                                   side='right')
+
+    codes = numpy.concatenate((initial, to_status[moves], from_status[moves]))
+    deltas = numpy.concatenate((numpy.ones(len(rows), dtype=numpy.int64),
+                                numpy.ones(len(move_days), dtype=numpy.int64),
+                                -numpy.ones(len(move_days),
+                                            dtype=numpy.int64)))
+    event_days = numpy.concatenate((created_days, move_days, move_days))
+    counted = (event_days < days) & (codes >= 0)
+    counts = numpy.zeros((days, len(table.statuses)), dtype=numpy.int64)
+    numpy.add.at(counts, (event_days[counted], codes[counted]),
+                 deltas[counted])
+    return numpy.cumsum(counts, axis=0)
+
+
+# The codes of the statuses the issues were ever in, as recorded by their
+# transitions or their current status, in ascending order.
+def statuses_seen(issues):
+    if not issues:
+        return numpy.zeros(0, dtype=numpy.int64)
+    table = issues[0].table
+    rows = rows_of(issues)
+    selected = numpy.zeros(len(table), dtype=bool)
+    selected[rows] = True
+    from_status, to_status, _ = _transitions(table)
+    moves = selected[column(table.transition_issues)]
+    codes = numpy.concatenate((column(table.current_statuses)[rows],
+                               from_status[moves], to_status[moves]))
+    return numpy.unique(codes[codes >= 0])
+
+
+# The days each issue spent in every status between `begin` and `end`,
+# summing repeated visits, as an (issues x statuses) array whose columns are
+# the table's status codes. Each transition opens a visit to its target
+# status which lasts until the issue's next transition, or until `end` for
+# the last one, and issues with a creation date spent the time up to their
+# first transition in its source status.
+def times_in_statuses(issues, begin, end):
+    if not issues:
+        return numpy.zeros((0, 0))
+    table = issues[0].table
+    result = numpy.zeros((len(issues), len(table.statuses)))
+    offsets = column(table.transition_offsets)
+    rows = rows_of(issues)
+    starts = offsets[rows]
+    counts = offsets[rows + 1] - starts
+    if not counts.any():
+        return result
+    from_codes, to_codes, timestamps = _transitions(table)
+
+    # The positions of the issues' transitions, grouped by issue.
+    ends = numpy.cumsum(counts)
+    owners = numpy.repeat(numpy.arange(len(issues)), counts)
+    positions = (numpy.arange(ends[-1]) -
+                 numpy.repeat(ends - counts, counts) +
+                 numpy.repeat(starts, counts))
+    visit_begin = timestamps[positions]
+    visit_end = numpy.append(visit_begin[1:], end)
+    last = ends[counts > 0] - 1
+    visit_end[last] = end
+
+    created = column(table.created)[rows]
+    first = (counts > 0) & (created != MISSING)
+    first_positions = starts[first]
+    owners = numpy.concatenate([owners, numpy.flatnonzero(first)])
+    codes = numpy.concatenate([to_codes[positions],
+                               from_codes[first_positions]])
+    visit_begin = numpy.concatenate([visit_begin, created[first]])
+    visit_end = numpy.concatenate([visit_end, timestamps[first_positions]])
+
+    visit_begin = numpy.clip(visit_begin, begin, end)
+    visit_end = numpy.clip(visit_end, begin, end)
+    days = numpy.maximum(visit_end - visit_begin, 0) / float(SECONDS_PER_DAY)
+    numpy.add.at(result, (owners, codes), days)
+    return result
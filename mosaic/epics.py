@@ -0,0 +1,67 @@
+import time
+
+from .cache import KEY_BATCH_SIZE
+from .issues import UNASSIGNED, field_name
+from .timestamps import to_timestamp
+
+
+# The fields looked up for every epic, and how many seconds they are reused
+# from the issue cache before being looked up again.
+EPIC_FIELDS = ['summary', 'status', 'created', 'resolutiondate']
+DEFAULT_EPIC_TTL = 24 * 60 * 60
+
+
+def epic_metadata(raw):
+    fields = raw.get('fields') or {}
+    created = fields.get('created')
+    resolved = fields.get('resolutiondate')
+    return {
+        'key': raw['key'],
+        'summary': fields.get('summary'),
+        'status': field_name(fields.get('status')),
+        'created': None if created is None else to_timestamp(created),
+        'resolved': None if resolved is None else to_timestamp(resolved),
+    }
+
+
+# Looks up the summary, status and dates of epics (or any parent issues) by
+# key. Every key not resolved yet in the run is looked up with one batched
+# `key in (...)` search. JIRA rejects the whole search if one of the keys
+# was deleted, moved or can not be viewed, unless the query is not
+# validated, so the lookups are not and such epics are simply not found.
+# With an issue cache, lookups are stored in it and reused by later runs
+# until they are older than `ttl` seconds; offline, stored lookups are used
+# whatever their age.
+class EpicResolver(object):
+    def __init__(self, fetcher, log, ttl=DEFAULT_EPIC_TTL, offline=False):
+        self.fetcher = fetcher
+        self.log = log
+        self.cache = getattr(fetcher, 'cache', None)
+        self.ttl = ttl
+        self.offline = offline
+        self.resolved = {}
+
+    # The metadata of each epic, or None for the epics which could not be
+    # found.
+    def resolve(self, keys):
+        keys = [key for key in keys if key and key != UNASSIGNED]
+        pending = sorted(set(key for key in keys if key not in self.resolved))
+        now = time.time()
+        if pending and self.cache is not None:
+            for key, (raw, fetched) in self.cache.load_epics(pending).items():
+                if self.offline or now - fetched <= self.ttl:
+                    self.resolved[key] = epic_metadata(raw)
+            pending = [key for key in pending if key not in self.resolved]
+        if pending and not self.offline:
+            self.log.debug('Looking up {0} epics'.format(len(pending)))
+            raws = []
+            for start in range(0, len(pending), KEY_BATCH_SIZE):
+                jql = 'key in ({0})'.format(
+                    ', '.join(pending[start:start + KEY_BATCH_SIZE]))
+                raws.extend(self.fetcher.search_raw(jql, fields=EPIC_FIELDS,
+                                                    validate_query=False))
+            if self.cache is not None:
+                self.cache.store_epics(raws, now)
+            for raw in raws:
+                self.resolved[raw['key']] = epic_metadata(raw)
+        return dict((key, self.resolved.get(key)) for key in keys)
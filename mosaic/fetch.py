@@ -0,0 +1,282 @@
+import collections
+import itertools
+import re
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .issues import IssueTable
+from .profiling import Profiler, carry_profiler
+
+
+# Clauses which can be evaluated against an already fetched issue rather than
+# by asking JIRA. A query that only differs from another planned query by
+# some of these clauses is answered by filtering the broader result set.
+LOCAL_CLAUSES = {
+    'priority': re.compile(r'^priority in \((?P<values>[^()]*)\)$', re.I),
+}
+
+
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_BACKOFF = 1.0
+
+
+def retry_delay(error, attempt):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        return RETRY_BACKOFF * 2 ** attempt
+
+
+def search_page(client, jql, start, page_size, retries, log, **kwargs):
+    attempt = 0
+    while True:
+        try:
+            return client.search_issues(jql, startAt=start,
+                                        maxResults=page_size,
+                                        json_result=True, **kwargs)
+        except Exception as error:
+            status = getattr(error, 'status_code', None)
+            if status not in RETRY_STATUSES or attempt >= retries:
+                raise
+            delay = retry_delay(error, attempt)
+            log.debug(('Search page at {start} failed with status {status}, '
+                       'retrying in {delay} seconds').format(
+                           start=start, status=status, delay=delay))
+            time.sleep(delay)
+            attempt += 1
+
+
+# Yields the pages of a search in order. At most `workers` pages are
+# requested ahead of the one being consumed, so only those are ever held.
+def iter_pages(client, jql, log, workers=DEFAULT_WORKERS,
+               page_size=DEFAULT_PAGE_SIZE, retries=DEFAULT_RETRIES,
+               **kwargs):
+    first = search_page(client, jql, 0, page_size, retries, log, **kwargs)
+    total = first.get('total', len(first['issues']))
+
+    # The server may cap the page size below what was asked for, so the
+    # remaining pages are laid out using the size it actually returned.
+    page_size = first.get('maxResults') or page_size
+    starts = (list(range(len(first['issues']), total, page_size))
+              if first['issues'] else [])
+    yield first['issues']
+    del first
+    if not starts:
+        return
+    log.debug('Fetching {total} issues in {pages} more pages'.format(
+        total=total, pages=len(starts)))
+
+    def fetch(start):
+        return search_page(client, jql, start, page_size, retries, log,
+                           **kwargs)['issues']
+
+    if workers <= 1:
+        for start in starts:
+            yield fetch(start)
+        return
+    fetch = carry_profiler(fetch)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        starts = iter(starts)
+        pending = collections.deque(
+            executor.submit(fetch, start)
+            for start in itertools.islice(starts, workers))
+        while pending:
+            page = pending.popleft().result()
+            for start in itertools.islice(starts, 1):
+                pending.append(executor.submit(fetch, start))
+            yield page
+
+
+def normalize_jql(query_string):
+    return re.sub(r'\s+', ' ', query_string).strip()
+
+
+def split_clauses(query_string):
+    if re.search(r'\bOR\b', query_string, re.I):
+        return None
+    return [clause.strip() for clause in
+            re.split(r'\s+AND\s+', query_string, flags=re.I)]
+
+
+def parse_values(values):
+    return set(value.strip().strip('"\'').lower()
+               for value in values.split(',') if value.strip())
+
+
+def local_filter(clause):
+    for field, pattern in LOCAL_CLAUSES.items():
+        match = pattern.match(clause)
+        if match:
+            return field, parse_values(match.group('values'))
+    return None
+
+
+def issue_matches(issue, filters):
+    for field, values in filters:
+        value = getattr(issue, field, None)
+        if value is None or value.lower() not in values:
+            return False
+    return True
+
+
+# Executes JIRA searches on behalf of a set of queries. Every distinct JQL
+# string is only sent to JIRA once per fetcher, and queries which are a local
+# filter of another planned query are derived from that query's results.
+class IssueFetcher(object):
+    def __init__(self, client, log, workers=DEFAULT_WORKERS,
+                 page_size=DEFAULT_PAGE_SIZE, retries=DEFAULT_RETRIES,
+                 profiler=None):
+        self.client = client
+        self.log = log
+        self.workers = workers
+        self.page_size = page_size
+        self.retries = retries
+        self.issues = {}
+        self.derived = {}
+        self.requirements = {}
+        self.table = IssueTable()
+        self.profiler = profiler or Profiler()
+
+    def require(self, jql, fields, changelog):
+        if jql not in self.requirements:
+            fields = None if fields is None else set(fields)
+            self.requirements[jql] = (fields, changelog)
+            return
+        current_fields, current_changelog = self.requirements[jql]
+        if current_fields is None or fields is None:
+            merged = None
+        else:
+            merged = current_fields | set(fields)
+        self.requirements[jql] = (merged, current_changelog or changelog)
+
+    def plan(self, queries):
+        # Issues with stored facts only get their transitions if a query
+        # reads them.
+        self.table.keep_transitions = any(query.needs_transitions
+                                          for query in queries)
+        planned = []
+        for query in queries:
+            self.table.add_group_fields(query.group_fields())
+            for query_string in query.queries.values():
+                jql = normalize_jql(query_string)
+                self.require(jql, query.fields, query.needs_changelog)
+                if jql not in planned:
+                    planned.append(jql)
+
+        clauses = dict((jql, split_clauses(jql)) for jql in planned)
+        for jql in planned:
+            if clauses[jql] is None:
+                continue
+            for other in planned:
+                if other == jql or clauses[other] is None:
+                    continue
+                if other in self.derived:
+                    continue
+                extra = [c for c in clauses[jql] if c not in clauses[other]]
+                missing = [c for c in clauses[other] if c not in clauses[jql]]
+                if not extra or missing:
+                    continue
+                filters = [local_filter(clause) for clause in extra]
+                if None in filters:
+                    continue
+                self.log.debug('Query "{0}" will be derived from "{1}"'.format(
+                    jql, other))
+                self.derived[jql] = (other, filters)
+                fields, changelog = self.requirements[jql]
+                if fields is not None:
+                    fields = fields | set(field for field, _ in filters)
+                self.require(other, fields, changelog)
+                break
+
+        self.log.debug('Planned {0} searches for {1} queries'.format(
+            len(planned) - len(self.derived), len(queries)))
+        return planned
+
+    def pages(self, jql, **kwargs):
+        self.profiler.count('searches')
+        for page in iter_pages(self.client, jql, self.log,
+                               workers=self.workers, page_size=self.page_size,
+                               retries=self.retries, **kwargs):
+            self.profiler.count('pages')
+            self.profiler.count('issues', len(page))
+            yield page
+
+    def search_raw(self, jql, **kwargs):
+        issues = []
+        with self.profiler.phase('fetch.search'):
+            for page in self.pages(jql, **kwargs):
+                issues.extend(page)
+        return issues
+
+    def search_args(self, jql):
+        # Queries which were not planned get every field and the changelog.
+        fields, changelog = self.requirements.get(jql, (None, True))
+        search_args = {}
+        if fields is not None:
+            # An empty field list is dropped from the request, and JIRA then
+            # returns every field, so only the key is asked for instead.
+            search_args['fields'] = sorted(fields) or ['key']
+        if changelog:
+            search_args['expand'] = 'changelog'
+        return search_args
+
+    def search(self, jql):
+        self.log.debug('Executing query: {0}'.format(jql))
+        raws = self.search_raw(jql, **self.search_args(jql))
+        with self.profiler.phase('fetch.parse'):
+            return self.table.extend(raws)
+
+    def derive(self, jql, issues):
+        filters = self.derived[jql][1]
+        return [issue for issue in issues if issue_matches(issue, filters)]
+
+    def fetch(self, query_string):
+        jql = normalize_jql(query_string)
+        if jql in self.issues:
+            self.log.debug('Reusing results for query: {0}'.format(jql))
+        elif jql in self.derived:
+            source = self.derived[jql][0]
+            self.issues[jql] = self.derive(jql, self.fetch(source))
+        else:
+            self.issues[jql] = self.search(jql)
+        return self.issues[jql]
+
+    # Feeds the searches of the queries to their `accumulate` methods one
+    # page at a time instead of fetching whole result sets. Every page gets
+    # an issue table of its own which is dropped once the queries, and any
+    # searches derived from it, have seen it.
+    def stream(self, queries):
+        subscribers = {}
+        for query in queries:
+            for name, query_string in query.queries.items():
+                jql = normalize_jql(query_string)
+                subscribers.setdefault(jql, []).append((query, name))
+
+        for query in queries:
+            query.start_results()
+        for jql in subscribers:
+            if jql in self.derived:
+                continue
+            self.log.debug('Streaming query: {0}'.format(jql))
+            for page in self.pages(jql, **self.search_args(jql)):
+                with self.profiler.phase('fetch.parse'):
+                    issues = IssueTable(self.table.group_labels).extend(page)
+                with self.profiler.phase('build_results'):
+                    self.dispatch(jql, issues, subscribers)
+        with self.profiler.phase('build_results'):
+            for query in queries:
+                query.finish_results()
+
+    def dispatch(self, jql, issues, subscribers):
+        for query, name in subscribers.get(jql, []):
+            query.accumulate(name, issues)
+        for derived, (source, _) in self.derived.items():
+            if source == jql:
+                self.dispatch(derived, self.derive(derived, issues),
+                              subscribers)
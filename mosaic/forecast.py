@@ -0,0 +1,93 @@
+import math
+
+import numpy
+
+from .timestamps import SECONDS_PER_DAY
+
+
+# Monte Carlo throughput forecasts.
+#
+# Every trial replays the future one day at a time, each day completing as
+# many issues as a day drawn at random from the historical daily
+# throughput. Trials are simulated together as arrays of sampled days, in
+# blocks bounded by BLOCK_SAMPLES so that long horizons do not hold every
+# sample at once. Like `mosaic.engine`, this module is only imported by the
+# queries which use it.
+
+BLOCK_SAMPLES = 2 ** 22
+
+# Forecasts of when a number of issues will be done give up after this many
+# days.
+MAX_FORECAST_DAYS = 10 * 365
+
+
+def generator(seed=None):
+    return numpy.random.default_rng(seed)
+
+
+# The number of issues completed on each day from `begin` to `end`,
+# including the days nothing was.
+def daily_throughput(timestamps, begin, end):
+    days = max(int((end - begin) // SECONDS_PER_DAY), 1)
+    offsets = (numpy.asarray(timestamps, dtype=numpy.int64) -
+               begin) // SECONDS_PER_DAY
+    offsets = offsets[(offsets >= 0) & (offsets < days)]
+    return numpy.bincount(offsets, minlength=days)
+
+
+def _sample(daily, rng, trials, days):
+    return daily[rng.integers(0, len(daily), size=(trials, days))]
+
+
+# The total number of issues each trial completes in `days` days.
+def simulate_totals(daily, days, trials, rng):
+    totals = numpy.zeros(trials, dtype=numpy.int64)
+    if days <= 0:
+        return totals
+    block = max(1, min(trials, BLOCK_SAMPLES // days))
+    for start in range(0, trials, block):
+        count = min(block, trials - start)
+        totals[start:start + count] = _sample(daily, rng, count,
+                                              days).sum(axis=1)
+    return totals
+
+
+# The number of days each trial takes to complete `items` issues, or inf for
+# the trials which do not within `max_days`.
+def simulate_days(daily, items, trials, rng, max_days=MAX_FORECAST_DAYS):
+    result = numpy.full(trials, numpy.inf)
+    if items <= 0:
+        result[:] = 0
+        return result
+    if not daily.any():
+        return result
+    done = numpy.zeros(trials, dtype=numpy.int64)
+    remaining = numpy.arange(trials)
+    day = 0
+    while len(remaining) and day < max_days:
+        days = min(max(1, BLOCK_SAMPLES // len(remaining)), max_days - day)
+        cumulative = (done[remaining][:, numpy.newaxis] +
+                      _sample(daily, rng, len(remaining), days).cumsum(axis=1))
+        finished = cumulative[:, -1] >= items
+        first = numpy.argmax(cumulative >= items, axis=1)
+        result[remaining[finished]] = day + first[finished] + 1
+        done[remaining] = cumulative[:, -1]
+        remaining = remaining[~finished]
+        day += days
+    return result
+
+
+def _rank(values, fraction):
+    ordered = numpy.sort(values)
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+# The outcome a share `confidence` percent of the trials did at least as
+# well as: the most issues completed, or the fewest days taken.
+def at_least(totals, confidence):
+    return int(_rank(totals, 1 - confidence / 100.0))
+
+
+def within(days, confidence):
+    value = _rank(days, confidence / 100.0)
+    return value if math.isinf(value) else int(value)
@@ -0,0 +1,53 @@
+from itertools import product
+
+from .issues import EPIC_FIELD, PARENT_FIELD, UNASSIGNED
+
+
+# The names results can be grouped by and the JIRA field each reads. Any
+# other name is taken to be a field id itself, such as customfield_10010.
+GROUP_FIELDS = {
+    'epic': EPIC_FIELD,
+    'priority': 'priority',
+    'type': 'issuetype',
+    'assignee': 'assignee',
+    'component': 'components',
+    'status': 'status',
+    'labels': 'labels',
+}
+
+# The groups an IssueTable records in columns of its own.
+TABLE_COLUMNS = {
+    'epic': 'epics',
+    'priority': 'priorities',
+    'type': 'types',
+}
+
+
+def group_field(name):
+    return GROUP_FIELDS.get(name, name)
+
+
+# The fields a grouping is read from. Issues without an epic link are
+# grouped by their parent issue instead.
+def group_source_fields(name):
+    if name == 'epic':
+        return [EPIC_FIELD, PARENT_FIELD]
+    return [group_field(name)]
+
+
+# The labels of the groups an issue belongs to. An issue with several
+# values in a field, such as components, is in the group of each of them.
+def issue_labels(issue, name):
+    table = issue.table
+    if name in TABLE_COLUMNS:
+        label = getattr(table, TABLE_COLUMNS[name])[issue.index]
+        return (UNASSIGNED if label is None else label,)
+    return table.group_labels[group_field(name)][issue.index]
+
+
+# The key of every group an issue belongs to across several groupings, a
+# tuple with one label per grouping.
+def group_keys(issue, groupings):
+    if len(groupings) == 1:
+        return [(label,) for label in issue_labels(issue, groupings[0])]
+    return list(product(*[issue_labels(issue, name) for name in groupings]))
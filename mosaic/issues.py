@@ -0,0 +1,277 @@
+from array import array
+
+from .timestamps import to_timestamp
+
+
+MISSING = -2 ** 63
+
+EPIC_FIELD = 'customfield_10006'
+POINTS_FIELD = 'customfield_10002'
+# Issues of team-managed projects, and sub-tasks, name the epic or issue
+# they belong to in the parent field rather than the epic link.
+PARENT_FIELD = 'parent'
+
+# The group of issues with no value in the field they are grouped by.
+UNASSIGNED = 'UNASSIGNED'
+
+# Bumped whenever `derive_facts` changes, so that facts persisted by an
+# earlier version are derived again rather than trusted.
+FACTS_VERSION = 2
+
+
+# The key of the epic, or else the parent issue, an issue belongs to.
+def epic_key(fields):
+    epic = fields.get(EPIC_FIELD)
+    if epic is None:
+        epic = (fields.get(PARENT_FIELD) or {}).get('key')
+    return epic
+
+
+def field_name(value):
+    if isinstance(value, dict):
+        return value.get('name')
+    return value
+
+
+# The labels of a field's value for grouping: one per item of a multi-value
+# field, and the name or value of objects such as users and options.
+def field_labels(value):
+    if isinstance(value, list):
+        labels = []
+        for item in value:
+            labels.extend(label for label in field_labels(item)
+                          if label not in labels and label != UNASSIGNED)
+        return labels or [UNASSIGNED]
+    if isinstance(value, dict):
+        for name in ('name', 'value', 'displayName', 'key'):
+            if value.get(name) is not None:
+                return [str(value[name])]
+        return [UNASSIGNED]
+    if value is None:
+        return [UNASSIGNED]
+    return [str(value)]
+
+
+# The (from, to, timestamp) status changes in a raw issue's changelog, in
+# changelog order.
+def status_changes(raw):
+    histories = (raw.get('changelog') or {}).get('histories') or []
+    for history in histories:
+        timestamp = None
+        for item in history.get('items') or []:
+            if item.get('field') != 'status':
+                continue
+            if timestamp is None:
+                timestamp = to_timestamp(history['created'])
+            yield item.get('fromString'), item.get('toString'), timestamp
+
+
+def _starts_cycle(from_status, to_status):
+    return ((from_status == 'To Do' and to_status != 'Next') or
+            (from_status == 'Next' and to_status != 'To Do'))
+
+
+# The facts the metrics need from an issue's status changes, derived once
+# when it is ingested rather than by every query:
+#
+# - cycle_start: the last change out of "To Do" (other than to "Next") or
+#   out of "Next" (other than back to "To Do"), or None.
+# - statuses: [status, first entry, last exit] for every status the issue
+#   was in, with None for a status it never entered or never left.
+def derive_facts(changes):
+    cycle_start = None
+    statuses = {}
+    for from_status, to_status, timestamp in changes:
+        if _starts_cycle(from_status, to_status):
+            cycle_start = timestamp
+        source = statuses.setdefault(from_status, [from_status, None, None])
+        source[2] = timestamp
+        target = statuses.setdefault(to_status, [to_status, None, None])
+        if target[1] is None:
+            target[1] = timestamp
+    return {'version': FACTS_VERSION, 'cycle_start': cycle_start,
+            'statuses': list(statuses.values())}
+
+
+def raw_facts(raw):
+    return derive_facts(status_changes(raw))
+
+
+# A compact, column oriented store for fetched issues.
+#
+# Each issue is a row across the column arrays, timestamps are kept as epoch
+# seconds and repeated strings (statuses, epics, priorities and types) are
+# interned so every row shares a single copy. Status changes from the
+# changelogs are flattened into a transition table which records the issue
+# row, the from and to status codes and the timestamp of each change, with
+# `transition_offsets` pointing at the first transition of every issue. The
+# current status of each issue is kept as a status code too, or -1 when the
+# search did not ask for it.
+#
+# The facts derived from each issue's changelog (see `derive_facts`) are
+# kept alongside: a cycle start column, and a visit table with one row per
+# issue and status holding its first entry and last exit. Unless
+# `keep_transitions` is set, issues added with valid facts get no
+# transitions, their changelogs are not even walked.
+#
+# Fields the results are grouped by (see `mosaic.groups`) get a column of
+# label tuples each, in `group_labels`.
+class IssueTable(object):
+    def __init__(self, group_fields=()):
+        self.keys = []
+        self.created = array('q')
+        self.resolved = array('q')
+        self.points = array('d')
+        self.epics = []
+        self.priorities = []
+        self.types = []
+        self.current_statuses = array('l')
+
+        self.statuses = []
+        self.status_codes = {}
+        self.transition_offsets = array('l', [0])
+        self.transition_issues = array('l')
+        self.transition_from = array('l')
+        self.transition_to = array('l')
+        self.transition_timestamps = array('q')
+
+        self.cycle_starts = array('q')
+        self.visit_issues = array('l')
+        self.visit_statuses = array('l')
+        self.visit_entries = array('q')
+        self.visit_exits = array('q')
+        self.keep_transitions = True
+
+        self.group_labels = {}
+        self._strings = {}
+        self.add_group_fields(group_fields)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def intern(self, value):
+        if value is None:
+            return None
+        return self._strings.setdefault(value, value)
+
+    def add_group_fields(self, fields):
+        for field in fields:
+            if field not in self.group_labels:
+                self.group_labels[field] = [(UNASSIGNED,)] * len(self.keys)
+
+    def status_code(self, status):
+        if status not in self.status_codes:
+            self.status_codes[status] = len(self.statuses)
+            self.statuses.append(self.intern(status))
+        return self.status_codes[status]
+
+    # Add a raw issue, with the facts derived from it if they are known
+    # already.
+    def add(self, raw, facts=None):
+        index = len(self.keys)
+        fields = raw.get('fields') or {}
+        self.keys.append(raw['key'])
+        self.created.append(self._timestamp(fields.get('created')))
+        self.resolved.append(self._timestamp(fields.get('resolutiondate')))
+        points = fields.get(POINTS_FIELD)
+        self.points.append(float('nan') if points is None else points)
+        self.epics.append(self.intern(epic_key(fields)))
+        self.priorities.append(self.intern(field_name(fields.get('priority'))))
+        self.types.append(self.intern(field_name(fields.get('issuetype'))))
+        status = field_name(fields.get('status'))
+        self.current_statuses.append(-1 if status is None
+                                     else self.status_code(status))
+        for field, labels in self.group_labels.items():
+            labels.append(tuple(self.intern(label)
+                                for label in field_labels(fields.get(field))))
+
+        valid = facts is not None and facts.get('version') == FACTS_VERSION
+        if self.keep_transitions or not valid:
+            changes = list(status_changes(raw))
+        if self.keep_transitions:
+            for from_status, to_status, timestamp in changes:
+                self.transition_issues.append(index)
+                self.transition_from.append(self.status_code(from_status))
+                self.transition_to.append(self.status_code(to_status))
+                self.transition_timestamps.append(timestamp)
+        self.transition_offsets.append(len(self.transition_timestamps))
+
+        if not valid:
+            facts = derive_facts(changes)
+        self._add_facts(index, facts)
+        return IssueRecord(self, index)
+
+    def _add_facts(self, index, facts):
+        self.cycle_starts.append(self._or_missing(facts['cycle_start']))
+        for status, entry, left in facts['statuses']:
+            self.visit_issues.append(index)
+            self.visit_statuses.append(self.status_code(status))
+            self.visit_entries.append(self._or_missing(entry))
+            self.visit_exits.append(self._or_missing(left))
+
+    def extend(self, raws, facts=None):
+        facts = facts or {}
+        return [self.add(raw, facts.get(raw['key'])) for raw in raws]
+
+    def _or_missing(self, value):
+        return MISSING if value is None else value
+
+    def _timestamp(self, value):
+        if value is None:
+            return MISSING
+        return to_timestamp(value)
+
+
+# A lightweight view of a single row of an IssueTable.
+class IssueRecord(object):
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __str__(self):
+        return self.key
+
+    def __repr__(self):
+        return '<IssueRecord: {0}>'.format(self.key)
+
+    @property
+    def key(self):
+        return self.table.keys[self.index]
+
+    @property
+    def created(self):
+        value = self.table.created[self.index]
+        return None if value == MISSING else value
+
+    @property
+    def resolved(self):
+        value = self.table.resolved[self.index]
+        return None if value == MISSING else value
+
+    @property
+    def points(self):
+        value = self.table.points[self.index]
+        return None if value != value else value
+
+    @property
+    def epic(self):
+        return self.table.epics[self.index]
+
+    @property
+    def priority(self):
+        return self.table.priorities[self.index]
+
+    @property
+    def type(self):
+        return self.table.types[self.index]
+
+    def status_transitions(self):
+        table = self.table
+        statuses = table.statuses
+        for position in range(table.transition_offsets[self.index],
+                              table.transition_offsets[self.index + 1]):
+            yield (statuses[table.transition_from[position]],
+                   statuses[table.transition_to[position]],
+                   table.transition_timestamps[position])
@@ -0,0 +1,158 @@
+import re
+
+from bisect import bisect_left
+
+from .fetch import parse_values, split_clauses
+from .issues import field_name, status_changes
+from .timestamps import to_timestamp
+
+
+# The JQL clauses the queries emit, and --query-append filters on the indexed
+# fields, can be answered from a local copy of a project's issues. A search
+# using anything else goes to JIRA.
+CLAUSES = [
+    ('project', re.compile(r'^project = "?(?P<value>[^"\s]+)"?$', re.I)),
+    ('category', re.compile(r'^statusCategory = "?(?P<value>[^"]+?)"?$',
+                            re.I)),
+    ('changed', re.compile(
+        r'^(?P<negated>not )?status changed to "?(?P<status>[^"]+?)"? '
+        r'(?:during ?\( ?"(?P<begin>[^"]+)", ?"(?P<end>[^"]+)" ?\)|'
+        r'before "(?P<before>[^"]+)")$', re.I)),
+    ('field', re.compile(
+        r'^(?P<field>\w+) (?:= "?(?P<value>[^"()]+?)"?|'
+        r'in \((?P<values>[^()]*)\))$', re.I)),
+]
+
+# The JQL names of the indexed fields, and the issue field each indexes.
+INDEXED_FIELDS = {
+    'type': 'issuetype',
+    'issuetype': 'issuetype',
+    'priority': 'priority',
+    'status': 'status',
+    'component': 'components',
+    'labels': 'labels',
+}
+
+
+def parse_clause(clause):
+    for name, pattern in CLAUSES:
+        match = pattern.match(clause)
+        if not match:
+            continue
+        if name == 'field':
+            field = INDEXED_FIELDS.get(match.group('field').lower())
+            if field is None:
+                return None
+            values = match.group('values')
+            if values is None:
+                values = match.group('value')
+            return name, (field, parse_values(values))
+        if name != 'changed':
+            return name, match.group('value').lower()
+        if match.group('before'):
+            begin, end = None, to_timestamp(match.group('before'))
+        else:
+            begin = to_timestamp(match.group('begin'))
+            end = to_timestamp(match.group('end'))
+        return name, (match.group('status').lower(), begin, end,
+                      bool(match.group('negated')))
+    return None
+
+
+# The clauses of a search, or None if it uses JQL outside the local subset.
+def parse_jql(jql):
+    clauses = split_clauses(jql)
+    if clauses is None:
+        return None
+    parsed = [parse_clause(clause) for clause in clauses if clause]
+    if None in parsed:
+        return None
+    return parsed
+
+
+def _add(index, value, key):
+    if isinstance(value, list):
+        for item in value:
+            _add(index, item, key)
+        return
+    value = field_name(value)
+    if value is not None:
+        index.setdefault(value.lower(), set()).add(key)
+
+
+# Indexes over every issue of a project, answering the local JQL subset
+# without scanning the issues: sets of keys by the value of each indexed
+# field and by status category, and for every status the sorted times issues
+# changed to it.
+#
+# Status changes are compared in UTC and a DURING range includes its start
+# but not its end date, the same periods the series mode uses.
+class IssueIndex(object):
+    def __init__(self, project, raws):
+        self.project = project.lower()
+        self.keys = []
+        self.fields = dict((field, {}) for field in INDEXED_FIELDS.values())
+        self.categories = {}
+        self.complete_categories = True
+        changes = {}
+        for raw in raws:
+            key = raw['key']
+            fields = raw.get('fields') or {}
+            self.keys.append(key)
+            for field, index in self.fields.items():
+                _add(index, fields.get(field), key)
+            category = (fields.get('status') or {}).get('statusCategory')
+            if category is None:
+                self.complete_categories = False
+            else:
+                _add(self.categories, category, key)
+            for _, to_status, timestamp in status_changes(raw):
+                if to_status is not None:
+                    changes.setdefault(to_status.lower(), []).append(
+                        (timestamp, key))
+        self.changes = {}
+        for status, entries in changes.items():
+            entries.sort()
+            self.changes[status] = ([timestamp for timestamp, _ in entries],
+                                    [key for _, key in entries])
+
+    def changed_to(self, status, begin, end):
+        timestamps, keys = self.changes.get(status, ([], []))
+        start = 0 if begin is None else bisect_left(timestamps, begin)
+        return set(keys[start:bisect_left(timestamps, end)])
+
+    def matching(self, name, value):
+        if name == 'project':
+            return None if value == self.project else set()
+        if name == 'field':
+            field, values = value
+            index = self.fields[field]
+            return set().union(*[index.get(v, set()) for v in values])
+        if name == 'category':
+            return self.categories.get(value, set())
+        status, begin, end, _ = value
+        return self.changed_to(status, begin, end)
+
+    # The keys of the issues matching the parsed clauses, in index order, or
+    # None if they can not be answered locally.
+    def evaluate(self, clauses):
+        names = [name for name, _ in clauses]
+        if 'project' not in names:
+            return None
+        if 'category' in names and not self.complete_categories:
+            return None
+        selected, excluded = None, set()
+        for name, value in clauses:
+            keys = self.matching(name, value)
+            if keys is None:
+                continue
+            if name == 'changed' and value[3]:
+                excluded |= keys
+            elif selected is None:
+                # A copy, the sets of the index itself must not be narrowed.
+                selected = set(keys)
+            else:
+                selected &= keys
+        return [key for key in self.keys
+                if (selected is None or key in selected) and
+                key not in excluded]
@@ -2,12 +2,21 @@
 
 import argparse
 import datetime
-import jira
 import logging
 import sys
 
+from .cache import CachedIssueFetcher, IssueCache
+from .details import detail_formats, open_details
+from .epics import DEFAULT_EPIC_TTL, EpicResolver
+from .fetch import DEFAULT_PAGE_SIZE, DEFAULT_RETRIES, DEFAULT_WORKERS
+from .fetch import IssueFetcher
+from .groups import GROUP_FIELDS
+from .profiling import Profiler, metrics_formats, profile_run
 from .queries import query_map
+from .queries.ForecastQuery import DEFAULT_TRIALS
 from .renderers import renderer_map
+from .series import series_periods
+from .stats import DEFAULT_PERCENTILES, parse_percentiles
 
 
 log = logging.getLogger('mosaic')
@@ -20,8 +29,7 @@ log.addHandler(ch)
 DEFAULT_TYPES = 'bug, story, task'
 
 
-def parse_args():
-    desc = 'A utility for calculating various metrics from JIRA data'
+def build_parser(desc):
     parser = argparse.ArgumentParser(description=desc)
 
     parser.add_argument('-s', '--server',
@@ -59,6 +67,18 @@ def parse_args():
     parser.add_argument('-o', '--output', default='text',
                         choices=renderer_map.keys(),
                         help='Choose one of a few different output modes')
+    parser.add_argument('--output-file', default=None, metavar='FILE',
+                        help=('Write the report to this file rather than '
+                              'stdout'))
+    parser.add_argument('--details', default=None, metavar='FILE',
+                        help=('Also write the lead, cycle and status times '
+                              'computed for every issue to this file. '
+                              'mosaic-batch writes a file per job, with the '
+                              'job name added before the extension'))
+    parser.add_argument('--details-format', default='csv',
+                        choices=detail_formats.keys(),
+                        help=('The format of the --details file. The parquet '
+                              'and arrow formats require pyarrow'))
     parser.add_argument('-l', '--list', action='store_true',
                         default=False,
                         help='Print a list of available queries')
@@ -83,8 +103,93 @@ def parse_args():
                               'eg:\'bug, story\' '))
     parser.add_argument('-E', '--epoch', default=str(one_year_ago),
                         help=('A date before which issues are not considered'))
+    parser.add_argument('--series', type=int, default=None, metavar='WEEKS',
+                        help=('Split the date range into consecutive periods '
+                              'of this many weeks and report every query '
+                              'for each period, from a single fetch'))
+    parser.add_argument('--window', type=int, default=None, metavar='DAYS',
+                        help=('With --series, report each period over the '
+                              'trailing window of this many days instead. '
+                              'Supported by the lead time, cycle time and '
+                              'status duration queries'))
+    parser.add_argument('--percentiles', nargs='?', default=None,
+                        const=','.join(str(p) for p in DEFAULT_PERCENTILES),
+                        help=('Also report these comma separated percentiles '
+                              'of the durations, 50,85,95 if no value is '
+                              'given. Not supported by all queries'))
+    parser.add_argument('--group-by', default=None, metavar='FIELD',
+                        help=('Report every query per value of this field: '
+                              '{0}, or a custom field id such as '
+                              'customfield_10010. All the groups are '
+                              'computed from the same search, so '
+                              '"-q cycletime --group-by priority" covers '
+                              'every priority at once').format(
+                                  ', '.join(sorted(GROUP_FIELDS))))
+    parser.add_argument('--forecast-trials', type=int, default=None,
+                        help=('How many trials the forecast query '
+                              'simulates, {0} by default').format(
+                                  DEFAULT_TRIALS))
+    parser.add_argument('--forecast-seed', type=int, default=None,
+                        help=('Seed the forecast simulation, for '
+                              'reproducible forecasts'))
+    parser.add_argument('--resolve-epics', action='store_true', default=False,
+                        help=('Look up the summary and status of the epics '
+                              'the by-epic queries report on'))
+    parser.add_argument('--epic-ttl', type=int, default=DEFAULT_EPIC_TTL,
+                        help=('How many seconds epics looked up are reused '
+                              'from the cache directory before being looked '
+                              'up again'))
+    parser.add_argument('--cache-dir', default=None,
+                        help=('A directory in which to keep a local cache of '
+                              'issues and their changelogs. Only issues '
+                              'updated since the previous run are fetched '
+                              'from JIRA when this is set'))
+    parser.add_argument('--offline', action='store_true', default=False,
+                        help=('Answer queries from the cache directory only, '
+                              'without contacting JIRA'))
+    parser.add_argument('--local-jql', action='store_true', default=False,
+                        help=('Keep every issue of the project in the cache '
+                              'directory and evaluate the searches the '
+                              'queries make against it, so other dates, '
+                              'types or --query-append filters on the type, '
+                              'priority, status, component or labels need '
+                              'no new search'))
+    parser.add_argument('--fetch-workers', type=int, default=DEFAULT_WORKERS,
+                        help=('The number of search result pages to fetch '
+                              'from JIRA concurrently'))
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help='The number of issues to request per page')
+    parser.add_argument('--fetch-retries', type=int, default=DEFAULT_RETRIES,
+                        help=('How many times to retry a page which failed '
+                              'with a 429 or 5xx response'))
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        default=False,
+                        help=('Fetch all the queries and their pages '
+                              'concurrently with asyncio. Requires aiohttp'))
+    parser.add_argument('--stream', action='store_true', default=False,
+                        help=('Reduce the search results page by page '
+                              'instead of holding them all in memory. Only '
+                              'the durations are kept, and only when '
+                              'percentiles are asked for'))
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help=('Print how long each phase of the run took, '
+                              'and how many pages, issues and bytes were '
+                              'fetched, to stderr'))
+    parser.add_argument('--profile-dump', default=None, metavar='FILE',
+                        help=('Run under cProfile and write its statistics '
+                              'to this file, for use with pstats'))
+    parser.add_argument('--metrics-output', default=None, metavar='FILE',
+                        help=('Write the phase timings and counters to this '
+                              'file'))
+    parser.add_argument('--metrics-format', default='json',
+                        choices=metrics_formats.keys(),
+                        help='The format of the --metrics-output file')
+    return parser
+
 
-    return vars(parser.parse_args())
+def parse_args():
+    desc = 'A utility for calculating various metrics from JIRA data'
+    return vars(build_parser(desc).parse_args())
 
 
 def check_queries(queries):
@@ -96,15 +201,38 @@ def check_queries(queries):
                                        query_options=str(query_map.keys())))
 
 
-def run(args, client=None):
-    if not client:
-        client_args = {
-            'server': args['server'],
-            'options': dict(verify=args['cert']),
-            'kerberos': True
-        }
-        client = jira.client.JIRA(**client_args)
+def build_fetcher(args, client, profiler=None):
+    fetch_args = {
+        'workers': args.get('fetch_workers', DEFAULT_WORKERS),
+        'page_size': args.get('page_size', DEFAULT_PAGE_SIZE),
+        'retries': args.get('fetch_retries', DEFAULT_RETRIES),
+        'profiler': profiler,
+    }
+    if args.get('cache_dir'):
+        cache = IssueCache(args['cache_dir'], args['server'], args['project'])
+        return CachedIssueFetcher(client, log, cache,
+                                  offline=args.get('offline', False),
+                                  local=args.get('local_jql', False),
+                                  **fetch_args)
+    elif args.get('offline', False):
+        raise Exception('The offline argument requires a cache directory.')
+    elif args.get('local_jql', False):
+        raise Exception('The local-jql argument requires a cache directory.')
+    return IssueFetcher(client, log, **fetch_args)
+
+
+def create_client(args):
+    import jira
+    client_args = {
+        'server': args['server'],
+        'options': dict(verify=args['cert']),
+        'kerberos': True
+    }
+    return jira.client.JIRA(**client_args)
+
 
+def build_queries(args, client, profiler=None):
+    profiler = profiler or Profiler()
     quoted_types = ",".join('"%s"' % t.strip() for t in
                             args.get('types', DEFAULT_TYPES).split(','))
     query_vars = {
@@ -121,27 +249,136 @@ def run(args, client=None):
         'epoch': datetime.date(*map(int, args['epoch'].split('-'))),
         'verbose': args.get('verbose', False),
         'default_points': args.get('default_points', 3.0),
+        'percentiles': parse_percentiles(args.get('percentiles')),
+        'group_by': args.get('group_by'),
+        'resolve_epics': args.get('resolve_epics', False),
+        'trials': args.get('forecast_trials'),
+        'seed': args.get('forecast_seed'),
     }
 
-    renderer = renderer_map[args.get('output', 'text')]
-
     check_queries(args['query'])
     queries = []
     for query in args['query']:
         queries.append(query_map[query](query, client, query_vars, log))
 
+    series = args.get('series')
+    if series:
+        if query_vars['rolling']:
+            msg = ('The series argument can not be combined with the '
+                   'rolling argument.')
+            raise Exception(msg)
+        if not series_periods(args['begin_date'], args['end_date'], series):
+            msg = ('The series argument requires a begin date before the '
+                   'end date.')
+            raise Exception(msg)
+        for query in queries:
+            if not query.supports_series:
+                msg = ('The specified query: "{query}" does not support the '
+                       'series argument.').format(query=query.query_name)
+                raise Exception(msg)
+    elif args.get('window'):
+        raise Exception('The window argument requires the series argument.')
+
+    if args.get('stream'):
+        if series:
+            msg = ('The stream argument can not be combined with the series '
+                   'argument.')
+            raise Exception(msg)
+        if args.get('cache_dir') or args.get('offline', False):
+            raise Exception('The stream argument does not support the issue '
+                            'cache.')
+        for query in queries:
+            if not query.supports_streaming:
+                msg = ('The specified query: "{query}" does not support the '
+                       'stream argument.').format(query=query.query_name)
+                raise Exception(msg)
+
     for query in queries:
-        query.set_defaults()
-        query.build_query()
-        query.run()
+        with profiler.phase('set_defaults'):
+            query.set_defaults()
+        with profiler.phase('build_query'):
+            query.build_query()
+        if series:
+            # Issues are bucketed into periods by their transitions to the
+            # end state, so every query needs the changelogs.
+            query.needs_changelog = True
+            query.needs_transitions = True
+    return queries
+
+
+def complete_query(args, query):
+    series = args.get('series')
+    if series:
+        periods = series_periods(args['begin_date'], args['end_date'], series)
+    if series and args.get('window'):
+        query.build_window_results(periods, args['window'])
+    elif series:
+        query.build_series_results(periods)
+    else:
         query.build_results()
 
+
+def render(args, queries):
+    renderer = renderer_map[args.get('output', 'text')]
+    for query in queries:
+        for line in renderer(query, query.results_report):
+            yield line
+
+
+def report(args, queries, out=None):
     if 'auto_mode' in args and args['auto_mode']:
         return queries[0].result
+    elif out is None and args.get('output_file'):
+        with open(args['output_file'], 'w') as f:
+            report(args, queries, f)
     else:
+        out = out or sys.stdout
+        for line in render(args, queries):
+            out.write(line)
+            out.write('\n')
+
+
+def execute(args, client=None, profiler=None, fetcher=None):
+    profiler = profiler or Profiler()
+    if not client and not fetcher and not args.get('offline', False):
+        client = create_client(args)
+
+    profiler.watch(client)
+    details = None
+    try:
+        queries = build_queries(args, client, profiler)
+        details = open_details(args, queries)
+
+        # Plan every query up front so that identical searches are only sent
+        # to JIRA once and their issues are shared between the queries.
+        if fetcher is None:
+            fetcher = build_fetcher(args, client, profiler)
+        fetcher.plan(queries)
+        epics = EpicResolver(fetcher, log,
+                             ttl=args.get('epic_ttl', DEFAULT_EPIC_TTL),
+                             offline=args.get('offline', False))
         for query in queries:
-            for line in renderer(query, query.results_report):
-                print(line)
+            query.epics = epics
+        if args.get('stream'):
+            fetcher.stream(queries)
+        else:
+            for query in queries:
+                with profiler.phase('run'):
+                    query.run(fetcher)
+                with profiler.phase('build_results'):
+                    complete_query(args, query)
+    finally:
+        profiler.unwatch()
+        if details is not None:
+            details.close()
+    return queries
+
+
+def run(args, client=None, profiler=None):
+    profiler = profiler or Profiler()
+    queries = execute(args, client=client, profiler=profiler)
+    with profiler.phase('render'):
+        return report(args, queries)
 
 
 def main():
@@ -160,7 +397,12 @@ def main():
         msg = 'You must specify at least one query with the -q argument.'
         log.error(msg)
         sys.exit(1)
-    run(args)
+    with profile_run(args, Profiler()) as profiler:
+        if args['use_async']:
+            from .aio import run as run_async
+            run_async(args, profiler=profiler)
+        else:
+            run(args, profiler=profiler)
 
 
 if __name__ == '__main__':
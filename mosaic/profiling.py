@@ -0,0 +1,189 @@
+import contextlib
+import json
+import sys
+import threading
+import time
+
+
+METRICS_PREFIX = 'mosaic_'
+
+# Several runs may share a jira client, such as the jobs of a batch or the
+# requests of mosaic-server. Each response is counted by the profiler of
+# the run the thread which made the request works for. A session carries
+# the hook for as long as any profiler watches it.
+_active = threading.local()
+_watched = {}
+_watched_lock = threading.Lock()
+
+
+def active_profiler():
+    return getattr(_active, 'profiler', None)
+
+
+def count_response(response, *args, **kwargs):
+    profiler = active_profiler()
+    if profiler is not None:
+        profiler.count('http_requests')
+        profiler.count('http_bytes', len(response.content))
+
+
+# Wrap a function run on a worker thread so that the requests it makes are
+# counted by the profiler of the run which hands it the work.
+def carry_profiler(function):
+    profiler = active_profiler()
+
+    def run(*args, **kwargs):
+        previous = active_profiler()
+        _active.profiler = profiler
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _active.profiler = previous
+    return run
+
+
+# Records how long each phase of a run took and counts what it did: pages
+# and issues fetched, bytes received from JIRA and issue cache hits. Phases
+# can nest, a phase's time includes that of the phases run within it, and
+# counts may be recorded from the fetcher's worker threads.
+class Profiler(object):
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.sessions = []
+        self.previous = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                seconds, calls = self.phases.get(name, (0.0, 0))
+                self.phases[name] = (seconds + elapsed, calls + 1)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # Count the requests this thread makes through a jira client's HTTP
+    # session, and the size of their responses, until `unwatch` is called.
+    # Worker threads count theirs through `carry_profiler`.
+    def watch(self, client):
+        self.previous = active_profiler()
+        _active.profiler = self
+        session = getattr(client, '_session', None)
+        hooks = getattr(session, 'hooks', None)
+        if hooks is None:
+            return
+        with _watched_lock:
+            if id(session) not in _watched:
+                hooks.setdefault('response', []).append(count_response)
+                _watched[id(session)] = 0
+            _watched[id(session)] += 1
+        self.sessions.append(session)
+
+    def unwatch(self):
+        _active.profiler = self.previous
+        with _watched_lock:
+            for session in self.sessions:
+                _watched[id(session)] -= 1
+                if not _watched[id(session)]:
+                    del _watched[id(session)]
+                    session.hooks['response'].remove(count_response)
+        self.sessions = []
+
+    # Add the phases and counts recorded by another profiler, such as one
+    # of a batch job run in another process.
+    def merge(self, phases, counters):
+        with self.lock:
+            for name, (seconds, calls) in phases.items():
+                total, count = self.phases.get(name, (0.0, 0))
+                self.phases[name] = (total + seconds, count + calls)
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def cache_hit_rate(self):
+        hits = self.counters.get('cache_hits', 0)
+        lookups = hits + self.counters.get('cache_misses', 0)
+        return hits / float(lookups) if lookups else None
+
+    def summary(self):
+        lines = ['{0:<24} {1:>10} {2:>6}'.format('phase', 'seconds', 'calls')]
+        for name, (seconds, calls) in sorted(self.phases.items()):
+            line = '{0:<24} {1:>10.3f} {2:>6}'.format(name, seconds, calls)
+            lines.append(line)
+        lines.append('')
+        lines.append('{0:<24} {1:>10}'.format('counter', 'value'))
+        for name, value in sorted(self.counters.items()):
+            lines.append('{0:<24} {1:>10}'.format(name, value))
+        hit_rate = self.cache_hit_rate()
+        if hit_rate is not None:
+            lines.append('{0:<24} {1:>10.1%}'.format('cache_hit_rate',
+                                                     hit_rate))
+        return lines
+
+    def metrics(self):
+        metrics = {
+            'phases': dict((name, {'seconds': seconds, 'calls': calls})
+                           for name, (seconds, calls) in self.phases.items()),
+            'counters': dict(self.counters),
+        }
+        if self.cache_hit_rate() is not None:
+            metrics['counters']['cache_hit_rate'] = self.cache_hit_rate()
+        return metrics
+
+
+def metrics_to_json(profiler):
+    return json.dumps(profiler.metrics(), indent=2, sort_keys=True)
+
+
+def metrics_to_prometheus(profiler):
+    metrics = profiler.metrics()
+    lines = []
+    for suffix, key in (('phase_seconds', 'seconds'),
+                        ('phase_calls', 'calls')):
+        name = METRICS_PREFIX + suffix
+        lines.append('# TYPE {0} gauge'.format(name))
+        for phase, values in sorted(metrics['phases'].items()):
+            lines.append('{0}{{phase="{1}"}} {2}'.format(name, phase,
+                                                         values[key]))
+    for counter, value in sorted(metrics['counters'].items()):
+        name = METRICS_PREFIX + counter
+        lines.append('# TYPE {0} gauge'.format(name))
+        lines.append('{0} {1}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+metrics_formats = {
+    'json': metrics_to_json,
+    'prometheus': metrics_to_prometheus,
+}
+
+
+# Wraps a run, optionally under cProfile, and reports the profiler's
+# findings as the --profile, --profile-dump and --metrics-output arguments
+# ask for once it is over.
+@contextlib.contextmanager
+def profile_run(args, profiler):
+    cprofile = None
+    if args.get('profile_dump'):
+        import cProfile
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+    try:
+        yield profiler
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(args['profile_dump'])
+        if args.get('profile'):
+            for line in profiler.summary():
+                print(line, file=sys.stderr)
+        if args.get('metrics_output'):
+            renderer = metrics_formats[args.get('metrics_format', 'json')]
+            with open(args['metrics_output'], 'w') as f:
+                f.write(renderer(profiler))
@@ -1,10 +1,59 @@
 import datetime
 
+from ..epics import EpicResolver
+from ..fetch import IssueFetcher
+from ..groups import TABLE_COLUMNS, group_field, group_keys, issue_labels
+from ..groups import group_source_fields
+from ..issues import UNASSIGNED
+from ..series import TransitionIndex
+from ..stats import Summary, sliding_window
+from ..timestamps import SECONDS_PER_DAY, format_timestamp, to_timestamp
+
 
 class BaseQuery(object):
     supports_rolling = False
     supports_isolated_rolling = False
 
+    # The issue fields the query reads, or None for all of them, and whether
+    # it walks the issue changelogs.
+    fields = None
+    needs_changelog = True
+
+    # Queries which read the issues' status transitions themselves, rather
+    # than the facts derived from them (see `mosaic.issues.derive_facts`).
+    needs_transitions = False
+
+    # Queries reporting a single metric per issue can be computed over a
+    # window sliding across a series. They implement `metric_values` and
+    # name the search the metric is computed from.
+    supports_window = False
+    metric_query = None
+
+    # Queries whose searches select issues by their transitions to the end
+    # state DURING the query period can report a series of periods from a
+    # single search.
+    supports_series = True
+
+    # Queries which reduce their issues one batch at a time, through
+    # `start_results`, `accumulate` and `finish_results`, can be run with
+    # --stream, without ever holding a whole result set.
+    supports_streaming = False
+
+    # Queries reporting a row per value of some field name it here, and the
+    # values qualify their rows. Any query can further be broken down by the
+    # --group-by field, reported as the rows' group.
+    qualifier_group = None
+    supports_grouping = True
+
+    # Queries reporting on epics themselves look them up through an
+    # EpicResolver, shared by the queries of a run.
+    resolves_epics = False
+    epics = None
+
+    # Where the per-issue values the query computes are written, if
+    # anywhere. See `mosaic.details`.
+    details = None
+
     def __init__(self, query_name, client, vars, log):
         self.log = log
         self.query_name = query_name
@@ -15,6 +64,17 @@ class BaseQuery(object):
         self.query_append = vars.get('query_append', '')
         self.lower_bound = float(vars.get('lower_bound', '0'))
         self.upper_bound = float(vars.get('upper_bound', 'inf'))
+        self.group_by = vars.get('group_by')
+        if self.group_by and not self.supports_grouping:
+            msg = ('The specified query: "{query}" does not support the '
+                   'group-by argument.').format(query=self.query_name)
+            raise Exception(msg)
+        if self.qualifier_group == 'epic' and vars.get('resolve_epics'):
+            self.resolves_epics = True
+            self.template = self.template.replace(
+                '{qualifier}', '{qualifier} ({epic_summary})')
+        if self.group_by and self.fields is not None:
+            self.fields = self.fields + group_source_fields(self.group_by)
         if self.rolling:
             if not self.supports_rolling:
                 msg = ('The specified query: "{query}" does not support the '
@@ -42,10 +102,220 @@ class BaseQuery(object):
     def set_defaults(self):
         pass
 
-    def run(self):
+    def series_keys(self):
+        window = 'DURING("{begin_date}", "{end_date}")'
+        return [query for query, query_base in self.query_bases.items()
+                if window in query_base]
+
+    def build_series_results(self, periods):
+        # The searches were run once over the whole series. Each period's
+        # results are the issues which transitioned to the end state during
+        # that period, exactly as a search over just that period would find.
+        indexes = dict((query, TransitionIndex(self.results[query],
+                                               self.vars['end_state']))
+                       for query in self.series_keys())
+        results, query_vars = self.results, self.vars
+        report = []
+        try:
+            for begin_date, end_date in periods:
+                self.vars = dict(query_vars, begin_date=begin_date,
+                                 end_date=end_date)
+                self.results = dict(results)
+                for query, index in indexes.items():
+                    self.results[query] = index.between(
+                        to_timestamp(begin_date), to_timestamp(end_date))
+                self.build_results()
+                report.extend(self.results_report)
+        finally:
+            self.results, self.vars = results, query_vars
+        self.results_report = report
+
+    def build_results(self):
+        self.start_results()
+        for query in self.queries:
+            self.accumulate(query, self.results[query])
+        self.finish_results()
+
+    def start_results(self):
+        raise NotImplementedError()
+
+    def accumulate(self, query, issues):
+        # Called with every batch of issues found by the named search.
+        raise NotImplementedError()
+
+    def finish_results(self):
+        raise NotImplementedError()
+
+    def metric_values(self, issues):
+        # One value per issue, or None for issues left out of the metric.
+        raise NotImplementedError()
+
+    def record_details(self, metric, issues, values, qualifier=None):
+        if self.details is None or not issues:
+            return
+        count = len(issues)
+        if qualifier is not None:
+            qualifiers = [qualifier] * count
+        elif self.qualifier_group:
+            qualifiers = [','.join(issue_labels(issue, self.qualifier_group))
+                          for issue in issues]
+        elif '{qualifier}' in self.template:
+            qualifiers = [self.vars['argument']] * count
+        else:
+            qualifiers = [''] * count
+        self.details.write({
+            'query': [self.query_name] * count,
+            'begin_date': [self.vars['begin_date']] * count,
+            'end_date': [self.vars['end_date']] * count,
+            'key': [issue.key for issue in issues],
+            'metric': [metric] * count,
+            'qualifier': qualifiers,
+            'value': list(values),
+        })
+
+    def groupings(self):
+        return [name for name in (self.qualifier_group, self.group_by)
+                if name]
+
+    # The issue fields grouped by which the IssueTable has no column for.
+    def group_fields(self):
+        return [group_field(name) for name in self.groupings()
+                if name not in TABLE_COLUMNS]
+
+    # The summaries are kept per group, keyed by a tuple of the labels of
+    # each grouping, and are updated in a single pass over each batch of
+    # issues. Without any groupings there is a single summary keyed by ().
+    def start_summaries(self):
+        self.summaries = {}
+        if not self.groupings():
+            self.summaries[()] = self.create_summary()
+
+    def group_summaries(self, issue, groupings):
+        for key in group_keys(issue, groupings):
+            if key not in self.summaries:
+                self.summaries[key] = self.create_summary()
+            yield self.summaries[key]
+
+    # Add every issue's value, skipping those which are None, to the
+    # summaries of the groups it belongs to.
+    def add_values(self, issues, values):
+        groupings = self.groupings()
+        if not groupings:
+            summary = self.summaries[()]
+            for value in values:
+                if value is not None:
+                    summary.add(value)
+            return
+        for issue, value in zip(issues, values):
+            if value is None:
+                continue
+            for summary in self.group_summaries(issue, groupings):
+                summary.add(value)
+
+    # Count issues in their groups' summaries without timing them.
+    def add_counts(self, issues):
+        groupings = self.groupings()
+        if not groupings:
+            self.summaries[()].count += len(issues)
+            return
+        for issue in issues:
+            for summary in self.group_summaries(issue, groupings):
+                summary.count += 1
+
+    def group_row_fields(self, key):
+        fields = {}
+        labels = list(key)
+        if self.qualifier_group:
+            fields['qualifier'] = labels.pop(0)
+        if self.group_by:
+            fields['group'] = labels.pop(0)
+        return fields
+
+    def report_rows(self):
+        return [self.report_row(summary, **self.group_row_fields(key))
+                for key, summary in self.summaries.items()]
+
+    def epic_resolver(self):
+        if self.epics is None:
+            self.epics = EpicResolver(IssueFetcher(self.client, self.log),
+                                      self.log)
+        return self.epics
+
+    # Add the summary and status of the epic qualifying each row.
+    def add_epic_metadata(self, rows):
+        epics = self.epic_resolver().resolve(
+            [row['qualifier'] for row in rows])
+        for row in rows:
+            epic = epics.get(row['qualifier'])
+            if epic is None:
+                row['epic_summary'] = ('no epic'
+                                       if row['qualifier'] == UNASSIGNED
+                                       else 'not found')
+                row['epic_status'] = None
+            else:
+                row['epic_summary'] = epic['summary']
+                row['epic_status'] = epic['status']
+
+    def create_summary(self):
+        return Summary(self.vars.get('percentiles'))
+
+    def report_row(self, summary, **fields):
+        row = dict(
+            begin_date=self.vars['begin_date'],
+            end_date=self.vars['end_date'],
+            value=summary.mean(),
+            count=summary.count,
+        )
+        if '{qualifier}' in self.template:
+            row['qualifier'] = self.vars['argument']
+        row.update(fields)
+        if self.vars.get('percentiles'):
+            row['percentiles'] = summary.percentile_values()
+        return row
+
+    def build_window_results(self, periods, days):
+        if not self.supports_window:
+            msg = ('The specified query: "{query}" does not support the '
+                   'window argument.').format(query=self.query_name)
+            raise Exception(msg)
+        if self.group_by:
+            raise Exception('The window argument does not support the '
+                            'group-by argument.')
+        issues = self.results[self.metric_query]
+        values = self.metric_values(issues)
+        index = TransitionIndex(issues, self.vars['end_state'])
+        events = [(timestamp, position, values[position])
+                  for timestamp, position
+                  in zip(index.timestamps, index.positions)
+                  if values[position] is not None]
+
+        # Every period reports the issues which reached the end state in the
+        # `days` days before its end, with the window's statistics updated
+        # incrementally as issues enter and leave it.
+        first = to_timestamp(periods[0][0])
+        ends = [to_timestamp(end_date) for _, end_date in periods]
+        windows = sliding_window(events, ends, days,
+                                 self.vars.get('percentiles') or [])
+        self.results_report = []
+        for end, (count, mean, window_percentiles) in zip(ends, windows):
+            begin = max(first, end - days * SECONDS_PER_DAY)
+            row = dict(
+                begin_date=format_timestamp(begin)[0:10],
+                end_date=format_timestamp(end)[0:10],
+                value=mean,
+                count=count,
+            )
+            if '{qualifier}' in self.template:
+                row['qualifier'] = self.vars['argument']
+            if self.vars.get('percentiles'):
+                row['percentiles'] = window_percentiles
+            self.results_report.append(row)
+        self.result = self.results_report[-1]['value']
+
+    def run(self, fetcher=None):
+        if fetcher is None:
+            fetcher = IssueFetcher(self.client, self.log)
+            fetcher.plan([self])
         self.results = {}
         for query, query_string in self.queries.items():
-            self.log.debug('Executing query: {0}'.format(query_string))
-            self.results[query] = self.client.search_issues(query_string,
-                                                            expand='changelog',
-                                                            maxResults=False)
+            self.results[query] = fetcher.fetch(query_string)
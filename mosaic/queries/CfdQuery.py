@@ -0,0 +1,69 @@
+import datetime
+
+from .BaseQuery import BaseQuery
+from ..timestamps import to_timestamp
+
+
+# A cumulative flow diagram: how many issues were in each status at the end
+# of every day between the begin and end dates, from the issues which were
+# created before the end date and had not reached the end state before the
+# begin date. Its rows are already daily, so it does not report series.
+class CfdQuery(BaseQuery):
+    template = ('At the end of {begin_date}, {value} issues were in the '
+                '{qualifier} status.')
+    fields = ['created', 'status']
+    supports_streaming = True
+    supports_grouping = False
+    supports_series = False
+    needs_transitions = True
+    query_bases = {
+        'cfd': ('PROJECT = {project} '
+                'AND TYPE IN ({types}) '
+                'AND created < "{end_date}" '
+                'AND NOT status CHANGED TO {end_state} BEFORE "{begin_date}"'),
+    }
+
+    def set_defaults(self):
+        if 'types' not in self.vars:
+            self.vars['types'] = 'bug, story, task'
+
+    def start_results(self):
+        self.counts = {}
+
+    def accumulate(self, query, issues):
+        if not issues:
+            return
+        from .. import engine
+        counts = engine.daily_status_counts(
+            issues, to_timestamp(self.vars['begin_date']),
+            to_timestamp(self.vars['end_date']))
+        # The table may be shared with other queries, only the statuses
+        # these issues were in are reported.
+        statuses = issues[0].table.statuses
+        for code in engine.statuses_seen(issues).tolist():
+            status = statuses[code]
+            if status is None:
+                continue
+            if status in self.counts:
+                self.counts[status] = self.counts[status] + counts[:, code]
+            else:
+                self.counts[status] = counts[:, code]
+
+    def finish_results(self):
+        begin = datetime.datetime.strptime(self.vars['begin_date'],
+                                           '%Y-%m-%d').date()
+        statuses = [(status, counts.tolist())
+                    for status, counts in self.counts.items()]
+        days = len(statuses[0][1]) if statuses else 0
+        self.results_report = []
+        for day in range(days):
+            date = begin + datetime.timedelta(days=day)
+            for status, counts in statuses:
+                self.results_report.append(dict(
+                    begin_date=str(date),
+                    end_date=str(date + datetime.timedelta(days=1)),
+                    value=counts[day],
+                    count=counts[day],
+                    qualifier=status,
+                ))
+        self.result = self.results_report
@@ -1,8 +1,10 @@
 import datetime
-import traceback
+import logging
+import math
 
 from .BaseQuery import BaseQuery
-from .utils import date_difference
+from ..issues import MISSING
+from ..timestamps import date_timestamp, timestamp_difference
 
 
 class CycletimeQuery(BaseQuery):
@@ -10,6 +12,10 @@ class CycletimeQuery(BaseQuery):
                 'the average cycle time for all issues '
                 'was {value} days.')
     supports_rolling = True
+    supports_window = True
+    metric_query = 'cycletime'
+    supports_streaming = True
+    fields = ['resolutiondate']
     query_bases = {
         'cycletime': ('PROJECT = {project} '
                       'AND TYPE IN ({types}) '
@@ -25,77 +31,82 @@ class CycletimeQuery(BaseQuery):
         if 'types' not in self.vars:
             self.vars['types'] = 'bug, story, task'
 
-    def _get_issue_start_date(self, issue):
-        start_date = None
-        for history in issue.changelog.histories:
-            for item in history.items:
-                if item.field == 'status':
-                    if item.fromString == 'To Do' and item.toString != 'Next':
-                        start_date = history.created
-                    elif (item.fromString == 'Next' and
-                          item.toString != 'To Do'):
-                        start_date = history.created
-        if start_date is None:
-            raise Exception(('No transition from To Do to In Progress '
-                             'could be found for issue {0}').format(issue))
-        return start_date
+    # One start date per issue, None for the issues which were never
+    # started, such as those moved straight into an in progress status.
+    def _get_issue_start_dates(self, issues):
+        from .. import engine
+        start_dates = engine.cycle_start_dates(issues).tolist()
+        for position, (issue, start_date) in enumerate(zip(issues,
+                                                           start_dates)):
+            if start_date == MISSING:
+                self.log.debug(('No transition from To Do to In Progress '
+                                'could be found for issue {0}').format(issue))
+                start_dates[position] = None
+        return start_dates
 
-    def _get_issue_cycle_time(self, issue):
-        start_date = self._get_issue_start_date(issue)
-        cycle_time = date_difference(issue.fields.resolutiondate,
-                                     start_date, self.vars['epoch'])
-        line = '\tFor issue {issue}, the cycle time was {cycletime} days'
-        self.log.debug(line.format(issue=issue.key, cycletime=cycle_time))
-        return cycle_time
+    def metric_values(self, issues):
+        from .. import engine
+        cycle_times = engine.cycle_times(
+            issues, date_timestamp(self.vars['epoch'])).tolist()
+        return [None if math.isnan(cycle_time) else cycle_time
+                for cycle_time in cycle_times]
 
-    def _get_total_cycle_time(self, issues, in_progress_issues):
-        count = len(issues)
-        total_cycle_time = 0
-        for issue in issues:
-            try:
-                total_cycle_time += self._get_issue_cycle_time(issue)
-            except Exception:
-                self.log.debug(traceback.format_exc())
-                count -= 1
-        if self.rolling:
-            self.log.debug(('Calculating time spent so far for in '
-                            'progress issues'))
-            today = datetime.date.today()
-            today = datetime.datetime.strftime(today, '%Y-%m-%d')
-            for issue in in_progress_issues:
-                start_date = self._get_issue_start_date(issue)
-                time_spent = date_difference(today, start_date)
-                self.log.debug(('Time spent so far on issue {key}: {duration} '
-                                'days.').format(key=issue.key,
-                                                duration=time_spent))
-                total_cycle_time += time_spent
-                count += 1
+    # One cycle time per issue, None for the issues it could not be
+    # calculated for.
+    def _get_cycle_times(self, issues):
+        line = '\tFor issue {issue}, the cycle time was {cycletime} days'
+        debug = self.log.isEnabledFor(logging.DEBUG)
+        cycle_times = self.metric_values(issues)
+        self.record_details('cycle_time', issues, cycle_times)
+        for issue, cycle_time in zip(issues, cycle_times):
+            if cycle_time is None:
+                self.log.debug(('No cycle time could be calculated for issue '
+                                '{0}').format(issue))
+            elif debug:
+                self.log.debug(line.format(issue=issue.key,
+                                           cycletime=cycle_time))
+        return cycle_times
 
-        if not count:
-            return float('nan'), 0
-        average_cycle_time = total_cycle_time / count
-        return average_cycle_time, count
+    def _get_times_spent(self, in_progress_issues):
+        today = date_timestamp(datetime.date.today())
+        epoch = date_timestamp(self.vars['epoch'])
+        start_dates = self._get_issue_start_dates(in_progress_issues)
+        times_spent = []
+        for issue, start_date in zip(in_progress_issues, start_dates):
+            if start_date is None:
+                times_spent.append(None)
+                continue
+            time_spent = timestamp_difference(today, start_date, epoch,
+                                              date_only=True)
+            self.log.debug(('Time spent so far on issue {key}: {duration} '
+                            'days.').format(key=issue.key,
+                                            duration=time_spent))
+            times_spent.append(time_spent)
+        self.record_details('time_spent', in_progress_issues, times_spent)
+        return times_spent
 
-    def build_results(self):
-        issues = self.results['cycletime']
-        in_progress_issues = self.results['cycletime_rolling']
-        self.log.debug('There were {0} issues'.format(len(issues)))
+    def start_results(self):
+        self.start_summaries()
         if self.rolling:
             self.log.debug(('Rolling argument specified. Cycle time will be '
                            'calculated using in progress issues'))
+
+    def accumulate(self, query, issues):
+        if query == self.metric_query:
+            self.log.debug('There were {0} issues'.format(len(issues)))
+            cycle_times = self._get_cycle_times(issues)
+        elif self.rolling:
             self.log.debug(('There are {len} issues in '
-                           'progress.').format(len=len(in_progress_issues)))
-        average_cycle_time, count = self._get_total_cycle_time(
-            issues, in_progress_issues)
-        self.result = average_cycle_time
-        start_date = self.vars['begin_date']
-        end_date = self.vars['end_date']
-        self.results_report = [dict(
-            begin_date=start_date,
-            end_date=end_date,
-            value=average_cycle_time,
-            count=count,
-        )]
+                           'progress.').format(len=len(issues)))
+            cycle_times = self._get_times_spent(issues)
+        else:
+            return
+        self.add_values(issues, cycle_times)
+
+    def finish_results(self):
+        self.results_report = self.report_rows()
+        if not self.groupings():
+            self.result = self.results_report[0]['value']
 
 
 class PrioritycycletimeQuery(CycletimeQuery):
@@ -104,6 +115,7 @@ class PrioritycycletimeQuery(CycletimeQuery):
                 '"{qualifier}" priority '
                 'was {value} days.')
     supports_rolling = True
+    metric_query = 'prioritycycletime'
     query_bases = {
         'prioritycycletime': ('PROJECT = {project} '
                               'AND TYPE IN ({types}) '
@@ -116,19 +128,3 @@ class PrioritycycletimeQuery(CycletimeQuery):
                                       'AND statusCategory = "In Progress" '
                                       'AND priority in ({argument}) ')
     }
-
-    def build_results(self):
-        issues = self.results['prioritycycletime']
-        in_progress_issues = self.results['prioritycycletime_rolling']
-        average_cycle_time, count = self._get_total_cycle_time(
-            issues, in_progress_issues)
-        self.result = average_cycle_time
-        start_date = self.vars['begin_date']
-        end_date = self.vars['end_date']
-        self.results_report = [dict(
-            begin_date=start_date,
-            end_date=end_date,
-            qualifier=self.vars['argument'],
-            value=average_cycle_time,
-            count=count,
-        )]
@@ -0,0 +1,95 @@
+import datetime
+
+from .ThroughputQuery import ThroughputQuery
+from ..issues import MISSING
+from ..stats import DEFAULT_PERCENTILES
+from ..timestamps import SECONDS_PER_DAY, is_date, to_timestamp
+
+
+DEFAULT_TRIALS = 10000
+
+
+# Forecasts from the daily throughput between the begin and end dates,
+# found by the same search as the throughput query. The argument is either
+# a date, to forecast how many issues will be done by then, or a number of
+# issues, to forecast when they will be done. Each percentile asked for is
+# reported as a confidence level.
+class ForecastQuery(ThroughputQuery):
+    items_template = ('Between {begin_date} and {end_date}, at least '
+                      '{value} issues will transition to the Done state, '
+                      'with {qualifier} confidence.')
+    days_template = ('Starting {begin_date}, {items} issues will have '
+                     'transitioned to the Done state by {end_date}, within '
+                     '{value} days, with {qualifier} confidence.')
+    fields = []
+    needs_changelog = True
+    needs_transitions = True
+    supports_grouping = False
+
+    def __init__(self, query_name, client, vars, log):
+        super(ForecastQuery, self).__init__(query_name, client, vars, log)
+        argument = vars.get('argument')
+        self.target_date = self.target_items = None
+        if argument and is_date(argument):
+            self.target_date = argument
+            self.template = self.items_template
+        elif argument and argument.isdigit():
+            self.target_items = int(argument)
+            self.template = self.days_template
+        else:
+            msg = ('The specified query: "{query}" requires a date or a '
+                   'number of issues as its argument.').format(
+                       query=self.query_name)
+            raise Exception(msg)
+
+    def start_results(self):
+        self.completions = []
+
+    def accumulate(self, query, issues):
+        from .. import engine
+        entered = engine.entry_times(issues, self.vars['end_state'],
+                                     to_timestamp(self.vars['begin_date']),
+                                     to_timestamp(self.vars['end_date']))
+        self.completions.extend(entered[entered != MISSING].tolist())
+
+    def finish_results(self):
+        from .. import forecast
+        daily = forecast.daily_throughput(
+            self.completions, to_timestamp(self.vars['begin_date']),
+            to_timestamp(self.vars['end_date']))
+        trials = self.vars.get('trials') or DEFAULT_TRIALS
+        rng = forecast.generator(self.vars.get('seed'))
+        confidences = self.vars.get('percentiles') or DEFAULT_PERCENTILES
+        start = self.vars['end_date']
+        self.results_report = []
+
+        if self.target_date is not None:
+            days = ((to_timestamp(self.target_date) - to_timestamp(start)) //
+                    SECONDS_PER_DAY)
+            totals = forecast.simulate_totals(daily, days, trials, rng)
+            for confidence in confidences:
+                self.results_report.append(dict(
+                    begin_date=start,
+                    end_date=self.target_date,
+                    value=forecast.at_least(totals, confidence),
+                    count=trials,
+                    qualifier='{0:g}%'.format(confidence),
+                ))
+        else:
+            days = forecast.simulate_days(daily, self.target_items, trials,
+                                          rng)
+            begin = datetime.datetime.strptime(start, '%Y-%m-%d').date()
+            for confidence in confidences:
+                value = forecast.within(days, confidence)
+                end_date = 'never'
+                if value != float('inf'):
+                    end_date = str(begin + datetime.timedelta(days=value))
+                self.results_report.append(dict(
+                    begin_date=start,
+                    end_date=end_date,
+                    value=value,
+                    count=trials,
+                    items=self.target_items,
+                    qualifier='{0:g}%'.format(confidence),
+                ))
+        self.result = self.results_report[0]['value']
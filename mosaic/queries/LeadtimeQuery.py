@@ -1,10 +1,17 @@
+import logging
+
 from .BaseQuery import BaseQuery
-from .utils import by_epic, date_difference
+from ..timestamps import date_timestamp, timestamp_difference
 
 
 class LeadtimeQuery(BaseQuery):
     template = ('Between {begin_date} and {end_date}, '
                 'the average lead time was {value} days.')
+    fields = ['created', 'resolutiondate', 'customfield_10006', 'parent']
+    needs_changelog = False
+    supports_window = True
+    metric_query = 'leadtime'
+    supports_streaming = True
     query_bases = {
         'leadtime': ('PROJECT = {project} '
                      'AND TYPE IN ({types}) '
@@ -17,52 +24,88 @@ class LeadtimeQuery(BaseQuery):
         if 'types' not in self.vars:
             self.vars['types'] = 'bug, story, task'
 
-    def _get_issue_lead_time(self, issue):
-        lead_time = date_difference(
-            issue.fields.resolutiondate, issue.fields.created,
-            self.vars['epoch'])
-        line = '\tFor issue {issue}, the lead time was {leadtime} days'
-        self.log.debug(line.format(issue=issue.key, leadtime=lead_time))
-        return lead_time
+    def metric_values(self, issues):
+        from .. import engine
+        return engine.lead_times(
+            issues, date_timestamp(self.vars['epoch'])).tolist()
 
     def _get_issues_lead_time(self, issues):
-        total_lead_time = 0
-        for issue in issues:
-            total_lead_time += self._get_issue_lead_time(issue)
-        if not issues:
-            return float('nan'), 0
-        return total_lead_time / len(issues), len(issues)
-
-    def build_results(self):
-        issues = self.results['leadtime']
-        average_lead_time, count = self._get_issues_lead_time(issues)
-        self.result = average_lead_time
-        start_date = self.vars['begin_date']
-        end_date = self.vars['end_date']
-        self.results_report = [dict(
-            begin_date=start_date,
-            end_date=end_date,
-            value=average_lead_time,
-            count=count,
-        )]
+        lead_times = self.metric_values(issues)
+        if self.log.isEnabledFor(logging.DEBUG):
+            line = '\tFor issue {issue}, the lead time was {leadtime} days'
+            for issue, lead_time in zip(issues, lead_times):
+                self.log.debug(line.format(issue=issue.key,
+                                           leadtime=lead_time))
+        return lead_times
+
+    def start_results(self):
+        self.start_summaries()
+
+    def accumulate(self, query, issues):
+        lead_times = self._get_issues_lead_time(issues)
+        self.record_details('lead_time', issues, lead_times)
+        self.add_values(issues, lead_times)
+
+    def finish_results(self):
+        self.results_report = self.report_rows()
+        if self.resolves_epics:
+            self.add_epic_metadata(self.results_report)
+        if not self.groupings():
+            self.result = self.results_report[0]['value']
 
 
 class LeadtimebyepicQuery(LeadtimeQuery):
     template = ('Between {begin_date} and {end_date}, '
                 'the average lead time for {qualifier} was {value} days.')
+    supports_window = False
+    qualifier_group = 'epic'
+
+
+class EpicleadtimeQuery(LeadtimeQuery):
+    template = ('Between {begin_date} and {end_date}, the lead time of the '
+                '{qualifier} ({epic_summary}) epic, from its creation to the '
+                'resolution of its last child, was {value} days.')
+    fields = ['resolutiondate', 'customfield_10006', 'parent']
+    supports_window = False
+    supports_grouping = False
+    resolves_epics = True
+
+    def start_results(self):
+        self.children = {}
+        self.last_resolved = {}
+
+    def accumulate(self, query, issues):
+        # The epics are timed from the children already fetched, the issues
+        # resolved during the query period.
+        for issue in issues:
+            if issue.epic is None or issue.resolved is None:
+                continue
+            self.children[issue.epic] = self.children.get(issue.epic, 0) + 1
+            self.last_resolved[issue.epic] = max(
+                issue.resolved, self.last_resolved.get(issue.epic, 0))
 
-    def build_results(self):
-        epics = by_epic(self.results['leadtime'])
-        epic_lead_times = {}
-        for epic, epic_issues in epics.items():
-            epic_lead_times[epic] = self._get_issues_lead_time(epic_issues)
-
-        start_date = self.vars['begin_date']
-        end_date = self.vars['end_date']
-        self.results_report = [dict(
-            begin_date=start_date,
-            end_date=end_date,
-            qualifier=epic,
-            value=values[0],
-            count=values[1],
-        ) for epic, values in epic_lead_times.items()]
+    def finish_results(self):
+        epics = self.epic_resolver().resolve(list(self.last_resolved))
+        epoch = date_timestamp(self.vars['epoch'])
+        self.results_report = []
+        for key, last_resolved in self.last_resolved.items():
+            epic = epics.get(key)
+            if epic is None or epic['created'] is None:
+                self.log.debug(('The creation date of epic {0} could not be '
+                                'found').format(key))
+                continue
+            lead_time = timestamp_difference(last_resolved, epic['created'],
+                                             epoch)
+            self.log.debug(('The lead time of epic {key} was {leadtime} '
+                            'days').format(key=key, leadtime=lead_time))
+            self.results_report.append(dict(
+                begin_date=self.vars['begin_date'],
+                end_date=self.vars['end_date'],
+                value=lead_time,
+                count=self.children[key],
+                qualifier=key,
+                epic_summary=epic['summary'],
+                epic_status=epic['status'],
+            ))
+        self.result = dict((row['qualifier'], row['value'])
+                           for row in self.results_report)
@@ -1,12 +1,6 @@
 from .BaseQuery import BaseQuery
-from .utils import date_difference
-
-
-class Transition():
-    def __init__(self, to_status, from_status, timestamp):
-        self.to_status = to_status
-        self.from_status = from_status
-        self.timestamp = timestamp
+from ..groups import group_keys
+from ..timestamps import date_timestamp, to_timestamp
 
 
 class StatusdurationQuery(BaseQuery):
@@ -17,6 +11,10 @@ class StatusdurationQuery(BaseQuery):
 
     # This means you can use --rolling in combination with --end-date
     supports_isolated_rolling = True
+    supports_window = True
+    metric_query = 'statusduration'
+    supports_streaming = True
+    fields = []
 
     query_bases = {
         'statusduration': (
@@ -37,115 +35,134 @@ class StatusdurationQuery(BaseQuery):
         if 'types' not in self.vars:
             self.vars['types'] = 'bug, story, task'
 
-    def _get_time_in_status(self, issue, target_status):
-        transitions = []
-        for history in issue.changelog.histories:
-            for item in history.items:
-                if item.field == 'status':
-                    transitions.append(Transition(
-                        item.toString, item.fromString, history.created))
-
-        begin_date, end_date = None, None
-
-        # Try to find the beginning date
-        # XXX - use `reversed(transitions)` here for a more generous result
-        for transition in transitions:
-            if transition.to_status == target_status:
-                self.log.debug(('Found a transition into the status '
-                                '"{status}" for issue '
-                                '{key} on {date}').format(
-                                    status=transition.to_status,
-                                    key=issue.key,
-                                    date=transition.timestamp))
-                begin_date = transition.timestamp
-                break
-
-        if not begin_date:
-            # If we get here, the issue never entered the target status
-            self.log.debug(('Issue {key} never entered the "{status}" '
-                            'status.').format(key=issue.key,
-                                              status=target_status))
-            return -1
-
-        # Try to find the end date
-        for transition in reversed(transitions):
-            if transition.from_status == target_status:
-                self.log.debug(('Found a transition out of the status '
-                                '"{status}" for issue '
-                                '{key} on {date}').format(
-                                    status=transition.from_status,
-                                    key=issue.key,
-                                    date=transition.timestamp))
-                end_date = transition.timestamp
-                break
-
-        # If the item is still in the target state, then use the end of the
-        # query period.
-        if not end_date:
-            end_date = self.vars['end_date']
-
-        # Or... if the found exit from the target state is after the end of
-        # the query period, then just use the end of the query period for
-        # our calculation.  It is the status duration for that card *up to
-        # the end of the query period*.
-        if end_date > self.vars['end_date']:
-            end_date = self.vars['end_date']
-
-        duration = date_difference(end_date, begin_date, self.vars['epoch'])
-        return duration
-
-    def build_results(self):
-        target_status = self.vars['argument']
-        issues = len(self.results['statusduration'])
-        in_progress_issues = self.results['statusduration_rolling']
-        self.log.debug(('{len} issues were completed during the target '
-                        'date range.').format(len=issues))
-        total_duration = 0
-        if not self.rolling:
-            for issue in self.results['statusduration']:
-                duration = self._get_time_in_status(issue, target_status)
-                if duration < 0:
-                    issues = issues - 1
-                else:
-                    self.log.debug(('Time spent in status "{status}" for '
-                                    'issue {key}: {duration} '
-                                    'days').format(status=target_status,
-                                                   key=issue.key,
-                                                   duration=duration))
-                    total_duration += duration
-        else:
+    def _get_times_in_status(self, issues, target_status):
+        # Each duration runs from the issue's first transition into the
+        # target status to its last transition out of it. If the item is
+        # still in the target state, or left it after the end of the query
+        # period, the end of the query period is used instead. It is the
+        # status duration for that card *up to the end of the query period*.
+        # Issues which never entered the target status get a duration of -1.
+        from .. import engine
+        return engine.times_in_status(
+            issues, target_status, to_timestamp(self.vars['end_date']),
+            date_timestamp(self.vars['epoch'])).tolist()
+
+    def metric_values(self, issues):
+        return [None if duration < 0 else duration for duration in
+                self._get_times_in_status(issues, self.vars['argument'])]
+
+    def start_results(self):
+        self.start_summaries()
+        if self.rolling:
             self.log.debug(('Rolling argument specified. Issues in progress '
                             'will be used to calculate status duration.'))
-            self.log.debug(('{len} issues are currently in '
-                            'progress.').format(len=len(in_progress_issues)))
-            for issue in in_progress_issues:
-                duration = self._get_time_in_status(issue, target_status)
-                if duration < self.vars['lower_bound']:
+
+    def accumulate(self, query, issues):
+        target_status = self.vars['argument']
+        if query == 'statusduration':
+            self.log.debug(('{len} issues were completed during the target '
+                            'date range.').format(len=len(issues)))
+            if self.rolling:
+                # The completed issues are counted too, they are just not
+                # timed.
+                self.add_counts(issues)
+                return
+            durations = self.metric_values(issues)
+            self.record_details('time_in_status', issues, durations)
+            for issue, duration in zip(issues, durations):
+                if duration is None:
+                    self.log.debug(('Issue {key} never entered the "{status}" '
+                                    'status.').format(key=issue.key,
+                                                      status=target_status))
                     continue
-                if duration > self.vars['upper_bound']:
+                self.log.debug(('Time spent in status "{status}" for '
+                                'issue {key}: {duration} '
+                                'days').format(status=target_status,
+                                               key=issue.key,
+                                               duration=duration))
+            self.add_values(issues, durations)
+        elif self.rolling:
+            self.log.debug(('{len} issues are currently in '
+                            'progress.').format(len=len(issues)))
+            durations = self._get_times_in_status(issues, target_status)
+            self.record_details('time_in_status', issues,
+                                [None if duration < 0 else duration
+                                 for duration in durations])
+            bounded = []
+            for issue, duration in zip(issues, durations):
+                if (duration < self.vars['lower_bound'] or
+                        duration > self.vars['upper_bound']):
+                    bounded.append(None)
                     continue
                 self.log.debug(('Time spent in status "{status}" for '
                                 'issue "{key}: {duration} '
                                 'days').format(status=target_status,
                                                key=issue.key,
                                                duration=duration))
-                total_duration += duration
-                issues += 1
+                bounded.append(duration)
+            self.add_values(issues, bounded)
 
-        start_date = self.vars['begin_date']
-        end_date = self.vars['end_date']
+    def finish_results(self):
+        count = sum(summary.count for summary in self.summaries.values())
         self.log.debug(('{count} total issues entered the target '
-                        'state').format(count=issues))
-        if not issues:
-            average_duration = float('nan')
-        else:
-            average_duration = total_duration / issues
+                        'state').format(count=count))
+        self.results_report = self.report_rows()
+        if not self.groupings():
+            self.result = self.results_report[0]['value']
+
+
+class AllstatusdurationQuery(StatusdurationQuery):
+    supports_rolling = False
+    supports_isolated_rolling = False
+    supports_window = False
+    needs_transitions = True
+    fields = ['created']
+    query_bases = {
+        'statusduration': StatusdurationQuery.query_bases['statusduration'],
+    }
+
+    def start_results(self):
+        self.summaries = {}
 
-        self.result = average_duration
-        self.results_report = [dict(
-            begin_date=start_date,
-            end_date=end_date,
-            qualifier=target_status,
-            value=average_duration,
-            count=issues,
-        )]
+    def accumulate(self, query, issues):
+        # Every status is timed in one pass over the changelogs. Visits are
+        # clipped to the query period and an issue counts towards the
+        # statuses it spent some of the period in. The end state is left
+        # out, the issues stay there once they reach it.
+        if not issues:
+            return
+        end_state = self.vars['end_state'].strip('"\'').lower()
+        statuses = issues[0].table.statuses
+        from .. import engine
+        durations = engine.times_in_statuses(
+            issues, to_timestamp(self.vars['begin_date']),
+            to_timestamp(self.vars['end_date']))
+        for code, status in enumerate(statuses):
+            if status is None or status.lower() == end_state:
+                continue
+            status_durations = durations[:, code]
+            timed = status_durations > 0
+            status_durations = status_durations[timed]
+            if not len(status_durations):
+                continue
+            timed_issues = [issue for issue, included
+                            in zip(issues, timed.tolist()) if included]
+            self.record_details('time_in_status', timed_issues,
+                                status_durations.tolist(), status)
+            for issue, duration in zip(timed_issues,
+                                       status_durations.tolist()):
+                keys = [()]
+                if self.group_by:
+                    keys = group_keys(issue, [self.group_by])
+                for key in keys:
+                    key = (status,) + key
+                    if key not in self.summaries:
+                        self.summaries[key] = self.create_summary()
+                    self.summaries[key].add(duration)
+
+    def finish_results(self):
+        # The summaries are keyed by status, then by the group.
+        self.results_report = [
+            self.report_row(summary, qualifier=key[0],
+                            **self.group_row_fields(key[1:]))
+            for key, summary in self.summaries.items()]
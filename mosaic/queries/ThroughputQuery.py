@@ -1,10 +1,14 @@
+import logging
+
 from .BaseQuery import BaseQuery
-from .utils import by_epic
+from ..stats import Summary
 
 
 class ThroughputQuery(BaseQuery):
     template = ('Between {begin_date} and {end_date}, '
                 '{value} issues transitioned to the Done state.')
+    fields = ['customfield_10002', 'customfield_10006', 'parent']
+    needs_changelog = False
     query_bases = {
         'throughput': ('PROJECT = {project} '
                        'AND TYPE IN ({types}) '
@@ -13,48 +17,62 @@ class ThroughputQuery(BaseQuery):
                        'DURING("{begin_date}", "{end_date}")')
     }
 
-    def build_results(self):
-        if self.vars['verbose']:
-            for result in self.results['throughput']:
-                print(result)
-        points = sum(
-            issue.fields.customfield_10002 or self.vars['default_points']
-            for issue in self.results['throughput'])
-        result_count = len(self.results['throughput'])
-        self.result = '{} stories {} points'.format(result_count, points)
+    supports_streaming = True
+
+    def create_summary(self):
+        # Counts issues and totals their points.
+        return Summary()
+
+    def start_results(self):
+        self.start_summaries()
+
+    def accumulate(self, query, issues):
+        points = []
+        for issue in issues:
+            if self.vars['verbose']:
+                print(issue)
+            points.append(issue.points or self.vars['default_points'])
+        self.add_values(issues, points)
+
+    def finish_results(self):
+        if not self.groupings():
+            summary = self.summaries[()]
+            self.result = '{} stories {} points'.format(summary.count,
+                                                        summary.total)
         start_date = self.vars['begin_date']
         end_date = self.vars['end_date']
-        self.results_report = [dict(
-            begin_date=start_date,
-            end_date=end_date,
-            value=result_count,
-            count=result_count,
-        )]
+        self.results_report = []
+        for key, summary in self.summaries.items():
+            row = dict(
+                begin_date=start_date,
+                end_date=end_date,
+                value=summary.count,
+                count=summary.count,
+            )
+            row.update(self.group_row_fields(key))
+            self.results_report.append(row)
+        if self.resolves_epics:
+            self.add_epic_metadata(self.results_report)
 
 
 class ThroughputbyepicQuery(ThroughputQuery):
     template = ('Between {begin_date} and {end_date}, '
                 '{value} issues transitioned to the Done state '
                 'on the {qualifier} epic.')
+    qualifier_group = 'epic'
 
-    def build_results(self):
-        epics = by_epic(self.results['throughput'])
+    def start_results(self):
+        super(ThroughputbyepicQuery, self).start_results()
+        self.unassigned_issues = []
 
-        epic_throughput = {}
-        for epic, epic_issues in epics.items():
-            epic_throughput[epic] = len(epic_issues)
+    def accumulate(self, query, issues):
+        super(ThroughputbyepicQuery, self).accumulate(query, issues)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.unassigned_issues.extend(issue.key for issue in issues
+                                          if issue.epic is None)
 
-        unassigned_issues_list = [issue.key for issue in epics['UNASSIGNED']]
-        unassigned_issues = ', '.join(unassigned_issues_list)
+    def finish_results(self):
+        unassigned_issues = ', '.join(self.unassigned_issues)
         msg = 'The following issues were not assigned to an epic: {0}'
         self.log.debug(msg.format(unassigned_issues))
-
-        start_date = self.vars['begin_date']
-        end_date = self.vars['end_date']
-        self.results_report = [dict(
-            begin_date=start_date,
-            end_date=end_date,
-            value=throughput,
-            count=throughput,
-            qualifier=epic,
-        ) for epic, throughput in epic_throughput.items()]
+        super(ThroughputbyepicQuery, self).finish_results()
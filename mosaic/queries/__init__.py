@@ -2,9 +2,13 @@ from .ThroughputQuery import ThroughputQuery
 from .ThroughputQuery import ThroughputbyepicQuery
 from .LeadtimeQuery import LeadtimeQuery
 from .LeadtimeQuery import LeadtimebyepicQuery
+from .LeadtimeQuery import EpicleadtimeQuery
 from .CycletimeQuery import CycletimeQuery
 from .CycletimeQuery import PrioritycycletimeQuery
 from .StatusdurationQuery import StatusdurationQuery
+from .StatusdurationQuery import AllstatusdurationQuery
+from .ForecastQuery import ForecastQuery
+from .CfdQuery import CfdQuery
 
 
 query_map = {
@@ -12,7 +16,11 @@ query_map = {
     'throughputbyepic': ThroughputbyepicQuery,
     'leadtime': LeadtimeQuery,
     'leadtimebyepic': LeadtimebyepicQuery,
+    'epicleadtime': EpicleadtimeQuery,
     'cycletime': CycletimeQuery,
     'prioritycycletime': PrioritycycletimeQuery,
-    'statusduration': StatusdurationQuery
+    'statusduration': StatusdurationQuery,
+    'allstatusduration': AllstatusdurationQuery,
+    'forecast': ForecastQuery,
+    'cfd': CfdQuery,
 }
@@ -1,49 +1,9 @@
-import datetime
-
-
-def by_epic(issues):
-    epics = {}
-    for issue in issues:
-        if hasattr(issue.fields, 'customfield_10006'):
-            parent_epic = issue.fields.customfield_10006
-            if parent_epic is not None:
-                if parent_epic not in epics:
-                    epics[parent_epic] = []
-                epics[parent_epic].append(issue)
-            else:
-                if 'UNASSIGNED' not in epics:
-                    epics['UNASSIGNED'] = []
-                epics['UNASSIGNED'].append(issue)
-        else:
-            if 'UNASSIGNED' not in epics:
-                epics['UNASSIGNED'] = []
-            epics['UNASSIGNED'].append(issue)
-    return epics
+from ..timestamps import (date_timestamp, is_date, timestamp_difference,
+                          to_timestamp)
 
 
 def date_difference(later_date, earlier_date, epoch):
-    try:
-        date_format = '%Y-%m-%dT%H:%M:%S'
-        later_date = later_date[0:19]
-        earlier_date = earlier_date[0:19]
-        later_date_object = datetime.datetime.strptime(later_date,
-                                                       date_format)
-        earlier_date_object = datetime.datetime.strptime(earlier_date,
-                                                         date_format)
-        if later_date_object.date() < epoch:
-            return float('-inf')
-        difference = (later_date_object - earlier_date_object).total_seconds()
-        # Convert difference to days.
-        return difference / float(60 * 60 * 24)
-    except ValueError:
-        date_format = '%Y-%m-%d'
-        later_date = later_date[0:10]
-        earlier_date = earlier_date[0:10]
-        later_date_object = datetime.datetime.strptime(later_date,
-                                                       date_format)
-        earlier_date_object = datetime.datetime.strptime(earlier_date,
-                                                         date_format)
-        if later_date_object.date() < epoch:
-            return float('-inf')
-        difference = (later_date_object - earlier_date_object).days
-        return difference
+    date_only = is_date(later_date) or is_date(earlier_date)
+    return timestamp_difference(to_timestamp(later_date),
+                                to_timestamp(earlier_date),
+                                date_timestamp(epoch), date_only)
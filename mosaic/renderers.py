@@ -1,9 +1,21 @@
-import yaml
+from .stats import percentile_label
+
+
+def percentile_labels(query):
+    return [percentile_label(p) for p in query.vars.get('percentiles', [])]
 
 
 def results_to_text(query, results):
     for result in results:
-        yield query.template.format(**result)
+        line = query.template.format(**result)
+        if 'group' in result:
+            line = '{0} {1}: {2}'.format(query.group_by, result['group'],
+                                         line)
+        if 'percentiles' in result:
+            line += ' Percentiles: ' + ', '.join(
+                '{0} {1}'.format(label, result['percentiles'][label])
+                for label in percentile_labels(query))
+        yield line
 
 
 def results_to_csv(query, results):
@@ -12,14 +24,24 @@ def results_to_csv(query, results):
     for result in results:
         # Set a default value
         result['qualifier'] = result.get('qualifier', '')
-        yield template.format(
+        line = template.format(
             project=query.vars['project'],
             rolling=query.rolling,
             **result)
+        if 'group' in result:
+            line += ',{0}'.format(result['group'])
+        if 'percentiles' in result:
+            line += ''.join(',{0}'.format(result['percentiles'][label])
+                            for label in percentile_labels(query))
+        yield line
 
 
 def results_to_yaml(query, results):
-    yield yaml.dumps(results)
+    import yaml
+    # Each result is dumped as an item of the document's list on its own, so
+    # the items are written out as they are rendered.
+    for result in results:
+        yield yaml.dump([result], default_flow_style=False).rstrip('\n')
     yield "---"
 
 
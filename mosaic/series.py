@@ -0,0 +1,47 @@
+import datetime
+
+from bisect import bisect_left
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+# Split the range from begin_date to end_date into consecutive periods of
+# `weeks` weeks. The final period is cut short at end_date.
+def series_periods(begin_date, end_date, weeks):
+    if weeks < 1:
+        raise Exception('The series argument must be at least one week.')
+    begin, end = parse_date(begin_date), parse_date(end_date)
+    step = datetime.timedelta(weeks=weeks)
+    periods = []
+    while begin < end:
+        period_end = min(begin + step, end)
+        periods.append((str(begin), str(period_end)))
+        begin = period_end
+    return periods
+
+
+# A sorted index of the times a list of issues transitioned into a status,
+# used to pick out the issues which entered it during a period without
+# rescanning every changelog for each period.
+class TransitionIndex(object):
+    def __init__(self, issues, status):
+        status = status.strip('"\'').lower()
+        entries = []
+        for position, issue in enumerate(issues):
+            for _, to_status, timestamp in issue.status_transitions():
+                if to_status is not None and to_status.lower() == status:
+                    entries.append((timestamp, position))
+        entries.sort()
+        self.issues = issues
+        self.timestamps = [timestamp for timestamp, _ in entries]
+        self.positions = [position for _, position in entries]
+
+    # The issues which entered the status at or after `begin` and before
+    # `end`, in their original order.
+    def between(self, begin, end):
+        start = bisect_left(self.timestamps, begin)
+        stop = bisect_left(self.timestamps, end)
+        positions = sorted(set(self.positions[start:stop]))
+        return [self.issues[position] for position in positions]
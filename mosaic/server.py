@@ -0,0 +1,286 @@
+#! /usr/bin/env python3
+
+import datetime
+import json
+import logging
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+from .cache import CachedIssueFetcher, MemoryIssueCache
+from .fetch import DEFAULT_PAGE_SIZE, DEFAULT_RETRIES, DEFAULT_WORKERS
+from .mosaic import build_parser, create_client, execute, log, render
+from .queries import query_map
+from .renderers import renderer_map
+
+
+DEFAULT_PORT = 8080
+DEFAULT_REFRESH_INTERVAL = 300
+DEFAULT_MAX_SEARCHES = 500
+
+# The request parameters which override the server's command line settings,
+# and the argument each of them sets.
+PARAMETERS = {
+    'project': 'project',
+    'begin_date': 'begin_date',
+    'end_date': 'end_date',
+    'end_state': 'end_state',
+    'argument': 'query_argument',
+    'types': 'types',
+    'epoch': 'epoch',
+    'percentiles': 'percentiles',
+    'group_by': 'group_by',
+    'rolling': 'rolling',
+    'query_append': 'query_append',
+    'lower_bound': 'lower_bound',
+    'upper_bound': 'upper_bound',
+    'output': 'output',
+}
+
+# The command line arguments which only apply to a single run, such as the
+# file --details writes, and which mosaic-server therefore rejects.
+SINGLE_RUN_ARGUMENTS = [
+    ('details', 'details'),
+    ('output_file', 'output-file'),
+    ('cache_dir', 'cache-dir'),
+    ('offline', 'offline'),
+    ('use_async', 'async'),
+    ('stream', 'stream'),
+    ('profile', 'profile'),
+    ('profile_dump', 'profile-dump'),
+    ('metrics_output', 'metrics-output'),
+]
+
+
+class RequestError(Exception):
+    pass
+
+
+# Serves query results from issues kept in memory.
+#
+# Each project gets a MemoryIssueCache which the searches of every request
+# go through, so an issue is only fetched from JIRA once. A background
+# thread refreshes the caches with the issues updated since the previous
+# refresh and re-evaluates the stored searches against them, without
+# holding up the requests. Rendered responses are kept until the next
+# refresh changes the issues they were computed from, so repeated requests
+# are answered without recomputing.
+class MetricsService(object):
+    def __init__(self, args, client=None,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self.args = args
+        self.client = client or create_client(args)
+        self.refresh_interval = refresh_interval
+        self.caches = {}
+        self.responses = {}
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+
+    def cache(self, project):
+        if project not in self.caches:
+            self.caches[project] = MemoryIssueCache(
+                self.args['server'], project,
+                max_searches=self.args.get('max_searches',
+                                           DEFAULT_MAX_SEARCHES))
+        return self.caches[project]
+
+    def fetcher(self, project):
+        fetcher = CachedIssueFetcher(
+            self.client, log, self.cache(project),
+            local=self.args.get('local_jql', False),
+            workers=self.args.get('fetch_workers', DEFAULT_WORKERS),
+            page_size=self.args.get('page_size', DEFAULT_PAGE_SIZE),
+            retries=self.args.get('fetch_retries', DEFAULT_RETRIES))
+        # Refreshes are left to the background thread.
+        fetcher.refreshed = fetcher.cache.synced is not None
+        return fetcher
+
+    def request_args(self, parameters):
+        today = datetime.date.today()
+        args = dict(self.args,
+                    begin_date=str(today - datetime.timedelta(days=14)),
+                    end_date=str(today),
+                    epoch=str(today - datetime.timedelta(days=364)),
+                    output='json', stream=False)
+        queries = parameters.pop('query', [])
+        for query in queries:
+            if query not in query_map:
+                raise RequestError('Unknown query: {0}'.format(query))
+        if not queries:
+            raise RequestError('At least one query parameter is required.')
+        args['query'] = queries
+        for name, values in parameters.items():
+            if name not in PARAMETERS:
+                raise RequestError('Unknown parameter: {0}'.format(name))
+            args[PARAMETERS[name]] = values[-1]
+        args['rolling'] = str(args.get('rolling')).lower() in ('1', 'true')
+        if args['output'] != 'json' and args['output'] not in renderer_map:
+            raise RequestError('Unknown output: {0}'.format(args['output']))
+        return args
+
+    def response_key(self, args):
+        generation = self.cache(args['project']).generation
+        return (generation, json.dumps(args, sort_keys=True, default=str))
+
+    def metrics(self, parameters):
+        args = self.request_args(parameters)
+        key = self.response_key(args)
+        responses = self.responses.get(args['project'], {})
+        if key in responses:
+            return responses[key]
+        generation = key[0]
+        with self.lock:
+            queries = execute(args, fetcher=self.fetcher(args['project']))
+            if args['output'] == 'json':
+                body = json.dumps({'queries': [
+                    dict(query=query.query_name,
+                         template=query.template,
+                         results=query.results_report)
+                    for query in queries]}, default=str)
+                response = ('application/json', body)
+            else:
+                body = '\n'.join(render(args, queries)) + '\n'
+                response = ('text/plain', body)
+            # The first request for a project starts its sync generations.
+            # A response computed while a refresh moved them on may have
+            # missed its changes, and is not kept.
+            key = self.response_key(args)
+            if generation and key[0] != generation:
+                return response
+            # Responses of the project's older generations can never be
+            # asked for again.
+            responses = dict(
+                (response_key, value) for response_key, value
+                in self.responses.get(args['project'], {}).items()
+                if response_key[0] >= key[0])
+            responses[key] = response
+            self.responses[args['project']] = responses
+        return response
+
+    def status(self):
+        return ('application/json', json.dumps({
+            'projects': dict(
+                (project, {'generation': cache.generation,
+                           'synced': cache.synced,
+                           'issues': len(cache.issues),
+                           'searches': len(cache.searches)})
+                for project, cache in self.caches.items()),
+            'responses': sum(len(responses)
+                             for responses in self.responses.values()),
+        }))
+
+    # Requests go on being answered while JIRA is asked for the changes,
+    # the caches guard their own state.
+    def refresh(self):
+        for project in list(self.caches):
+            fetcher = self.fetcher(project)
+            fetcher.refresh()
+            for jql in fetcher.cache.stored_searches():
+                fetcher.search_keys(jql)
+
+    def refresh_forever(self):
+        while not self.stopped.wait(self.refresh_interval):
+            try:
+                start = time.time()
+                self.refresh()
+                log.debug('Refreshed the issue caches in {0:.1f}s'.format(
+                    time.time() - start))
+            except Exception:
+                log.exception('Refreshing the issue caches failed')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            if url.path == '/metrics':
+                content_type, body = self.server.service.metrics(
+                    parse_qs(url.query))
+            elif url.path == '/queries':
+                content_type = 'application/json'
+                body = json.dumps(sorted(query_map.keys()))
+            elif url.path == '/status':
+                content_type, body = self.server.service.status()
+            else:
+                self.send_error(404)
+                return
+        except RequestError as error:
+            self.send_error(400, str(error))
+            return
+        except Exception as error:
+            log.exception('Request failed: {0}'.format(self.path))
+            self.send_error(500, str(error))
+            return
+        payload = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        HTTPServer.__init__(self, address, MetricsHandler)
+        self.service = service
+
+
+def parse_args():
+    desc = ('Serve metrics calculated from JIRA data over HTTP, from issues '
+            'kept in memory between requests')
+    parser = build_parser(desc)
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='The address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help='The port to listen on')
+    parser.add_argument('--refresh-interval', type=int,
+                        default=DEFAULT_REFRESH_INTERVAL,
+                        help=('How many seconds to wait between refreshes '
+                              'of the issues held in memory'))
+    parser.add_argument('--max-searches', type=int,
+                        default=DEFAULT_MAX_SEARCHES,
+                        help=('How many searches to keep and re-evaluate '
+                              'on every refresh, per project. The least '
+                              'recently used are forgotten first'))
+    return vars(parser.parse_args())
+
+
+def main():
+    args = parse_args()
+    if args['verbose']:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+
+    for name, flag in SINGLE_RUN_ARGUMENTS:
+        if args[name]:
+            log.error('The {0} argument is not supported in server '
+                      'mode.'.format(flag))
+            sys.exit(1)
+    service = MetricsService(args, refresh_interval=args['refresh_interval'])
+    refresher = threading.Thread(target=service.refresh_forever)
+    refresher.daemon = True
+    refresher.start()
+    server = MetricsServer((args['host'], args['port']), service)
+    log.info('Serving metrics on http://{0}:{1}/metrics'.format(
+        args['host'], args['port']))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stopped.set()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+import math
+
+
+DEFAULT_PERCENTILES = [50, 85, 95]
+
+
+def parse_percentiles(value):
+    if not value:
+        return []
+    percentiles = [float(p) for p in str(value).split(',') if p.strip()]
+    for percentile in percentiles:
+        if not 0 <= percentile <= 100:
+            msg = 'Percentiles must be between 0 and 100, not {0}'
+            raise Exception(msg.format(percentile))
+    return percentiles
+
+
+def percentile_label(percentile):
+    return 'p{0:g}'.format(percentile)
+
+
+def _interpolate(lower, upper, fraction):
+    if fraction == 0 or lower == upper:
+        return lower
+    return lower + (upper - lower) * fraction
+
+
+# Percentiles of an unsorted sequence, interpolating linearly between the
+# closest ranks like numpy.percentile does.
+def percentiles(values, percentiles):
+    ordered = sorted(values)
+    result = {}
+    for percentile in percentiles:
+        if not ordered:
+            result[percentile_label(percentile)] = float('nan')
+            continue
+        rank = percentile / 100.0 * (len(ordered) - 1)
+        lower = int(math.floor(rank))
+        upper = min(lower + 1, len(ordered) - 1)
+        result[percentile_label(percentile)] = _interpolate(
+            ordered[lower], ordered[upper], rank - lower)
+    return result
+
+
+# The running count, total and mean of a metric. The individual values are
+# only kept when percentiles of them were asked for.
+class Summary(object):
+    def __init__(self, percentiles=None):
+        self.percentiles = percentiles or []
+        self.count = 0
+        self.total = 0
+        self.values = [] if self.percentiles else None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.values is not None:
+            self.values.append(value)
+
+    def mean(self):
+        if not self.count:
+            return float('nan')
+        return self.total / self.count
+
+    def percentile_values(self):
+        return percentiles(self.values or [], self.percentiles)
+
+
+# An order-statistic multiset over a known universe of values.
+#
+# Values are mapped to their rank in the universe and counted in a Fenwick
+# tree, so adding or removing a value and finding the k-th smallest value
+# present are all O(log n). This lets percentiles over a sliding window be
+# maintained as values enter and leave it rather than re-sorting the window
+# every time it moves.
+class OrderStatistics(object):
+    def __init__(self, universe):
+        self.values = sorted(set(universe))
+        self.ranks = dict((value, rank)
+                          for rank, value in enumerate(self.values))
+        self.tree = [0] * (len(self.values) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._top = 1
+        while self._top * 2 <= len(self.values):
+            self._top *= 2
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value, count=1):
+        position = self.ranks[value] + 1
+        while position < len(self.tree):
+            self.tree[position] += count
+            position += position & -position
+        self.count += count
+        self.total += value * count
+
+    def remove(self, value):
+        self.add(value, -1)
+
+    def mean(self):
+        if not self.count:
+            return float('nan')
+        return self.total / self.count
+
+    # The k-th smallest value present, counting from zero.
+    def kth(self, k):
+        position, remaining = 0, k + 1
+        step = self._top
+        while step:
+            candidate = position + step
+            if (candidate < len(self.tree) and
+                    self.tree[candidate] < remaining):
+                position = candidate
+                remaining -= self.tree[candidate]
+            step //= 2
+        return self.values[position]
+
+    def percentiles(self, percentiles):
+        result = {}
+        for percentile in percentiles:
+            if not self.count:
+                result[percentile_label(percentile)] = float('nan')
+                continue
+            rank = percentile / 100.0 * (self.count - 1)
+            lower = int(math.floor(rank))
+            upper = min(lower + 1, self.count - 1)
+            result[percentile_label(percentile)] = _interpolate(
+                self.kth(lower), self.kth(upper), rank - lower)
+        return result
+
+
+# Statistics of the values in a window of `days` days sliding over a series.
+#
+# `events` are (timestamp, key, value) tuples, where the key identifies the
+# issue a value belongs to so an issue with several events in the window is
+# only counted once. For every window end in `ends` (ascending timestamps),
+# yields the count, mean and percentiles of the values with an event in
+# [end - days, end). Values that are not finite, such as the -inf given to
+# issues resolved before the epoch, are left out.
+def sliding_window(events, ends, days, percentiles):
+    events = sorted((event for event in events
+                     if not math.isinf(event[2]) and not math.isnan(event[2])),
+                    key=lambda event: event[0])
+    window = OrderStatistics(value for _, _, value in events)
+    length = days * 60 * 60 * 24
+    in_window = {}
+    entered = left = 0
+    for end in ends:
+        while entered < len(events) and events[entered][0] < end:
+            _, key, value = events[entered]
+            in_window[key] = in_window.get(key, 0) + 1
+            if in_window[key] == 1:
+                window.add(value)
+            entered += 1
+        while left < entered and events[left][0] < end - length:
+            _, key, value = events[left]
+            in_window[key] -= 1
+            if not in_window[key]:
+                window.remove(value)
+            left += 1
+        yield len(window), window.mean(), window.percentiles(percentiles)
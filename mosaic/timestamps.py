@@ -0,0 +1,86 @@
+import calendar
+import datetime
+
+from functools import lru_cache
+
+
+SECONDS_PER_DAY = 60 * 60 * 24
+
+# Changelog timestamps repeat heavily across the searches of a run (the same
+# issues are shared between queries and re-read from the cache), so parsed
+# values are memoized up to this many distinct strings.
+PARSE_CACHE_SIZE = 2 ** 16
+
+
+def _epoch_days(year, month, day):
+    # Days since 1970-01-01 in the proleptic Gregorian calendar.
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = (year_of_era * 365 + year_of_era // 4 - year_of_era // 100 +
+                  day_of_year)
+    return era * 146097 + day_of_era - 719468
+
+
+def _utc_offset(value):
+    if not value or value == 'Z':
+        return 0
+    if value[0] not in '+-':
+        raise ValueError(value)
+    digits = value[1:].replace(':', '')
+    if len(digits) not in (2, 4) or not digits.isdigit():
+        raise ValueError(value)
+    offset = int(digits[0:2]) * 3600 + int(digits[2:4] or 0) * 60
+    return -offset if value[0] == '-' else offset
+
+
+def is_date(value):
+    return len(value) == 10
+
+
+# Convert a JIRA date ("2018-01-05") or ISO 8601 datetime
+# ("2018-01-05T10:20:30.000+0000") to UTC epoch seconds. Dates are taken as
+# midnight UTC and fractions of a second are dropped.
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def to_timestamp(value):
+    try:
+        if value[4] != '-' or value[7] != '-':
+            raise ValueError(value)
+        days = _epoch_days(int(value[0:4]), int(value[5:7]),
+                           int(value[8:10]))
+        if is_date(value):
+            return days * SECONDS_PER_DAY
+        if value[10] not in 'T ' or value[13] != ':' or value[16] != ':':
+            raise ValueError(value)
+        seconds = (int(value[11:13]) * 3600 + int(value[14:16]) * 60 +
+                   int(value[17:19]))
+        rest = value[19:]
+        if rest.startswith('.'):
+            end = 1
+            while end < len(rest) and rest[end].isdigit():
+                end += 1
+            rest = rest[end:]
+        return days * SECONDS_PER_DAY + seconds - _utc_offset(rest)
+    except (IndexError, TypeError, ValueError):
+        raise ValueError('Unrecognized timestamp: {0!r}'.format(value))
+
+
+def date_timestamp(date):
+    return calendar.timegm(date.timetuple())
+
+
+def format_timestamp(timestamp):
+    epoch = datetime.datetime(1970, 1, 1)
+    return (epoch + datetime.timedelta(seconds=timestamp)).isoformat()
+
+
+# The difference between two timestamps in days, or -inf when the later one
+# is before `epoch`. When either side of the difference is only a date,
+# whole days are compared.
+def timestamp_difference(later, earlier, epoch, date_only=False):
+    if later < epoch:
+        return float('-inf')
+    if date_only:
+        return later // SECONDS_PER_DAY - earlier // SECONDS_PER_DAY
+    return (later - earlier) / float(SECONDS_PER_DAY)
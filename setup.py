@@ -10,8 +10,15 @@ setup(name='mosaic',
       description='Mosaic tool for JIRA reporting',
       author='Alex Corvin',
       author_email='acorvin@redhat.com',
-      packages=find_packages(),
+      packages=find_packages(exclude=['tests', 'tests.*']),
+      python_requires='>=3.6',
       install_requires=requirements,
+      extras_require={
+          'async': ['aiohttp'],
+          'arrow': ['pyarrow'],
+      },
       entry_points={
-          'console_scripts': ['mosaic=mosaic.mosaic:main']
+          'console_scripts': ['mosaic=mosaic.mosaic:main',
+                              'mosaic-batch=mosaic.batch:main',
+                              'mosaic-server=mosaic.server:main']
       })
@@ -0,0 +1,235 @@
+import collections
+import datetime
+import json
+import random
+import re
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+
+# A fake JIRA server for the tests: the parts of the REST API mosaic uses,
+# served on a local port so that the real jira client talks to it over HTTP.
+#
+# Searches are answered from `searches`, a mapping of JQL to a predicate
+# over raw issues registered by each test, plus `key in (...)` lookups and
+# the `updated >= "..."` clause the issue cache appends to its searches.
+# Any other JQL is rejected with a 400, like JIRA does with invalid JQL.
+
+JIRA_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.000+0000'
+# The custom fields holding an issue's epic link and story points.
+EPIC_FIELD = 'customfield_10006'
+POINTS_FIELD = 'customfield_10002'
+CATEGORIES = {
+    'To Do': 'To Do',
+    'Next': 'To Do',
+    'In Progress': 'In Progress',
+    'Review': 'In Progress',
+    'Done': 'Done',
+}
+PRIORITIES = ['Blocker', 'Major', 'Minor']
+TYPES = ['Bug', 'Story', 'Task']
+LABELS = ['backend', 'frontend', 'docs']
+COMPONENTS = ['api', 'ui']
+
+KEY_SEARCH = re.compile(r'^key in \(([^()]*)\)$', re.I)
+UPDATED_CLAUSE = re.compile(r'^(?P<jql>.*) AND updated >= "(?P<since>[^"]+)"$')
+
+
+def jira_time(moment):
+    return moment.strftime(JIRA_TIME_FORMAT)
+
+
+def make_issue(key, created, changes, **fields):
+    histories = []
+    for moment, from_status, to_status in changes:
+        histories.append({
+            'created': jira_time(moment),
+            'items': [{'field': 'status', 'fromString': from_status,
+                       'toString': to_status}],
+        })
+    status = changes[-1][2] if changes else 'To Do'
+    issue_fields = {
+        'created': jira_time(created),
+        'updated': jira_time(changes[-1][0] if changes else created),
+        'resolutiondate': (jira_time(changes[-1][0])
+                           if status == 'Done' else None),
+        'status': {'name': status,
+                   'statusCategory': {'name': CATEGORIES[status]}},
+        'priority': {'name': 'Major'},
+        'issuetype': {'name': 'Story'},
+        'labels': [],
+        'components': [],
+        EPIC_FIELD: None,
+        POINTS_FIELD: None,
+    }
+    issue_fields.update(fields)
+    return {'key': key, 'fields': issue_fields,
+            'changelog': {'startAt': 0, 'maxResults': len(histories),
+                          'total': len(histories), 'histories': histories}}
+
+
+# Issues walking the To Do, Next, In Progress, Review, Done workflow over
+# 2018, bouncing back from review now and then and not all of them done.
+def generate_issues(count, seed=0, project='P'):
+    rnd = random.Random(seed)
+    start = datetime.datetime(2018, 1, 1)
+    issues = []
+    for number in range(count):
+        created = start + datetime.timedelta(
+            minutes=rnd.randint(0, 300 * 24 * 60))
+        path = ['In Progress', 'Review']
+        if rnd.random() < 0.3:
+            path = ['Next'] + path
+        while rnd.random() < 0.3:
+            path.extend(['In Progress', 'Review'])
+        path.append('Done')
+        path = path[:rnd.randint(0, len(path))]
+        moment, status, changes = created, 'To Do', []
+        for to_status in path:
+            moment += datetime.timedelta(minutes=rnd.randint(30, 8 * 24 * 60))
+            changes.append((moment, status, to_status))
+            status = to_status
+        issues.append(make_issue(
+            '{0}-{1}'.format(project, number + 1), created, changes,
+            priority={'name': rnd.choice(PRIORITIES)},
+            issuetype={'name': rnd.choice(TYPES)},
+            labels=rnd.sample(LABELS, rnd.randint(0, 2)),
+            components=[{'name': name} for name in
+                        rnd.sample(COMPONENTS, rnd.randint(0, 2))],
+            **{EPIC_FIELD: rnd.choice(['E-1', 'E-2', None]),
+               POINTS_FIELD: rnd.choice([1.0, 3.0, None])}))
+    return issues
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeJira(object):
+    def __init__(self, issues=(), max_results=1000):
+        self.issues = collections.OrderedDict(
+            (issue['key'], issue) for issue in issues)
+        self.searches = {}
+        self.max_results = max_results
+        self.failures = collections.deque()
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = None
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = dict((name, ','.join(values)) for name, values in
+                              parse_qs(url.query).items())
+                status, headers, body = fake.handle(url.path, params)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps(body).encode('utf-8'))
+
+        self.server = FakeServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+
+    def client(self):
+        import jira
+        return jira.JIRA(self.url, get_server_info=False, max_retries=0)
+
+    # Answer the next search with an error status instead.
+    def fail(self, status, retry_after=None):
+        self.failures.append((status, retry_after))
+
+    def update(self, issue):
+        self.issues[issue['key']] = issue
+
+    def remove(self, key):
+        del self.issues[key]
+
+    def searched(self):
+        return [params['jql'] for path, params in self.requests
+                if path.endswith('/search')]
+
+    def handle(self, path, params):
+        if path.endswith('/field'):
+            return 200, {}, []
+        with self.lock:
+            self.requests.append((path, params))
+            failure = (self.failures.popleft() if self.failures and
+                       path.endswith('/search') else None)
+        if failure is not None:
+            status, retry_after = failure
+            headers = {}
+            if retry_after is not None:
+                headers['Retry-After'] = str(retry_after)
+            return status, headers, {'errorMessages': ['Failure']}
+        if path.endswith('/search'):
+            return self.search(params)
+        return 404, {}, {'errorMessages': ['Not found']}
+
+    def matching(self, jql, validate):
+        match = KEY_SEARCH.match(jql)
+        if match:
+            keys = [key.strip() for key in match.group(1).split(',')]
+            unknown = [key for key in keys if key not in self.issues]
+            if unknown and validate:
+                raise ValueError(("An issue with key '{0}' does not exist "
+                                  "for field 'key'.").format(unknown[0]))
+            return [self.issues[key] for key in keys if key in self.issues]
+        match = UPDATED_CLAUSE.match(jql)
+        if match:
+            base = match.group('jql')
+            if base.startswith('(') and base.endswith(')'):
+                base = base[1:-1]
+            since = match.group('since').replace(' ', 'T')
+            return [issue for issue in self.matching(base, validate)
+                    if issue['fields']['updated'][:16] >= since]
+        if jql not in self.searches:
+            raise ValueError('Unsupported JQL: {0}'.format(jql))
+        return [issue for issue in self.issues.values()
+                if self.searches[jql](issue)]
+
+    def search(self, params):
+        validate = params.get('validateQuery', 'true').lower() != 'false'
+        try:
+            issues = self.matching(params['jql'], validate)
+        except ValueError as error:
+            return 400, {}, {'errorMessages': [str(error)]}
+        start = int(params.get('startAt', 0))
+        page_size = min(int(params.get('maxResults', 50)), self.max_results)
+        fields = [field for field in params.get('fields', '').split(',')
+                  if field]
+        expand = params.get('expand') or ''
+        page = []
+        for issue in issues[start:start + page_size]:
+            result = {'key': issue['key'], 'fields': issue['fields']}
+            if fields and '*all' not in fields:
+                result['fields'] = dict(
+                    (field, issue['fields'][field]) for field in fields
+                    if field in issue['fields'])
+            if 'changelog' in expand:
+                result['changelog'] = issue['changelog']
+            page.append(result)
+        return 200, {}, {'startAt': start, 'maxResults': page_size,
+                         'total': len(issues), 'issues': page}
@@ -0,0 +1,69 @@
+import sys
+
+import pytest
+
+from mosaic import batch
+from mosaic.fetch import normalize_jql
+from mosaic.mosaic import build_queries
+
+from tests.fakejira import FakeJira, generate_issues
+
+
+@pytest.fixture
+def jira(monkeypatch):
+    issues = generate_issues(200) + generate_issues(200, seed=1, project='Q')
+    with FakeJira(issues) as fake:
+        # The jobs share the client of the server, as they would once it
+        # has authenticated.
+        monkeypatch.setitem(batch._clients, (fake.url, 'cert'),
+                            fake.client())
+        yield fake
+
+
+def build_jobs(jira, monkeypatch, *argv):
+    argv = ['mosaic-batch', '-s', jira.url, '-c', 'cert'] + list(argv)
+    monkeypatch.setattr(sys, 'argv', argv)
+    jobs = batch.build_jobs(batch.parse_args())
+    for job in jobs:
+        prefix = job['project'] + '-'
+        for query in build_queries(job, None):
+            for jql in query.queries.values():
+                jira.searches[normalize_jql(jql)] = (
+                    lambda issue, prefix=prefix: issue['key'].startswith(
+                        prefix))
+    return jobs
+
+
+def test_jobs_files_may_leave_dates_unquoted(jira, monkeypatch, tmp_path):
+    path = tmp_path / 'jobs.yaml'
+    path.write_text(u'\n'.join([
+        '- project: P',
+        '  query: statusduration',
+        '  query_argument: Review',
+        '  begin_date: 2018-03-01',
+        '  end_date: 2018-09-01',
+        '  epoch: 2018-01-01',
+    ]))
+    jobs = build_jobs(jira, monkeypatch, '--jobs', str(path))
+    quoted = build_jobs(jira, monkeypatch, '-q', 'statusduration',
+                        '-a', 'Review', '-b', '2018-03-01', '-e', '2018-09-01',
+                        '-E', '2018-01-01', 'P')
+    assert jobs[0]['begin_date'] == '2018-03-01'
+    assert jobs[0]['epoch'] == '2018-01-01'
+    (lines, _, error, _), = batch.run_batch(jobs)
+    assert error is None
+    assert lines == batch.run_batch(quoted)[0][0]
+
+
+def test_jobs_count_their_own_requests(jira, monkeypatch):
+    jobs = build_jobs(jira, monkeypatch, '-q', 'throughput', '-q', 'leadtime',
+                      '-b', '2018-03-01', '-e', '2018-09-01', '-E',
+                      '2018-01-01', 'P', 'Q')
+    jobs[0]['page_size'] = 10
+    alone = [batch.run_job(job)[3][1]['http_requests'] for job in jobs]
+    assert alone[0] > alone[1]
+    results = batch.run_batch(jobs * 3, workers=6)
+    assert [profile[1]['http_requests'] for _, _, _, profile in results] == (
+        alone * 3)
+    session = batch._clients[(jira.url, 'cert')]._session
+    assert session.hooks['response'] == []
@@ -0,0 +1,182 @@
+import copy
+import datetime
+import logging
+
+import pytest
+
+from mosaic.cache import CachedIssueFetcher, IssueCache, MemoryIssueCache
+from mosaic.issues import IssueTable, raw_facts
+from mosaic.mosaic import build_queries
+from mosaic.profiling import Profiler
+
+from tests.fakejira import FakeJira, generate_issues, jira_time
+
+
+log = logging.getLogger('mosaic.tests')
+
+SEARCH = 'PROJECT = P AND priority = Major'
+
+
+def is_major(issue):
+    return issue['fields']['priority']['name'] == 'Major'
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def cache(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryIssueCache('server', 'P')
+    return IssueCache(str(tmp_path), 'server', 'P')
+
+
+@pytest.fixture
+def jira():
+    with FakeJira(generate_issues(300), max_results=50) as fake:
+        fake.searches['PROJECT = P'] = lambda issue: True
+        fake.searches[SEARCH] = is_major
+        yield fake
+
+
+# A fetcher for one run of mosaic, the requests it makes recorded apart
+# from the earlier runs'.
+def run(jira, cache, **kwargs):
+    del jira.requests[:]
+    return CachedIssueFetcher(jira.client(), log, cache, workers=2,
+                              profiler=Profiler(), **kwargs)
+
+
+def expected(jira, predicate=is_major):
+    return [key for key, issue in jira.issues.items() if predicate(issue)]
+
+
+def change(jira, key, **fields):
+    issue = copy.deepcopy(jira.issues[key])
+    issue['fields'].update(fields)
+    issue['fields']['updated'] = jira_time(datetime.datetime.now())
+    jira.update(issue)
+
+
+def test_issues_are_fetched_once(jira, cache):
+    issues = run(jira, cache).search(SEARCH)
+    assert [issue.key for issue in issues] == expected(jira)
+    assert [issue.priority for issue in issues] == ['Major'] * len(issues)
+    # The search is listed a page of keys at a time, then its issues are
+    # fetched with their changelogs by key.
+    searched = jira.searched()
+    pages = -(-len(issues) // 50)
+    assert searched[:pages] == [SEARCH] * pages
+    assert all(jql.startswith('key in (') for jql in searched[pages:])
+
+    fetcher = run(jira, cache)
+    issues = fetcher.search(SEARCH)
+    assert [issue.key for issue in issues] == expected(jira)
+    # Only the refresh, the listing of the project's keys and the search's
+    # re-evaluation go to JIRA, and nothing is fetched since nothing
+    # changed or was deleted.
+    searched = set(jira.searched())
+    assert len(searched) == 3
+    assert 'PROJECT = P' in searched
+    assert all('updated >= ' in jql for jql in searched
+               if jql != 'PROJECT = P')
+    assert fetcher.profiler.counters['cache_hits'] == 1
+
+
+def test_changed_issues_are_re_evaluated(jira, cache):
+    run(jira, cache).search(SEARCH)
+    majors = expected(jira)
+    others = [key for key in jira.issues if key not in majors]
+    change(jira, majors[0], priority={'name': 'Minor'})
+    change(jira, others[0], priority={'name': 'Major'})
+    change(jira, others[1], summary='Renamed')
+
+    fetcher = run(jira, cache)
+    issues = fetcher.search(SEARCH)
+    assert sorted(issue.key for issue in issues) == sorted(expected(jira))
+    assert majors[0] not in [issue.key for issue in issues]
+    moved = [issue for issue in issues if issue.key == others[0]]
+    assert moved[0].priority == 'Major'
+
+    # The three changed issues are refetched, and nothing else.
+    refetched = [jql for jql in jira.searched() if jql.startswith('key in')]
+    assert len(refetched) == 1
+    assert sorted(refetched[0][8:-1].split(', ')) == sorted(
+        [majors[0], others[0], others[1]])
+    assert fetcher.profiler.counters['changelogs_reused'] == 0
+
+
+def test_offline_runs_use_the_cache_only(jira, cache):
+    run(jira, cache).search(SEARCH)
+    issues = run(jira, cache, offline=True).search(SEARCH)
+    assert [issue.key for issue in issues] == expected(jira)
+    assert jira.searched() == []
+    with pytest.raises(Exception) as error:
+        run(jira, cache, offline=True).search('PROJECT = P')
+    assert 'has not been cached yet' in str(error.value)
+
+
+def test_facts_are_stored_with_the_issues(jira, cache):
+    run(jira, cache).search(SEARCH)
+    keys = expected(jira)
+    assert sorted(cache.load_facts(keys)) == sorted(keys)
+
+    table = run(jira, cache, offline=True).search(SEARCH)[0].table
+    derived = IssueTable().extend([jira.issues[key] for key in keys])[0].table
+    for column in ('cycle_starts', 'visit_issues', 'visit_statuses',
+                   'visit_entries', 'visit_exits'):
+        assert getattr(table, column) == getattr(derived, column)
+
+
+def test_facts_stand_in_for_the_transitions(jira):
+    raws = list(jira.issues.values())
+    facts = dict((raw['key'], raw_facts(raw)) for raw in raws)
+    table = IssueTable()
+    table.keep_transitions = False
+    table.extend(raws, facts)
+    derived = IssueTable().extend(raws)[0].table
+    assert len(derived.transition_timestamps) > 0
+    assert len(table.transition_timestamps) == 0
+    assert list(table.transition_offsets) == [0] * (len(raws) + 1)
+    for column in ('cycle_starts', 'visit_issues', 'visit_entries',
+                   'visit_exits'):
+        assert getattr(table, column) == getattr(derived, column)
+
+    # Issues without valid facts still get them derived.
+    stale = dict(facts[raws[0]['key']], version=0)
+    table.extend(raws[:1], {raws[0]['key']: stale})
+    assert table.cycle_starts[-1] == derived.cycle_starts[0]
+
+
+@pytest.mark.parametrize('queries, transitions', [
+    (['leadtime', 'cycletime', 'statusduration'], False),
+    (['cycletime', 'allstatusduration'], True),
+    (['cycletime', 'forecast'], True),
+    (['cfd'], True),
+])
+def test_transitions_are_kept_for_the_queries_reading_them(
+        jira, queries, transitions):
+    args = {'project': 'P', 'begin_date': '2018-03-01',
+            'end_date': '2018-06-01', 'epoch': '2018-01-01',
+            'query': queries, 'query_argument': '2018-07-01'}
+    fetcher = run(jira, MemoryIssueCache('server', 'P'))
+    fetcher.plan(build_queries(args, None))
+    assert fetcher.table.keep_transitions == transitions
+
+
+def test_deleted_issues_are_forgotten(jira, cache):
+    run(jira, cache).search(SEARCH)
+    run(jira, cache, local=True).search(SEARCH)
+    deleted = expected(jira)[0]
+    jira.remove(deleted)
+    for local in (False, True):
+        issues = run(jira, cache, local=local).search(SEARCH)
+        assert [issue.key for issue in issues] == expected(jira)
+    assert deleted not in cache.keys()
+
+
+def test_memory_caches_forget_the_least_used_searches():
+    cache = MemoryIssueCache('server', 'P', max_searches=2)
+    cache.store_search('a', ['P-1'], 1, 'synced')
+    cache.store_search('b', ['P-2'], 1, 'synced')
+    assert cache.search('a') == (['P-1'], 1, 'synced')
+    cache.store_search('c', [], 1, 'synced')
+    assert cache.stored_searches() == ['a', 'c']
+    assert cache.search('b') is None
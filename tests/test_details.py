@@ -0,0 +1,77 @@
+import csv
+import json
+import logging
+
+import pytest
+
+from mosaic.cache import CachedIssueFetcher, MemoryIssueCache
+from mosaic.details import DETAIL_COLUMNS
+from mosaic.mosaic import execute
+
+from tests.fakejira import FakeJira, generate_issues
+
+
+log = logging.getLogger('mosaic.tests')
+
+ARGS = {
+    'project': 'P',
+    'begin_date': '2018-03-01',
+    'end_date': '2018-06-01',
+    'epoch': '2018-01-01',
+    'query': ['leadtime', 'cycletime', 'statusduration'],
+    'query_argument': 'Review',
+    'end_state': 'Done',
+}
+
+
+def read_csv(path):
+    with open(path, newline='') as details:
+        rows = list(csv.DictReader(details))
+    for row in rows:
+        row['value'] = float(row['value']) if row['value'] else None
+    return rows
+
+
+def read_jsonl(path):
+    with open(path) as details:
+        return [json.loads(line) for line in details]
+
+
+@pytest.fixture(scope='module')
+def exports(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('details')
+    cache = MemoryIssueCache('server', 'P')
+    exports = {}
+    with FakeJira(generate_issues(300, seed=5)) as jira:
+        jira.searches['PROJECT = P'] = lambda issue: True
+        for details_format, read in (('csv', read_csv),
+                                     ('jsonl', read_jsonl)):
+            path = str(directory / ('details.' + details_format))
+            fetcher = CachedIssueFetcher(jira.client(), log, cache,
+                                         local=True)
+            queries = execute(dict(ARGS, details=path,
+                                   details_format=details_format),
+                              fetcher=fetcher)
+            exports[details_format] = queries, read(path)
+    return exports
+
+
+def test_formats_hold_the_same_rows(exports):
+    csv_rows, jsonl_rows = exports['csv'][1], exports['jsonl'][1]
+    assert len(csv_rows) > 50
+    assert all(sorted(row) == sorted(DETAIL_COLUMNS) for row in jsonl_rows)
+    assert csv_rows == jsonl_rows
+
+
+@pytest.mark.parametrize('details_format', ['csv', 'jsonl'])
+def test_details_add_up_to_the_reports(exports, details_format):
+    queries, rows = exports[details_format]
+    for query in queries:
+        report, = query.results_report
+        values = [row['value'] for row in rows
+                  if row['query'] == query.query_name and
+                  row['value'] is not None]
+        assert all(row['begin_date'] == ARGS['begin_date'] and
+                   row['end_date'] == ARGS['end_date'] for row in rows)
+        assert len(values) == report['count']
+        assert sum(values) / len(values) == pytest.approx(report['value'])
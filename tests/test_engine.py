@@ -0,0 +1,286 @@
+import datetime
+import math
+
+import pytest
+
+from mosaic import engine
+from mosaic.issues import IssueTable
+from mosaic.mosaic import build_queries
+from mosaic.timestamps import date_timestamp, to_timestamp
+
+from tests.fakejira import generate_issues, make_issue
+
+
+# The metrics as the queries computed them before the engine, walking each
+# issue's changelog with the string dates of the search results.
+
+EPOCH = datetime.date(2018, 3, 1)
+
+
+def date_difference(later_date, earlier_date, epoch):
+    try:
+        date_format = '%Y-%m-%dT%H:%M:%S'
+        later = datetime.datetime.strptime(later_date[0:19], date_format)
+        earlier = datetime.datetime.strptime(earlier_date[0:19], date_format)
+        if later.date() < epoch:
+            return float('-inf')
+        return (later - earlier).total_seconds() / float(60 * 60 * 24)
+    except ValueError:
+        date_format = '%Y-%m-%d'
+        later = datetime.datetime.strptime(later_date[0:10], date_format)
+        earlier = datetime.datetime.strptime(earlier_date[0:10], date_format)
+        if later.date() < epoch:
+            return float('-inf')
+        return (later - earlier).days
+
+
+def status_items(raw):
+    for history in raw['changelog']['histories']:
+        for item in history['items']:
+            if item['field'] == 'status':
+                yield item['fromString'], item['toString'], history['created']
+
+
+def lead_time(raw):
+    fields = raw['fields']
+    if fields['resolutiondate'] is None:
+        return None
+    return date_difference(fields['resolutiondate'], fields['created'], EPOCH)
+
+
+def cycle_start(raw):
+    start_date = None
+    for from_status, to_status, created in status_items(raw):
+        if from_status == 'To Do' and to_status != 'Next':
+            start_date = created
+        elif from_status == 'Next' and to_status != 'To Do':
+            start_date = created
+    return start_date
+
+
+def cycle_time(raw):
+    start_date = cycle_start(raw)
+    if start_date is None or raw['fields']['resolutiondate'] is None:
+        return None
+    return date_difference(raw['fields']['resolutiondate'], start_date, EPOCH)
+
+
+def time_in_status(raw, target_status, period_end):
+    transitions = list(status_items(raw))
+    begin_date = end_date = None
+    for _, to_status, created in transitions:
+        if to_status == target_status:
+            begin_date = created
+            break
+    if not begin_date:
+        return -1
+    for from_status, _, created in reversed(transitions):
+        if from_status == target_status:
+            end_date = created
+            break
+    if not end_date or end_date > period_end:
+        end_date = period_end
+    return date_difference(end_date, begin_date, EPOCH)
+
+
+# The days an issue spent in each status between two timestamps, from its
+# creation to its first transition and from every transition to the next.
+# Issues which never transitioned are not timed at all.
+def times_in_statuses(raw, begin, end):
+    transitions = list(status_items(raw))
+    if not transitions:
+        return {}
+    visits = [(transitions[0][0], raw['fields']['created'],
+               transitions[0][2])]
+    for position, (_, to_status, created) in enumerate(transitions):
+        following = transitions[position + 1:]
+        visits.append((to_status, created,
+                       following[0][2] if following else None))
+    durations = {}
+    for status, entered, left in visits:
+        entered = min(max(to_timestamp(entered), begin), end)
+        left = end if left is None else min(max(to_timestamp(left), begin),
+                                            end)
+        durations[status] = durations.get(status, 0) + max(
+            left - entered, 0) / float(60 * 60 * 24)
+    return durations
+
+
+# The status of an issue at a moment, or None before it was created.
+def status_at(raw, moment):
+    if to_timestamp(raw['fields']['created']) >= moment:
+        return None
+    transitions = list(status_items(raw))
+    if not transitions:
+        return raw['fields']['status']['name']
+    status = transitions[0][0]
+    for _, to_status, created in transitions:
+        if to_timestamp(created) < moment:
+            status = to_status
+    return status
+
+
+@pytest.fixture(scope='module')
+def raws():
+    return generate_issues(500, seed=7)
+
+
+@pytest.fixture(scope='module')
+def issues(raws):
+    return IssueTable().extend(raws)
+
+
+def assert_matches(values, expected):
+    assert len(values) == len(expected)
+    for value, reference in zip(values.tolist(), expected):
+        if reference is None:
+            assert math.isnan(value)
+        else:
+            assert value == pytest.approx(reference, abs=1e-9)
+
+
+def test_lead_times(raws, issues):
+    assert_matches(engine.lead_times(issues, date_timestamp(EPOCH)),
+                   [lead_time(raw) for raw in raws])
+
+
+def test_cycle_times(raws, issues):
+    starts = engine.cycle_start_dates(issues).tolist()
+    for raw, start in zip(raws, starts):
+        reference = cycle_start(raw)
+        if reference is None:
+            assert start == engine.MISSING
+        else:
+            assert start == to_timestamp(reference)
+    assert_matches(engine.cycle_times(issues, date_timestamp(EPOCH)),
+                   [cycle_time(raw) for raw in raws])
+
+
+@pytest.mark.parametrize('status', ['Next', 'In Progress', 'Review', 'Done'])
+@pytest.mark.parametrize('period_end', ['2018-06-01', '2019-01-01'])
+def test_times_in_status(raws, issues, status, period_end):
+    durations = engine.times_in_status(issues, status,
+                                       to_timestamp(period_end),
+                                       date_timestamp(EPOCH))
+    assert_matches(durations, [time_in_status(raw, status, period_end)
+                               for raw in raws])
+
+
+def test_issue_subsets_keep_their_order(raws, issues):
+    subset = issues[::-3]
+    assert_matches(engine.lead_times(subset, date_timestamp(EPOCH)),
+                   [lead_time(raw) for raw in raws[::-3]])
+
+
+PERIOD = ('2018-03-01', '2018-06-01')
+
+
+def test_times_in_statuses(raws, issues):
+    begin, end = [to_timestamp(date) for date in PERIOD]
+    durations = engine.times_in_statuses(issues, begin, end)
+    statuses = issues[0].table.statuses
+    for raw, row in zip(raws, durations.tolist()):
+        expected = times_in_statuses(raw, begin, end)
+        for code, status in enumerate(statuses):
+            assert row[code] == pytest.approx(expected.get(status, 0),
+                                              abs=1e-9)
+
+
+def test_all_status_durations_are_reported(raws, issues):
+    args = {'project': 'P', 'begin_date': PERIOD[0], 'end_date': PERIOD[1],
+            'epoch': '2018-01-01', 'query': ['allstatusduration'],
+            'query_argument': None, 'end_state': 'Done'}
+    query, = build_queries(args, None)
+    query.results = {'statusduration': issues}
+    query.build_results()
+    rows = dict((row['qualifier'], (row['count'], row['value']))
+                for row in query.results_report)
+
+    begin, end = [to_timestamp(date) for date in PERIOD]
+    timed = {}
+    for raw in raws:
+        for status, days in times_in_statuses(raw, begin, end).items():
+            if days > 0 and status != 'Done':
+                timed.setdefault(status, []).append(days)
+    assert sorted(rows) == sorted(timed)
+    for status, durations in timed.items():
+        assert rows[status][0] == len(durations)
+        assert rows[status][1] == pytest.approx(
+            sum(durations) / len(durations))
+
+
+def test_daily_status_counts(raws, issues):
+    begin, end = [to_timestamp(date) for date in PERIOD]
+    counts = engine.daily_status_counts(issues, begin, end).tolist()
+    statuses = issues[0].table.statuses
+    assert len(counts) == 92
+    for day, row in enumerate(counts):
+        moment = begin + (day + 1) * 60 * 60 * 24
+        expected = [0] * len(statuses)
+        for raw in raws:
+            status = status_at(raw, moment)
+            if status is not None:
+                expected[statuses.index(status)] += 1
+        assert row == expected
+
+
+def cfd_report(issues):
+    args = {'project': 'P', 'begin_date': PERIOD[0], 'end_date': PERIOD[1],
+            'epoch': '2018-01-01', 'query': ['cfd'], 'query_argument': None,
+            'end_state': 'Done'}
+    query, = build_queries(args, None)
+    query.results = {'cfd': issues}
+    query.build_results()
+    return query.results_report
+
+
+def test_cfd_reports_the_statuses_of_its_issues():
+    created = datetime.datetime(2018, 2, 1)
+    started = datetime.datetime(2018, 3, 10)
+    raws = [make_issue('P-1', created, [(started, 'To Do', 'In Progress')]),
+            make_issue('P-2', created, []),
+            make_issue('P-3', created, [(started, 'To Do', 'Next')])]
+    # The table holds the issues of another query too.
+    issues = IssueTable().extend(raws)[:2]
+    assert issues[0].table.statuses.count('Next') == 1
+    assert engine.statuses_seen(issues).tolist() == sorted(
+        issues[0].table.statuses.index(status)
+        for status in ('To Do', 'In Progress'))
+
+    report = cfd_report(issues)
+    assert set(row['qualifier'] for row in report) == set(
+        ['To Do', 'In Progress'])
+    first, last = report[:2], report[-2:]
+    assert dict((row['qualifier'], row['value']) for row in first) == {
+        'To Do': 2, 'In Progress': 0}
+    assert dict((row['qualifier'], row['value']) for row in last) == {
+        'To Do': 1, 'In Progress': 1}
+
+
+def test_rolling_cycle_times_skip_issues_never_started():
+    created = datetime.datetime(2018, 2, 1)
+    in_progress = {'name': 'In Progress',
+                   'statusCategory': {'name': 'In Progress'}}
+    raws = [make_issue('P-1', created,
+                       [(datetime.datetime(2018, 2, 3), 'To Do',
+                         'In Progress'),
+                        (datetime.datetime(2018, 2, 5), 'In Progress',
+                         'Done')]),
+            make_issue('P-2', created,
+                       [(datetime.datetime(2018, 2, 5), 'To Do',
+                         'In Progress')]),
+            # Created straight into an in progress status.
+            make_issue('P-3', created, [], status=in_progress)]
+    table = IssueTable().extend(raws)
+    args = {'project': 'P', 'begin_date': '2018-01-01',
+            'end_date': str(datetime.date.today()), 'epoch': '2018-01-01',
+            'query': ['cycletime'], 'query_argument': None,
+            'end_state': 'Done', 'rolling': True}
+    query, = build_queries(args, None)
+    query.results = {'cycletime': table[:1], 'cycletime_rolling': table[1:]}
+    query.build_results()
+    row, = query.results_report
+    assert row['count'] == 2
+    today = datetime.date.today()
+    assert row['value'] == pytest.approx(
+        (2 + (today - datetime.date(2018, 2, 5)).days) / 2.0)
@@ -0,0 +1,112 @@
+import datetime
+import logging
+
+from mosaic.cache import CachedIssueFetcher, MemoryIssueCache
+from mosaic.epics import EpicResolver
+from mosaic.fetch import IssueFetcher, normalize_jql
+from mosaic.issues import UNASSIGNED
+from mosaic.mosaic import build_queries, execute
+
+from tests.fakejira import EPIC_FIELD, FakeJira, generate_issues, make_issue
+
+
+log = logging.getLogger('mosaic.tests')
+
+
+def issues():
+    epic = make_issue('E-1', datetime.datetime(2017, 12, 1), [],
+                      summary='First epic')
+    return [epic] + generate_issues(100)
+
+
+def lookups(jira):
+    return [params for path, params in jira.requests
+            if params.get('jql', '').startswith('key in')]
+
+
+def test_unknown_epics_are_not_found():
+    with FakeJira(issues()) as jira:
+        resolver = EpicResolver(IssueFetcher(jira.client(), log), log)
+        epics = resolver.resolve(['E-1', 'E-2', UNASSIGNED, 'E-1'])
+        assert epics['E-1']['summary'] == 'First epic'
+        assert epics['E-1']['status'] == 'To Do'
+        assert epics['E-2'] is None
+        assert UNASSIGNED not in epics
+        assert [params['validateQuery'] for params in lookups(jira)] == [
+            'False']
+
+        # Epics are looked up once per run.
+        resolver.resolve(['E-1', 'E-2'])
+        assert len(lookups(jira)) == 2
+
+
+def test_lookups_are_reused_until_they_expire():
+    cache = MemoryIssueCache('server', 'P')
+    with FakeJira(issues()) as jira:
+        fetcher = CachedIssueFetcher(jira.client(), log, cache)
+        EpicResolver(fetcher, log).resolve(['E-1'])
+        EpicResolver(fetcher, log).resolve(['E-1'])
+        assert len(lookups(jira)) == 1
+        EpicResolver(fetcher, log, ttl=-1).resolve(['E-1'])
+        assert len(lookups(jira)) == 2
+        epics = EpicResolver(fetcher, log, ttl=-1, offline=True).resolve(
+            ['E-1'])
+        assert epics['E-1']['summary'] == 'First epic'
+        assert len(lookups(jira)) == 2
+
+
+def test_reports_name_the_epics():
+    args = {
+        'project': 'P',
+        'begin_date': '2018-01-01',
+        'end_date': '2019-01-01',
+        'epoch': '2017-01-01',
+        'query': ['leadtimebyepic'],
+        'query_argument': None,
+        'resolve_epics': True,
+    }
+    with FakeJira(issues()) as jira:
+        for query in build_queries(args, None):
+            for jql in query.queries.values():
+                jira.searches[normalize_jql(jql)] = (
+                    lambda issue: issue['fields']['resolutiondate'])
+        query, = execute(args, client=jira.client())
+    summaries = dict((row['qualifier'], row['epic_summary'])
+                     for row in query.results_report)
+    assert summaries == {'E-1': 'First epic', 'E-2': 'not found',
+                         UNASSIGNED: 'no epic'}
+
+
+def test_epic_lead_times_follow_links_and_parents():
+    created = datetime.datetime(2018, 2, 1)
+    raws = [
+        make_issue('E-1', datetime.datetime(2018, 1, 1), []),
+        make_issue('P-1', created,
+                   [(datetime.datetime(2018, 3, 2), 'To Do', 'Done')],
+                   **{EPIC_FIELD: 'E-1'}),
+        make_issue('P-2', created,
+                   [(datetime.datetime(2018, 3, 11), 'To Do', 'Done')],
+                   parent={'key': 'E-1', 'fields': {'summary': 'First'}}),
+        make_issue('P-3', created,
+                   [(datetime.datetime(2018, 3, 5), 'To Do', 'Done')],
+                   parent={'key': 'P-2'}),
+    ]
+    args = {
+        'project': 'P',
+        'begin_date': '2018-03-01',
+        'end_date': '2018-04-01',
+        'epoch': '2018-01-01',
+        'query': ['epicleadtime'],
+        'query_argument': None,
+    }
+    with FakeJira(raws) as jira:
+        for query in build_queries(args, None):
+            for jql in query.queries.values():
+                jira.searches[normalize_jql(jql)] = (
+                    lambda issue: issue['fields']['resolutiondate'])
+        query, = execute(args, client=jira.client())
+    # Sub-tasks and the issues of team-managed projects name their parent
+    # rather than an epic link.
+    assert query.result == {'E-1': 69.0, 'P-2': 32.0}
+    assert dict((row['qualifier'], row['count'])
+                for row in query.results_report) == {'E-1': 2, 'P-2': 1}
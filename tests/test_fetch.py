@@ -0,0 +1,175 @@
+import datetime
+import json
+import logging
+
+import pytest
+
+from mosaic import fetch
+from mosaic.fetch import IssueFetcher, iter_pages, normalize_jql
+from mosaic.jql import IssueIndex, parse_jql
+from mosaic.mosaic import build_queries, execute
+
+from tests.fakejira import FakeJira, generate_issues, make_issue
+
+
+log = logging.getLogger('mosaic.tests')
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(fetch, 'RETRY_BACKOFF', 0.0)
+
+
+@pytest.fixture
+def jira():
+    with FakeJira(generate_issues(250), max_results=40) as fake:
+        fake.searches['PROJECT = P'] = lambda issue: True
+        yield fake
+
+
+def keys(pages):
+    return [issue['key'] for page in pages for issue in page]
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_pages_are_yielded_in_order(jira, workers):
+    pages = list(iter_pages(jira.client(), 'PROJECT = P', log,
+                            workers=workers, page_size=100))
+    # The server caps the page size at 40, the rest of the pages are laid
+    # out using the size it returned.
+    assert [len(page) for page in pages] == [40] * 6 + [10]
+    assert keys(pages) == list(jira.issues)
+    starts = sorted(int(params['startAt']) for _, params in jira.requests)
+    assert starts == list(range(0, 250, 40))
+
+
+def test_rate_limited_pages_are_retried(jira):
+    jira.fail(429, retry_after=0)
+    jira.fail(503)
+    pages = list(iter_pages(jira.client(), 'PROJECT = P', log, workers=1))
+    assert keys(pages) == list(jira.issues)
+    assert len(jira.searched()) == 7 + 2
+
+
+def test_retries_give_up(jira):
+    for _ in range(3):
+        jira.fail(429, retry_after=0)
+    with pytest.raises(Exception) as error:
+        list(iter_pages(jira.client(), 'PROJECT = P', log, retries=2))
+    assert error.value.status_code == 429
+    assert len(jira.searched()) == 3
+
+
+def test_client_errors_are_not_retried(jira):
+    with pytest.raises(Exception) as error:
+        list(iter_pages(jira.client(), 'PROJECT = Q', log))
+    assert error.value.status_code == 400
+    assert len(jira.searched()) == 1
+
+
+class Query(object):
+    needs_transitions = False
+
+    def __init__(self, queries, fields=None, needs_changelog=True):
+        self.queries = queries
+        self.fields = fields
+        self.needs_changelog = needs_changelog
+
+    def group_fields(self):
+        return []
+
+
+def test_identical_searches_are_sent_once(jira):
+    fetcher = IssueFetcher(jira.client(), log)
+    fetcher.plan([Query({'a': 'PROJECT = P'}, ['created']),
+                  Query({'b': 'PROJECT  =  P '}, ['resolutiondate'],
+                        needs_changelog=False)])
+    first = fetcher.fetch('PROJECT = P')
+    second = fetcher.fetch('PROJECT  =  P ')
+    assert first is second
+    assert [issue.key for issue in first] == list(jira.issues)
+    assert jira.searched() == ['PROJECT = P'] * 7
+    # The search asks for the fields and changelog of both queries.
+    params = jira.requests[0][1]
+    assert params['fields'] == 'created,resolutiondate'
+    assert params['expand'] == 'changelog'
+
+
+def test_priority_searches_are_derived_locally(jira):
+    fetcher = IssueFetcher(jira.client(), log)
+    fetcher.plan([Query({'all': 'PROJECT = P'}, ['created']),
+                  Query({'major': 'PROJECT = P AND priority in (Major)'},
+                        ['created'])])
+    major = fetcher.fetch('PROJECT = P AND priority in (Major)')
+    expected = [issue['key'] for issue in jira.issues.values()
+                if issue['fields']['priority']['name'] == 'Major']
+    assert [issue.key for issue in major] == expected
+    assert set(jira.searched()) == set(['PROJECT = P'])
+    assert 'priority' in jira.requests[0][1]['fields'].split(',')
+
+
+def test_searches_without_fields_ask_for_the_key(jira):
+    fetcher = IssueFetcher(jira.client(), log)
+    fetcher.plan([Query({'a': 'PROJECT = P'}, [])])
+    issues = fetcher.fetch('PROJECT = P')
+    assert len(issues) == 250
+    assert jira.requests[0][1]['fields'] == 'key'
+
+
+# Every streaming query, with the argument it needs if any.
+STREAMING = [('throughput', None), ('throughputbyepic', None),
+             ('leadtime', None), ('leadtimebyepic', None),
+             ('epicleadtime', None), ('cycletime', None),
+             ('prioritycycletime', 'Major'), ('statusduration', 'Review'),
+             ('allstatusduration', None), ('cfd', None), ('forecast', '20')]
+
+
+# Whether an issue matches the cfd search, whose created and BEFORE clauses
+# are outside the local JQL subset.
+def in_cfd(issue, args):
+    if issue['fields']['created'] >= args['end_date']:
+        return False
+    return not any(item['toString'] == args['end_state'] and
+                   history['created'] < args['begin_date']
+                   for history in issue['changelog']['histories']
+                   for item in history['items'])
+
+
+@pytest.mark.parametrize('query, argument', STREAMING)
+def test_streamed_reports_match_the_materialized_ones(jira, query, argument):
+    args = {
+        'project': 'P',
+        'begin_date': '2018-03-01',
+        'end_date': '2018-06-01',
+        'epoch': '2018-01-01',
+        'query': [query],
+        'query_argument': argument,
+        'end_state': 'Done',
+        'percentiles': '50,85',
+        'forecast_seed': 1,
+        'page_size': 30,
+    }
+    for key in ('E-1', 'E-2'):
+        jira.update(make_issue(key, datetime.datetime(2017, 12, 1), [],
+                               summary='Epic ' + key))
+    # The fake JIRA server answers the searches from an index of its
+    # issues.
+    index = IssueIndex('P', list(jira.issues.values()))
+    for built in build_queries(args, None):
+        for jql in built.queries.values():
+            clauses = parse_jql(jql)
+            if clauses is None:
+                jira.searches[normalize_jql(jql)] = (
+                    lambda issue: in_cfd(issue, args))
+                continue
+            keys = set(index.evaluate(clauses))
+            jira.searches[normalize_jql(jql)] = (
+                lambda issue, keys=keys: issue['key'] in keys)
+
+    reports = []
+    for stream in (False, True):
+        queries = execute(dict(args, stream=stream), client=jira.client())
+        reports.append(json.dumps([built.results_report
+                                   for built in queries], sort_keys=True))
+    assert reports[0] == reports[1]
+    assert reports[0] != '[[]]'
@@ -0,0 +1,95 @@
+import math
+
+import numpy
+import pytest
+
+from mosaic import forecast
+from mosaic.issues import IssueTable
+from mosaic.mosaic import build_queries
+from mosaic.timestamps import SECONDS_PER_DAY, to_timestamp
+
+from tests.fakejira import generate_issues
+
+
+BEGIN = to_timestamp('2018-03-01')
+
+
+def test_daily_throughput_counts_every_day():
+    timestamps = [BEGIN - 1, BEGIN, BEGIN + 10, BEGIN + 2 * SECONDS_PER_DAY,
+                  BEGIN + 4 * SECONDS_PER_DAY]
+    daily = forecast.daily_throughput(timestamps, BEGIN,
+                                      BEGIN + 4 * SECONDS_PER_DAY)
+    assert daily.tolist() == [2, 0, 1, 0]
+
+
+@pytest.mark.parametrize('block_samples', [forecast.BLOCK_SAMPLES, 7])
+def test_constant_throughput_is_forecast_exactly(monkeypatch, block_samples):
+    monkeypatch.setattr(forecast, 'BLOCK_SAMPLES', block_samples)
+    daily = numpy.array([2, 2])
+    rng = forecast.generator(0)
+    assert forecast.simulate_totals(daily, 5, 20, rng).tolist() == [10] * 20
+    assert forecast.simulate_totals(daily, 0, 3, rng).tolist() == [0] * 3
+    assert forecast.simulate_days(daily, 7, 20, rng).tolist() == [4] * 20
+    assert forecast.simulate_days(daily, 0, 3, rng).tolist() == [0] * 3
+    assert forecast.simulate_days(daily, 7, 3, rng, max_days=3).tolist() == (
+        [float('inf')] * 3)
+    assert forecast.simulate_days(numpy.array([0, 0]), 1, 3,
+                                  rng).tolist() == [float('inf')] * 3
+
+
+def test_blocks_do_not_change_the_totals(monkeypatch):
+    daily = numpy.array([0, 1, 2, 5])
+    whole = forecast.simulate_totals(daily, 30, 100, forecast.generator(3))
+    monkeypatch.setattr(forecast, 'BLOCK_SAMPLES', 100)
+    blocked = forecast.simulate_totals(daily, 30, 100, forecast.generator(3))
+    assert blocked.tolist() == whole.tolist()
+
+
+def test_forecasts_follow_the_sampled_throughput():
+    daily = numpy.array([0, 1, 2])
+    totals = forecast.simulate_totals(daily, 30, 20000,
+                                      forecast.generator(1))
+    assert totals.mean() == pytest.approx(30, abs=0.2)
+    days = forecast.simulate_days(daily, 30, 20000, forecast.generator(1))
+    assert days.mean() == pytest.approx(30.5, abs=0.5)
+
+
+def test_confidence_levels():
+    values = numpy.arange(101)
+    assert forecast.at_least(values, 85) == 15
+    assert forecast.within(values, 85) == 85
+    assert math.isinf(forecast.within(numpy.array([1, numpy.inf]), 95))
+
+
+@pytest.fixture(scope='module')
+def issues():
+    return IssueTable().extend(generate_issues(300, seed=2))
+
+
+def forecast_report(issues, argument):
+    args = {'project': 'P', 'begin_date': '2018-03-01',
+            'end_date': '2018-06-01', 'epoch': '2018-01-01',
+            'query': ['forecast'], 'query_argument': argument,
+            'end_state': 'Done', 'percentiles': '50,85,95',
+            'forecast_trials': 2000, 'forecast_seed': 4}
+    query, = build_queries(args, None)
+    query.results = {'throughput': issues}
+    query.build_results()
+    return query.results_report
+
+
+def test_forecast_reports(issues):
+    items = forecast_report(issues, '2018-07-01')
+    assert [row['qualifier'] for row in items] == ['50%', '85%', '95%']
+    assert all(row['begin_date'] == '2018-06-01' and
+               row['end_date'] == '2018-07-01' for row in items)
+    values = [row['value'] for row in items]
+    assert values == sorted(values, reverse=True)
+    assert values[0] > 0
+
+    days = forecast_report(issues, '40')
+    values = [row['value'] for row in days]
+    assert values == sorted(values)
+    assert days[0]['items'] == 40
+    assert days[0]['end_date'] > '2018-06-01'
+    assert forecast_report(issues, '40') == days
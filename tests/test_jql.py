@@ -0,0 +1,142 @@
+import copy
+import logging
+import random
+
+import pytest
+
+from mosaic.cache import CachedIssueFetcher, MemoryIssueCache
+from mosaic.issues import field_name, status_changes
+from mosaic.jql import IssueIndex, parse_jql
+from mosaic.profiling import Profiler
+from mosaic.timestamps import to_timestamp
+
+from tests.fakejira import FakeJira, generate_issues
+
+
+log = logging.getLogger('mosaic.tests')
+
+
+# The issues a search matches, by checking every clause against every issue.
+def scan(raws, begin, end, types=None, category=None, priorities=None,
+         status='Done', labels=None):
+    keys = []
+    for raw in raws:
+        fields = raw['fields']
+        if types and fields['issuetype']['name'].lower() not in types:
+            continue
+        if category and (fields['status']['statusCategory']['name'] !=
+                         category):
+            continue
+        if priorities and fields['priority']['name'] not in priorities:
+            continue
+        if labels and not set(labels) & set(fields['labels']):
+            continue
+        if not any(to_status == status and begin <= timestamp < end
+                   for _, to_status, timestamp in status_changes(raw)):
+            continue
+        keys.append(raw['key'])
+    return keys
+
+
+@pytest.fixture(scope='module')
+def raws():
+    return generate_issues(400, seed=3)
+
+
+@pytest.fixture
+def index(raws):
+    return IssueIndex('P', raws)
+
+
+def evaluate(index, jql):
+    return index.evaluate(parse_jql(jql))
+
+
+def test_searches_match_a_scan(raws, index):
+    rnd = random.Random(5)
+    for _ in range(200):
+        begin = '2018-{0:02d}-{1:02d}'.format(rnd.randint(1, 12),
+                                              rnd.randint(1, 28))
+        end = '2019-01-{0:02d}'.format(rnd.randint(1, 28))
+        types = rnd.choice([['bug'], ['story'], ['bug', 'task']])
+        category = rnd.choice([None, 'Done', 'In Progress'])
+        priorities = rnd.choice([None, ['Major'], ['Blocker', 'Minor']])
+        labels = rnd.choice([None, ['docs'], ['backend', 'frontend']])
+        status = rnd.choice(['Done', 'Review', 'In Progress'])
+        jql = 'PROJECT = P AND TYPE IN ({0})'.format(', '.join(types))
+        if category:
+            jql += ' AND statusCategory = "{0}"'.format(category)
+        if priorities:
+            jql += ' AND priority in ({0})'.format(', '.join(priorities))
+        if labels:
+            jql += ' AND labels in ({0})'.format(', '.join(labels))
+        jql += ' AND status CHANGED TO "{0}" DURING("{1}", "{2}")'.format(
+            status, begin, end)
+        assert evaluate(index, jql) == scan(
+            raws, to_timestamp(begin), to_timestamp(end), types, category,
+            priorities, status, labels), jql
+
+
+def test_before_and_not_changed(raws, index):
+    jql = ('PROJECT = P AND status CHANGED TO "Review" BEFORE "2018-06-01" '
+           'AND NOT status CHANGED TO Done BEFORE "2018-03-01"')
+    done_early = set(scan(raws, 0, to_timestamp('2018-03-01')))
+    expected = [key for key in scan(raws, 0, to_timestamp('2018-06-01'),
+                                    status='Review')
+                if key not in done_early]
+    assert evaluate(index, jql) == expected
+
+
+def test_searches_leave_the_index_unchanged(raws, index):
+    done = 'PROJECT = P AND statusCategory = Done'
+    everything = evaluate(index, done)
+    bugs = evaluate(index, done + ' AND type = Bug')
+    assert len(bugs) < len(everything)
+    assert evaluate(index, done) == everything
+    assert evaluate(index, 'PROJECT = P AND priority = Major') == [
+        raw['key'] for raw in raws
+        if field_name(raw['fields']['priority']) == 'Major']
+
+
+def test_other_searches_are_left_to_jira(raws, index):
+    assert parse_jql('PROJECT = P AND assignee = bob') is None
+    assert parse_jql('PROJECT = P OR type = Bug') is None
+    assert evaluate(index, 'type = Bug') is None
+    assert evaluate(index, 'PROJECT = Q AND type = Bug') == []
+    uncategorized = copy.deepcopy(raws[0])
+    del uncategorized['fields']['status']['statusCategory']
+    index = IssueIndex('P', [uncategorized] + raws[1:])
+    assert evaluate(index, 'PROJECT = P AND statusCategory = Done') is None
+
+
+def test_fetcher_answers_searches_locally():
+    raws = generate_issues(300, seed=11)
+    cycle_time = ('PROJECT = P AND TYPE IN ("bug","story") AND '
+                  'statusCategory = Done AND status CHANGED TO Done '
+                  'DURING("2018-03-01", "2018-09-01")')
+    with FakeJira(raws, max_results=100) as jira:
+        jira.searches['PROJECT = P'] = lambda issue: True
+        cache = MemoryIssueCache('server', 'P')
+        fetcher = CachedIssueFetcher(jira.client(), log, cache, local=True,
+                                     profiler=Profiler())
+        issues = fetcher.search(cycle_time)
+        assert [issue.key for issue in issues] == scan(
+            raws, to_timestamp('2018-03-01'), to_timestamp('2018-09-01'),
+            ['bug', 'story'], 'Done')
+        assert fetcher.profiler.counters['local_searches'] == 1
+
+        # Later searches, in this run or the next, only refresh the
+        # snapshot of the project: the issues updated since the last
+        # refresh, and the keys of all of them to find the deleted ones.
+        del jira.requests[:]
+        fetcher = CachedIssueFetcher(jira.client(), log, cache, local=True,
+                                     profiler=Profiler())
+        issues = fetcher.search(cycle_time.replace('"bug","story"', '"task"'))
+        assert [issue.key for issue in issues] == scan(
+            raws, to_timestamp('2018-03-01'), to_timestamp('2018-09-01'),
+            ['task'], 'Done')
+        searched = set(jira.searched())
+        assert len(searched) == 2
+        assert 'PROJECT = P' in searched
+        assert all('updated >= ' in jql for jql in searched
+                   if jql != 'PROJECT = P')
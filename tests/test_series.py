@@ -0,0 +1,70 @@
+import json
+import logging
+
+import pytest
+
+from mosaic.cache import CachedIssueFetcher, MemoryIssueCache
+from mosaic.mosaic import build_queries, execute
+from mosaic.series import series_periods
+
+from tests.fakejira import FakeJira, generate_issues
+
+
+log = logging.getLogger('mosaic.tests')
+
+ARGS = {
+    'project': 'P',
+    'begin_date': '2018-02-01',
+    'end_date': '2018-08-01',
+    'epoch': '2018-01-01',
+    'query': ['throughput', 'leadtime', 'cycletime'],
+    'query_argument': None,
+    'end_state': 'Done',
+    'percentiles': '50,85',
+}
+
+
+# Run the queries, evaluating every search against an indexed snapshot of
+# the project so that the fake JIRA server only has to list it.
+@pytest.fixture
+def run():
+    cache = MemoryIssueCache('server', 'P')
+    with FakeJira(generate_issues(300, seed=3)) as jira:
+        jira.searches['PROJECT = P'] = lambda issue: True
+
+        def run(**args):
+            fetcher = CachedIssueFetcher(jira.client(), log, cache,
+                                         local=True)
+            return execute(dict(ARGS, **args), fetcher=fetcher)
+        yield run
+
+
+# The reports of a run, serialized so that NaN values compare equal.
+def reports(queries):
+    return json.dumps(dict((query.query_name, query.results_report)
+                           for query in queries), sort_keys=True)
+
+
+def test_series_match_a_run_per_period(run):
+    periods = series_periods(ARGS['begin_date'], ARGS['end_date'], 4)
+    assert len(periods) > 6
+    expected = dict((name, []) for name in ARGS['query'])
+    for begin_date, end_date in periods:
+        for query in run(begin_date=begin_date, end_date=end_date):
+            expected[query.query_name].extend(query.results_report)
+    assert reports(run(series=4)) == json.dumps(expected, sort_keys=True)
+
+
+@pytest.mark.parametrize('options', [{}, {'window': 30}])
+def test_series_need_a_period(options):
+    args = dict(ARGS, series=4, begin_date='2018-08-01', **options)
+    with pytest.raises(Exception) as error:
+        build_queries(args, None)
+    assert 'begin date before the end date' in str(error.value)
+
+
+def test_cfd_does_not_report_series():
+    args = dict(ARGS, series=4, query=['throughput', 'cfd'])
+    with pytest.raises(Exception) as error:
+        build_queries(args, None)
+    assert 'does not support the series argument' in str(error.value)
@@ -0,0 +1,96 @@
+import sys
+import threading
+
+import pytest
+
+from mosaic import server
+from mosaic.fetch import normalize_jql
+from mosaic.mosaic import build_parser, build_queries
+from mosaic.server import MetricsService
+
+from tests.fakejira import FakeJira, generate_issues
+
+
+@pytest.fixture
+def jira():
+    issues = generate_issues(200) + generate_issues(200, seed=1, project='Q')
+    with FakeJira(issues) as fake:
+        for project in ('P', 'Q'):
+            fake.searches['PROJECT = ' + project] = (
+                lambda issue, prefix=project + '-': issue['key'].startswith(
+                    prefix))
+        yield fake
+
+
+@pytest.fixture
+def service(jira):
+    args = vars(build_parser('').parse_args(['-s', jira.url]))
+    return MetricsService(args, client=jira.client())
+
+
+# Answer a request, registering the searches it makes with the fake JIRA
+# server first.
+def request(service, jira, **parameters):
+    parameters = dict((name, [value]) for name, value in parameters.items())
+    parameters['query'] = ['throughput', 'leadtime']
+    args = service.request_args(dict(parameters))
+    for query in build_queries(args, None):
+        for jql in query.queries.values():
+            jira.searches[normalize_jql(jql)] = jira.searches[
+                'PROJECT = ' + args['project']]
+    return service.metrics(parameters)
+
+
+DATES = {'begin_date': '2018-03-01', 'end_date': '2018-09-01',
+         'epoch': '2018-01-01'}
+
+
+def test_responses_are_kept_per_project(service, jira):
+    request(service, jira, project='P', **DATES)
+    for _ in range(3):
+        service.refresh()
+    response = request(service, jira, project='Q', **DATES)
+
+    # A response for the project with the later generation leaves the other
+    # project's responses in place.
+    request(service, jira, project='P', end_date='2018-10-01',
+            begin_date='2018-03-01', epoch='2018-01-01')
+    assert request(service, jira, project='Q', **DATES) is response
+
+
+def test_refreshes_do_not_wait_for_requests(service, jira):
+    request(service, jira, project='P', **DATES)
+    # Hold the lock as a request being computed does.
+    with service.lock:
+        refresher = threading.Thread(target=service.refresh)
+        refresher.start()
+        refresher.join(10)
+        assert not refresher.is_alive()
+    assert service.cache('P').generation == 2
+
+
+def test_searches_are_capped(service, jira):
+    service.args['max_searches'] = 2
+    for end_date in ('2018-07-01', '2018-08-01', '2018-09-01'):
+        request(service, jira, project='P', begin_date='2018-03-01',
+                end_date=end_date, epoch='2018-01-01')
+    searches = service.cache('P').stored_searches()
+    assert len(searches) == 2
+    assert all('2018-07-01' not in jql for jql in searches)
+
+
+def test_local_jql_is_evaluated_in_memory(service, jira):
+    service.args['local_jql'] = True
+    request(service, jira, project='P', **DATES)
+    searches = [jql for jql in jira.searched()
+                if not jql.startswith('key in')]
+    assert set(searches) == set(['PROJECT = P'])
+
+
+@pytest.mark.parametrize('argv', [['--details', 'details.csv'],
+                                  ['--cache-dir', 'cache'], ['--stream']])
+def test_single_run_arguments_are_rejected(monkeypatch, argv):
+    monkeypatch.setattr(sys, 'argv', ['mosaic-server', '-s', 'url'] + argv)
+    monkeypatch.setattr(server, 'MetricsService', None)
+    with pytest.raises(SystemExit):
+        server.main()
@@ -0,0 +1,89 @@
+import math
+import random
+
+import pytest
+
+from mosaic.stats import OrderStatistics, percentiles, sliding_window
+
+
+DAY = 60 * 60 * 24
+PERCENTILES = [0, 10, 50, 85, 95, 100]
+
+
+def same(first, second):
+    if math.isnan(first):
+        return math.isnan(second)
+    return first == pytest.approx(second)
+
+
+def same_percentiles(first, second):
+    return (sorted(first) == sorted(second) and
+            all(same(first[label], second[label]) for label in first))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_order_statistics_match_a_sorted_list(seed):
+    rnd = random.Random(seed)
+    # Few distinct values, so most of them are present several times.
+    universe = [rnd.randint(0, 20) * 1.5 for _ in range(30)]
+    statistics = OrderStatistics(universe)
+    reference = []
+    assert math.isnan(statistics.mean())
+    assert same_percentiles(statistics.percentiles(PERCENTILES),
+                            percentiles([], PERCENTILES))
+    for _ in range(300):
+        if reference and rnd.random() < 0.45:
+            value = rnd.choice(reference)
+            reference.remove(value)
+            statistics.remove(value)
+        else:
+            value = rnd.choice(universe)
+            reference.append(value)
+            statistics.add(value)
+        ordered = sorted(reference)
+        assert len(statistics) == len(ordered)
+        assert [statistics.kth(k) for k in range(len(ordered))] == ordered
+        if ordered:
+            assert same(statistics.mean(), sum(ordered) / len(ordered))
+        assert same_percentiles(statistics.percentiles(PERCENTILES),
+                                percentiles(ordered, PERCENTILES))
+
+
+# The statistics of a window computed from scratch: every issue with an
+# event in [end - days, end) counted once.
+def reference_window(events, end, days):
+    values = {}
+    for timestamp, key, value in events:
+        if (end - days * DAY <= timestamp < end and
+                not math.isinf(value) and not math.isnan(value)):
+            values[key] = value
+    values = sorted(values.values())
+    mean = sum(values) / len(values) if values else float('nan')
+    return len(values), mean, percentiles(values, PERCENTILES)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_sliding_windows_match_a_sorted_list(seed):
+    rnd = random.Random(seed)
+    values = dict((key, rnd.choice([1.0, 2.0, 2.0, 5.0, 8.0, float('inf'),
+                                    float('nan')]))
+                  for key in range(40))
+    # Events in two bursts with a gap between them, issues reaching the end
+    # state more than once, and events at the very edges of the windows.
+    events = []
+    for key in range(40):
+        for _ in range(rnd.randint(1, 3)):
+            day = rnd.choice([rnd.randint(0, 20), rnd.randint(60, 80)])
+            events.append((day * DAY, key, values[key]))
+    rnd.shuffle(events)
+    ends = [day * DAY for day in range(-5, 100, 3)]
+
+    windows = list(sliding_window(events, ends, 14, PERCENTILES))
+    assert len(windows) == len(ends)
+    assert any(count == 0 for count, _, _ in windows)
+    for end, (count, mean, window_percentiles) in zip(ends, windows):
+        expected_count, expected_mean, expected_percentiles = (
+            reference_window(events, end, 14))
+        assert count == expected_count
+        assert same(mean, expected_mean)
+        assert same_percentiles(window_percentiles, expected_percentiles)